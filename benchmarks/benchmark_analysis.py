@@ -0,0 +1,211 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Throughput and peak memory of the analysis stages with synthetic raw data
+    (see tjmonopix2.analysis.raw_data_generator).
+
+    Usage: python benchmark_analysis.py [--scale 1.0] [--save baseline.json] [--compare baseline.json] [stage ...]
+
+    Numba functions are compiled before the measurement. The S-curve fit always fits the full matrix
+    and takes several minutes per CPU core. Peak memory is the maximum of
+    the Python and numpy allocations during the stage (tracemalloc), numba internal
+    allocations are not included.
+'''
+
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+
+import numba
+import numpy as np
+from scipy.special import erf
+
+from tjmonopix2.analysis import analysis_utils as au
+from tjmonopix2.analysis import raw_data_generator as generator
+from tjmonopix2.analysis.analysis import Analysis
+from tjmonopix2.analysis.events import build_events
+from tjmonopix2.analysis.interpreter import RawDataInterpreter
+from tjmonopix2.analysis.plotting import Plotting
+from tjmonopix2.scans.calibrate_tot import _create_tot_avg
+
+
+def interpret(raw_data, n_scan_params=1):
+    interpreter = RawDataInterpreter(n_scan_params=n_scan_params, trigger_data_format=2)
+    hits = interpreter.interpret(raw_data, np.zeros(4 * raw_data.shape[0], dtype=au.hit_dtype), 0)
+    return hits, interpreter
+
+
+def to_cluster_hits(hits):
+    ''' Hits in clusterizer format, hits with same timestamp are one event (see Analysis.analyze_data) '''
+    hits = hits[hits['col'] < 1000]
+    cluster_hits = np.zeros(hits.shape[0], dtype=au.event_dtype)
+    cluster_hits['event_number'] = hits['timestamp']
+    cluster_hits['column'] = hits['col']
+    cluster_hits['row'] = hits['row']
+    cluster_hits['charge'] = ((hits['te'] - hits['le']) & 0x7F) + 1
+    cluster_hits['timestamp'] = hits['timestamp']
+    return cluster_hits
+
+
+class ClusterizerSetup(Analysis):
+    ''' Clusterizer of the analysis without raw data file '''
+    def __init__(self):
+        self.cluster_hits = True
+        self.tot_calib_file = None
+        self._setup_clusterizer()
+
+
+def get_clusterizer():
+    return ClusterizerSetup().clz
+
+
+class Stages(object):
+    ''' Stage name: (setup function returning the input, stage function, number of processed items, unit) '''
+
+    def __init__(self, scale=1.):
+        self.scale = scale
+
+    def n(self, value):
+        return max(int(value * self.scale), 1)
+
+    def interpret_uniform(self):
+        raw_data = generator.uniform_hits(self.n(5000000))
+        return raw_data, interpret, raw_data.shape[0], 'words'
+
+    def interpret_source(self):
+        raw_data = generator.source_hits(self.n(2000000))
+        return raw_data, interpret, raw_data.shape[0], 'words'
+
+    def interpret_triggered(self):
+        raw_data = generator.triggered_hits(self.n(2000000))
+        return raw_data, interpret, raw_data.shape[0], 'words'
+
+    def build_events(self):
+        hits, _ = interpret(generator.triggered_hits(self.n(2000000)))
+
+        def run(hits):
+            return build_events(hits.copy(), np.zeros(hits.shape[0], dtype=au.event_dtype))
+        return hits, run, hits.shape[0], 'hits'
+
+    def cluster(self):
+        hits, _ = interpret(generator.source_hits(self.n(1000000)))
+        clusterizer = get_clusterizer()
+        return to_cluster_hits(hits), clusterizer.cluster_hits, hits.shape[0], 'hits'
+
+    def interpret_injection(self):
+        n_pixels = self.n(16384)
+        pixels = (np.arange(n_pixels) // 512, np.arange(n_pixels) % 512)
+        raw_data = generator.injection_scan(np.arange(0, 60, 2), n_injections=100, pixels=pixels)
+
+        def run(raw_data):
+            interpreter = RawDataInterpreter(n_scan_params=len(raw_data))
+            for scan_param_id, words in enumerate(raw_data):
+                interpreter.interpret(words, np.zeros(4 * words.shape[0], dtype=au.hit_dtype), scan_param_id)
+            return interpreter.get_histograms()
+        return raw_data, run, sum(words.shape[0] for words in raw_data), 'words'
+
+    def fit_scurves(self):
+        ''' Fit of all 512 x 512 S-curves, n pixels are injected with threshold 30 and noise 3 '''
+        scan_params = np.arange(0, 60, 2)
+        n_pixels = self.n(512 * 512)
+        rng = np.random.default_rng(0)
+        probability = 0.5 * (1. + erf((scan_params[np.newaxis, :] - rng.normal(30., 3., size=(n_pixels, 1))) / (np.sqrt(2.) * 3.)))
+        hist_scurve = np.zeros((512 * 512, scan_params.shape[0]), dtype=np.uint32)
+        hist_scurve[:n_pixels] = rng.binomial(100, probability)
+
+        def run(hist_scurve):
+            return au.fit_scurves_multithread(hist_scurve, scan_params, n_injections=100)
+        return hist_scurve, run, 512 * 512, 'fits'
+
+    def analyze_file(self):
+        ''' Complete analysis of a synthetic source scan file (interpretation, histogramming and hit storage) '''
+        raw_data_file = os.path.join(tempfile.mkdtemp(), 'source_scan.h5')
+        n_words = generator.write_scan_file(raw_data_file, kind='source', n_words=self.n(20000000))
+
+        def run(raw_data_file):
+            with Analysis(raw_data_file=raw_data_file) as a:
+                a.analyze_data()
+        return raw_data_file, run, n_words, 'words'
+
+    def plot_file(self):
+        ''' Standard plots of an analyzed synthetic source scan file '''
+        raw_data_file = os.path.join(tempfile.mkdtemp(), 'source_scan.h5')
+        generator.write_scan_file(raw_data_file, kind='source', n_words=self.n(2000000))
+        with Analysis(raw_data_file=raw_data_file) as a:
+            a.analyze_data()
+
+        def run(analyzed_data_file):
+            with Plotting(analyzed_data_file=analyzed_data_file) as p:
+                p.create_standard_plots()
+        return a.analyzed_data_file, run, 1, 'files'
+
+    def tot_avg(self):
+        n_rows = self.n(128)
+        rng = np.random.default_rng(0)
+        hist_tot = np.zeros((512, n_rows, 4, 128), dtype=np.uint16)
+        hist_tot[..., 10:40] = rng.integers(0, 10, size=hist_tot[..., 10:40].shape, dtype=np.uint16)
+        return hist_tot, _create_tot_avg, 512 * n_rows, 'pixels'
+
+
+STAGES = ('interpret_uniform', 'interpret_source', 'interpret_triggered', 'interpret_injection', 'build_events', 'cluster', 'fit_scurves', 'tot_avg', 'analyze_file',
+          'plot_file')
+NUMBA_STAGES = ('interpret_uniform', 'interpret_source', 'interpret_triggered', 'interpret_injection', 'build_events', 'cluster', 'tot_avg', 'analyze_file')
+
+
+def benchmark(stages, name):
+    data, function, n_items, unit = getattr(stages, name)()
+    if name in NUMBA_STAGES:  # compile numba functions with a small input
+        warm_up_data, warm_up_function, _, _ = getattr(Stages(scale=1e-3), name)()
+        warm_up_function(warm_up_data)
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    function(data)
+    duration = time.perf_counter() - start
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {'seconds': duration, 'items': n_items, 'unit': unit, 'throughput': n_items / duration, 'peak_memory_mb': peak_memory / 1e6}
+
+
+def system_info():
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'numba': numba.__version__,
+            'machine': platform.machine(), 'processor': platform.processor()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('stages', nargs='*', default=STAGES, help='Stages to run, default is all: %s' % ', '.join(STAGES))
+    parser.add_argument('--scale', type=float, default=1., help='Scale factor of the data size')
+    parser.add_argument('--save', help='Save results as baseline json file')
+    parser.add_argument('--compare', help='Compare results with baseline json file')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+
+    stages = Stages(scale=args.scale)
+    results = {}
+    print('%-20s %14s %18s %14s %10s' % ('Stage', 'Time [s]', 'Throughput', 'Peak mem [MB]', 'Baseline'))
+    for name in args.stages:
+        result = benchmark(stages, name)
+        results[name] = result
+        ratio = ''
+        if baseline and name in baseline['stages']:
+            ratio = '%.2fx' % (result['throughput'] / baseline['stages'][name]['throughput'])
+        print('%-20s %14.3f %12.3g %-5s %14.1f %10s' % (name, result['seconds'], result['throughput'], result['unit'] + '/s',
+                                                        result['peak_memory_mb'], ratio))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'scale': args.scale, 'system': system_info(), 'stages': results}, f, indent=2)
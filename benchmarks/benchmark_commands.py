@@ -0,0 +1,180 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Throughput of the register and mask command generation of the chip object without hardware.
+    The commands are discarded instead of being sent to the command encoder.
+
+    Usage: python benchmark_commands.py [--scale 1.0] [--save baseline.json] [--compare baseline.json] [stage ...]
+'''
+
+import argparse
+import json
+import platform
+import time
+
+import numpy as np
+
+from tjmonopix2.system.tjmonopix2 import TJMonoPix2
+
+
+class CommandEncoder(object):
+    ''' Command encoder of the firmware that counts and discards the commands '''
+
+    def __init__(self, mem_size=4096):
+        self.mem_size = mem_size
+        self.n_bytes = 0
+
+    def get_mem_size(self):
+        return self.mem_size
+
+    def has_start_addr(self):
+        return True
+
+    def is_done(self):
+        return True
+
+    def set_data(self, data, addr=0):
+        self.n_bytes += len(data)
+
+    def set_start_addr(self, value):
+        pass
+
+    def set_size(self, value):
+        pass
+
+    def set_repetitions(self, value):
+        pass
+
+    def start(self):
+        pass
+
+
+class ReadoutSystem(dict):
+    ''' Firmware modules by name, a MagicMock adds more overhead than the command generation '''
+    board_version = 'BDAQ53'
+
+
+def get_chip():
+    ''' Chip object with a mocked readout system, commands are counted and discarded '''
+    daq = ReadoutSystem(cmd=CommandEncoder())
+    chip = TJMonoPix2(daq, config={'registers': {}})
+    chip._get_register_value = lambda address, *args, **kwargs: chip.registers.shadow[address]  # chip returns the written values
+    chip.registers.write_all(force=True)
+    daq['cmd'].n_bytes = 0
+    return chip
+
+
+class Stages(object):
+    ''' Stage name: (setup function returning the input, stage function, number of processed items, unit) '''
+
+    def __init__(self, scale=1.):
+        self.scale = scale
+
+    def n(self, value):
+        return max(int(value * self.scale), 1)
+
+    def register_write(self):
+        n_writes = self.n(100000)
+        chip = get_chip()
+
+        def run(chip):
+            register = chip.registers['VL']
+            for i in range(n_writes):
+                register.write(i & 0xFF)
+        return chip, run, n_writes, 'writes'
+
+    def register_read(self):
+        n_reads = self.n(100000)
+        chip = get_chip()
+
+        def run(chip):
+            register = chip.registers['VH']
+            for _ in range(n_reads):
+                register.read()
+        return chip, run, n_reads, 'reads'
+
+    def write_all(self):
+        n_calls = self.n(1000)
+        chip = get_chip()
+
+        def run(chip):
+            for _ in range(n_calls):
+                chip.registers.write_all(force=True)
+        return chip, run, n_calls * len(chip.registers), 'registers'
+
+    def mask_update(self):
+        ''' Write of the complete pixel matrix, e.g. at chip init '''
+        chip = get_chip()
+        n_rows = self.n(512)
+        chip.masks['enable'][:, :n_rows] = True
+
+        def run(chip):
+            chip.masks.update(force=True)
+        return chip, run, 512 * 512, 'pixels'
+
+    def mask_shift(self):
+        ''' Mask steps of an injection scan, the masks are changed by a few pixels per step '''
+        chip = get_chip()
+        chip.masks['enable'][:, :self.n(512)] = True
+        chip.masks['injection'][:] = chip.masks['enable']
+        chip.masks.update(force=True)
+        n_steps = self.n(200)
+
+        def run(chip):
+            for i, _ in enumerate(chip.masks.shift(masks=['enable', 'injection'])):
+                if i >= n_steps:
+                    break
+        return chip, run, n_steps, 'steps'
+
+
+STAGES = ('register_write', 'register_read', 'write_all', 'mask_update', 'mask_shift')
+
+
+def benchmark(stages, name):
+    data, function, n_items, unit = getattr(stages, name)()
+    warm_up_data, warm_up_function, _, _ = getattr(Stages(scale=1e-3), name)()  # compile numba functions
+    warm_up_function(warm_up_data)
+
+    start = time.perf_counter()
+    function(data)
+    duration = time.perf_counter() - start
+    return {'seconds': duration, 'items': n_items, 'unit': unit, 'throughput': n_items / duration, 'command_bytes': data.daq['cmd'].n_bytes}
+
+
+def system_info():
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'machine': platform.machine(), 'processor': platform.processor()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('stages', nargs='*', default=STAGES, help='Stages to run, default is all: %s' % ', '.join(STAGES))
+    parser.add_argument('--scale', type=float, default=1., help='Scale factor of the number of calls')
+    parser.add_argument('--save', help='Save results as baseline json file')
+    parser.add_argument('--compare', help='Compare results with baseline json file')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+
+    stages = Stages(scale=args.scale)
+    results = {}
+    print('%-20s %14s %22s %14s %10s' % ('Stage', 'Time [s]', 'Throughput', 'Command [kB]', 'Baseline'))
+    for name in args.stages:
+        result = benchmark(stages, name)
+        results[name] = result
+        ratio = ''
+        if baseline and name in baseline['stages']:
+            ratio = '%.2fx' % (result['throughput'] / baseline['stages'][name]['throughput'])
+        print('%-20s %14.3f %12.3g %-9s %14.1f %10s' % (name, result['seconds'], result['throughput'], result['unit'] + '/s',
+                                                        result['command_bytes'] / 1e3, ratio))
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'scale': args.scale, 'system': system_info(), 'stages': results}, f, indent=2)
@@ -0,0 +1,69 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Compare the compression profiles for raw data: write speed, read speed and file size.
+
+    Usage: python benchmark_compression.py [raw_data_file.h5]
+
+    Uses the raw data of the given (recorded) file, otherwise random TJ-Monopix2 like data.
+'''
+
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import tables as tb
+
+from tjmonopix2 import utils
+
+CHUNK_SIZE = 100000  # words per append, similar to one readout of the FIFO
+
+
+def get_raw_data(raw_data_file=None, n_words=10000000):
+    if raw_data_file:
+        with tb.open_file(raw_data_file, 'r') as in_file:
+            return in_file.root.raw_data[:]
+    # TJ data words with random symbols and increasing timestamps
+    rng = np.random.default_rng(0)
+    raw_data = 0x40000000 | rng.integers(0, 0x7FFFFFF, n_words, dtype=np.uint32)
+    raw_data[::10] = 0x48000000 | (np.arange(0, n_words, 10, dtype=np.uint32) & 0x3FFFFFF)
+    return raw_data
+
+
+def benchmark(raw_data, profile, kind='raw_data'):
+    filename = os.path.join(tempfile.mkdtemp(), 'benchmark.h5')
+    start = time.time()
+    with tb.open_file(filename, 'w') as out_file:
+        raw_data_earray = out_file.create_earray(out_file.root, name='raw_data', atom=tb.UIntAtom(),
+                                                 shape=(0,), filters=utils.get_filters(kind, profile))
+        for i in range(0, raw_data.shape[0], CHUNK_SIZE):
+            raw_data_earray.append(raw_data[i:i + CHUNK_SIZE])
+            raw_data_earray.flush()
+    write_time = time.time() - start
+
+    start = time.time()
+    with tb.open_file(filename, 'r') as in_file:
+        in_file.root.raw_data[:]
+    read_time = time.time() - start
+
+    file_size = os.path.getsize(filename)
+    os.remove(filename)
+    return write_time, read_time, file_size
+
+
+if __name__ == '__main__':
+    raw_data = get_raw_data(sys.argv[1] if len(sys.argv) > 1 else None)
+    data_size = raw_data.nbytes / 1e6
+    print('%d words (%.1f MB)' % (raw_data.shape[0], data_size))
+    print('%-12s %12s %12s %12s %8s' % ('Profile', 'Write [MB/s]', 'Read [MB/s]', 'Size [MB]', 'Ratio'))
+    for profile in utils.COMPRESSION_PROFILES.keys():
+        write_time, read_time, file_size = benchmark(raw_data, profile)
+        print('%-12s %12.1f %12.1f %12.1f %8.2f' % (profile, data_size / write_time, data_size / read_time,
+                                                    file_size / 1e6, raw_data.nbytes / float(file_size)))
@@ -0,0 +1,113 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Import time of the scan modules and time of the first call of the numba kernels (compilation
+    or loading from the numba cache), every measurement runs in a fresh Python process.
+
+    Usage: python benchmark_import.py [--runs 5] [--importtime] [--save baseline.json] [--compare baseline.json] [target ...]
+
+    The first run after a change of the numba kernels compiles and fills the cache (__pycache__),
+    the median of the runs is the startup time with cache.
+'''
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+
+import numpy as np
+
+IMPORTS = {
+    'scan_base': 'tjmonopix2.system.scan_base',
+    'scan_threshold': 'tjmonopix2.scans.scan_threshold',
+    'scan_source': 'tjmonopix2.scans.scan_source',
+    'analysis': 'tjmonopix2.analysis.analysis',
+    'plotting': 'tjmonopix2.analysis.plotting',
+}
+
+# First call of the numba kernels of the interpretation and event building, after the imports
+FIRST_CALL = '''
+import numpy as np
+from tjmonopix2.analysis import analysis_utils as au
+from tjmonopix2.analysis import raw_data_generator as generator
+from tjmonopix2.analysis.events import build_events
+from tjmonopix2.analysis.interpreter import RawDataInterpreter
+raw_data = generator.triggered_hits(1000)
+start = time.perf_counter()
+hits = RawDataInterpreter(trigger_data_format=2).interpret(raw_data, np.zeros(4 * raw_data.shape[0], dtype=au.hit_dtype), 0)
+build_events(hits, np.zeros(hits.shape[0], dtype=au.event_dtype))
+'''
+
+TARGETS = tuple(IMPORTS.keys()) + ('first_call', )
+
+
+def get_code(target):
+    if target == 'first_call':
+        return 'import time\n' + FIRST_CALL + 'print(time.perf_counter() - start)\n'
+    return 'import time\nstart = time.perf_counter()\nimport %s\nprint(time.perf_counter() - start)\n' % IMPORTS[target]
+
+
+def measure(target, runs):
+    ''' Median and minimum of the durations in fresh processes '''
+    durations = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', get_code(target)], check=True, capture_output=True, text=True).stdout
+        durations.append(float(output.split()[-1]))
+    return {'median_seconds': float(np.median(durations)), 'min_seconds': min(durations), 'runs': runs}
+
+
+def print_importtime(target, n_modules=15):
+    ''' Modules with the largest cumulative import time (python -X importtime) '''
+    module = IMPORTS.get(target, 'tjmonopix2.analysis.analysis')
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import %s' % module], check=True, capture_output=True, text=True).stderr
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        modules.append((int(cumulative), name.strip()))
+    for cumulative, name in sorted(modules, reverse=True)[:n_modules]:
+        print('    %-60s %8.3f s' % (name, cumulative / 1e6))
+
+
+def system_info():
+    import numba
+    return {'python': platform.python_version(), 'numpy': np.__version__, 'numba': numba.__version__,
+            'machine': platform.machine(), 'processor': platform.processor()}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('targets', nargs='*', default=TARGETS, help='Targets to measure, default is all: %s' % ', '.join(TARGETS))
+    parser.add_argument('--runs', type=int, default=5, help='Number of fresh processes per target')
+    parser.add_argument('--importtime', action='store_true', help='Print the slowest imported modules of every target')
+    parser.add_argument('--save', help='Save results as baseline json file')
+    parser.add_argument('--compare', help='Compare results with baseline json file')
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+
+    results = {}
+    print('%-20s %12s %12s %10s' % ('Target', 'Median [s]', 'Min [s]', 'Baseline'))
+    for target in args.targets:
+        result = measure(target, args.runs)
+        results[target] = result
+        ratio = ''
+        if baseline and target in baseline['targets']:
+            ratio = '%.2fx' % (baseline['targets'][target]['median_seconds'] / result['median_seconds'])
+        print('%-20s %12.3f %12.3f %10s' % (target, result['median_seconds'], result['min_seconds'], ratio))
+        if args.importtime:
+            print_importtime(target)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'runs': args.runs, 'system': system_info(), 'targets': results}, f, indent=2)
@@ -0,0 +1,120 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Sustained throughput of the data taking pipeline without hardware:
+    replayed FIFO data -> FifoReadout -> ScanBase data handling -> HDF5 (+ ZMQ).
+
+    Usage: pytest benchmarks/test_benchmark_readout.py (requires pytest-benchmark)
+'''
+
+import os
+import time
+
+import numpy as np
+import pytest
+import tables as tb
+import zmq
+
+from tjmonopix2 import utils
+from tjmonopix2.system import scan_base
+from tjmonopix2.system.fifo_readout import FifoReadout
+from tjmonopix2.tests.test_software.replay import FifoReplay, ReplayDaq
+
+pytest.importorskip('pytest_benchmark')
+
+N_WORDS = 20000000
+BURST_PROFILE = ((0.09, 0.), (0.01, 10.))  # 10 ms bursts every 100 ms
+
+
+def get_raw_data(n_words=1000000, seed=0):
+    ''' Hit words (data identifier of rx0) with random content '''
+    rng = np.random.default_rng(seed)
+    return (0x40000000 | rng.integers(0, 0x07FFFFFF, size=n_words, dtype=np.uint32)).astype(np.uint32)
+
+
+class ReplayScan(scan_base.ScanBase):
+    ''' Scan without hardware, only the data handling of the FIFO readout is used '''
+
+    def __init__(self, fifo_readout):
+        super(ReplayScan, self).__init__()
+        self.fifo_readout = fifo_readout
+        self.scan_param_id = 0
+
+
+def run_pipeline(raw_data, filename, n_words=N_WORDS, word_rate=None, burst_profile=None, send_data=False, profile=None, timeout=300.):
+    ''' Replay n_words through the readout and data handling, returns words per second.
+        Fails on readout errors and if not all words are handled within timeout seconds.
+    '''
+    fifo = FifoReplay(raw_data, word_rate=word_rate, burst_profile=burst_profile, loop=True, n_words=n_words)
+    fifo_readout = FifoReadout(ReplayDaq(fifo))
+
+    context = zmq.Context() if send_data else None
+    chip = scan_base.ChipContainer(name='chip', chip_settings={}, chip_conf=None, module_settings=None,
+                                   output_filename=filename, output_dir=os.path.dirname(filename), log_fh=None, scan_config=None)
+    with tb.open_file(filename, mode='w') as h5_file:
+        chip.raw_data_earray = h5_file.create_earray(h5_file.root, name='raw_data', atom=tb.UIntAtom(), shape=(0,),
+                                                     filters=utils.get_filters('raw_data', profile))
+        chip.meta_data_table = h5_file.create_table(h5_file.root, name='meta_data', description=scan_base.MetaTable,
+                                                    filters=utils.get_filters('tables', profile))
+        if send_data:
+            chip.socket = context.socket(zmq.PUB)
+            chip.socket.setsockopt(zmq.LINGER, 0)
+            chip.socket.bind_to_random_port('tcp://127.0.0.1')
+            scan_base.import_simple_enc()  # as at the socket setup of the scan
+        scan = ReplayScan(fifo_readout)
+        words_handled, errors = [0], []
+
+        def handle_data(data_tuple):
+            scan._store_data(chip, data_tuple)
+            words_handled[0] += data_tuple[0].shape[0]
+
+        start_time = time.time()
+        fifo_readout.start(callback=handle_data, errback=lambda exc: errors.append(exc[1]))
+        try:
+            while words_handled[0] < n_words and not errors:
+                if time.time() - start_time > timeout:
+                    pytest.fail('Only %d of %d words handled within %1.1f s' % (words_handled[0], n_words, timeout))
+                time.sleep(0.001)
+            total_time = time.time() - start_time
+        finally:
+            fifo_readout.stop(timeout=0)
+
+        if errors:
+            pytest.fail('Readout error: %s' % errors[0])
+        assert chip.raw_data_earray.nrows == n_words
+    if send_data:
+        chip.socket.close()
+        context.term()
+    os.remove(filename)
+    return n_words / total_time
+
+
+@pytest.fixture(scope='module')
+def raw_data():
+    return get_raw_data()
+
+
+@pytest.mark.parametrize('send_data', [False, True])
+@pytest.mark.parametrize('profile', ['balanced', 'fast-write'])
+def test_sustained_throughput(benchmark, raw_data, tmp_path, profile, send_data):
+    words_per_second = benchmark.pedantic(run_pipeline, args=(raw_data, str(tmp_path / 'raw_data.h5')),
+                                          kwargs=dict(send_data=send_data, profile=profile), rounds=3, iterations=1)
+    benchmark.extra_info['words_per_second'] = words_per_second
+
+
+@pytest.mark.parametrize('burst_profile', [None, BURST_PROFILE])
+def test_rate_limited(benchmark, raw_data, tmp_path, burst_profile):
+    ''' Rate of the pipeline at 10 M words/s (about 5 M hits/s), also for bursts. The pipeline keeps up if it handles more than 90 % of the rate,
+        this is only recorded and not asserted since it depends on the machine.
+    '''
+    word_rate = 1e7
+    words_per_second = benchmark.pedantic(run_pipeline, args=(raw_data, str(tmp_path / 'raw_data.h5')),
+                                          kwargs=dict(n_words=int(2 * word_rate), word_rate=word_rate, burst_profile=burst_profile),
+                                          rounds=1, iterations=1)
+    benchmark.extra_info['words_per_second'] = words_per_second
+    benchmark.extra_info['keeps_up'] = bool(words_per_second > 0.9 * word_rate)
@@ -10,18 +10,19 @@ import os
 import numba
 import numpy as np
 import tables as tb
-from pixel_clusterizer.clusterizer import HitClusterizer
+from tjmonopix2 import utils
 from tjmonopix2.analysis import analysis_utils as au
+from tjmonopix2.analysis import hit_storage
 from tjmonopix2.analysis.interpreter import RawDataInterpreter
 from tjmonopix2.analysis.events import build_events
-from tjmonopix2.system import logger
+from tjmonopix2.system import logger, profiling
 from tqdm import tqdm
 
 
 class Analysis(object):
     def __init__(self, raw_data_file=None, analyzed_data_file=None, tot_calib_file=None,
                  store_hits=True, cluster_hits=False, analyze_tdc=False, use_tdc_trigger_dist=False,
-                 build_events=False, chunk_size=1000000, **_):
+                 build_events=False, chunk_size=1000000, hit_format='table', raw_data_cache=False, compression=None, **_):
         self.log = logger.setup_derived_logger('Analysis')
 
         self.raw_data_file = raw_data_file
@@ -33,6 +34,9 @@ class Analysis(object):
         self.analyze_tdc = analyze_tdc
         self.use_tdc_trigger_dist = use_tdc_trigger_dist
         self.tot_calib_file = tot_calib_file
+        self.hit_format = hit_format  # storage format of hit data: 'table' or 'columnar'
+        self.raw_data_cache = raw_data_cache  # decompress raw data once into memory mapped file for repeated analysis
+        self.filters = utils.get_filters('analysis', compression)  # compression profile of output nodes
 
         if self.build_events:
             self.cluster_hits = True
@@ -44,6 +48,7 @@ class Analysis(object):
             self.analyzed_data_file = raw_data_file[:-3] + '_interpreted.h5'
 
         self.last_chunk = False
+        self._scan_param_table = None
 
         self._get_configs()
 
@@ -78,16 +83,32 @@ class Analysis(object):
             scan_parameter: string
                 Name of the scan parameter. If not defined all are returned.
         '''
-        with tb.open_file(self.raw_data_file, 'r') as in_file:
-            scan_param_table = in_file.root.configuration_out.scan.scan_params[:]
-            if scan_param_index:
-                scan_param_table = scan_param_table[scan_param_index]
-            if scan_parameter:
-                scan_param_table = scan_param_table[:][scan_parameter]
+        if self._scan_param_table is None:  # read once
+            with tb.open_file(self.raw_data_file, 'r') as in_file:
+                self._scan_param_table = in_file.root.configuration_out.scan.scan_params[:]
+        scan_param_table = self._scan_param_table
+        if scan_param_index:
+            scan_param_table = scan_param_table[scan_param_index]
+        if scan_parameter:
+            scan_param_table = scan_param_table[:][scan_parameter]
         return scan_param_table
 
+    def _get_readout_ranges(self, in_file):
+        ''' Return the raw data word ranges with scan_param_id, index_start and index_stop
+
+            Uses the summary table of the readouts if available (one row per readout() call),
+            otherwise the meta data (one row per readout)
+        '''
+        try:
+            ranges = in_file.root.scan_param_ranges[:]
+            return ranges[ranges['n_readouts'] > 0]
+        except tb.NoSuchNodeError:  # files of older software versions
+            return in_file.root.meta_data[:]
+
     def _range_of_parameter(self, meta_data):
         ''' Calculate the raw data word indeces of each scan parameter id
+
+            meta_data: meta data or readout summary (see _get_readout_ranges)
         '''
         index = np.append(np.array([0]), (np.where(np.diff(meta_data['scan_param_id']) != 0)[0] + 1))
 
@@ -127,22 +148,29 @@ class Analysis(object):
             return
         yield scan_param_id, data[stop + self.chunk_offset:stop]
 
-    def _create_table(self, out_file, name, title, dtype):
+    def _create_table(self, out_file, name, title, dtype, hit_format='table'):
         ''' Create hit table node for storage in out_file.
             Copy configuration nodes from raw data file.
+
+            hit_format: 'table' or 'columnar' (hit data only, see hit_storage module)
         '''
+        if hit_format != 'table':
+            if dtype != au.hit_dtype:
+                raise ValueError('Hit format %s is only supported for hit data' % hit_format)
+            return hit_storage.create_hit_storage(out_file, name=name, title=title, hit_format=hit_format,
+                                                  filters=self.filters, expectedrows=self.chunk_size)
         table = out_file.create_table(out_file.root, name=name,
                                       description=dtype,
                                       title=title,
                                       expectedrows=self.chunk_size,
-                                      filters=tb.Filters(complib='blosc',
-                                                         complevel=5,
-                                                         fletcher32=False))
+                                      filters=self.filters)
 
         return table
 
     def _setup_clusterizer(self):
         ''' Define data structure and settings for hit clusterizer package '''
+        from pixel_clusterizer.clusterizer import HitClusterizer  # imported on use, only needed for clustering
+
         # Define all field names and data types
         hit_fields = {'event_number': 'event_number',
                       'trigger_number': 'trigger_number',
@@ -275,12 +303,13 @@ class Analysis(object):
             # Set end_of_cluster function for shape and distance calculation
             self.clz.set_end_of_cluster_function(end_of_cluster_function)
 
+    @profiling.stage('analyze_data')
     def analyze_data(self):
         self.log.info('Analyzing data...')
         self.chunk_offset = 0
         with tb.open_file(self.raw_data_file) as in_file:
             n_words = in_file.root.raw_data.shape[0]
-            meta_data = in_file.root.meta_data[:]
+            meta_data = self._get_readout_ranges(in_file)
 
             if meta_data.shape[0] == 0:
                 self.log.warning('Data is empty. Skip analysis!')
@@ -295,7 +324,7 @@ class Analysis(object):
                 out_file.copy_children(in_file.root.configuration_out, out_file.root.configuration_in, recursive=True)
 
                 if self.store_hits:
-                    hit_table = self._create_table(out_file, name='Dut', title='hit_data', dtype=au.hit_dtype)
+                    hit_table = self._create_table(out_file, name='Dut', title='hit_data', dtype=au.hit_dtype, hit_format=self.hit_format)
                 if self.build_events:
                     trigger_n, trigger_ts, event_n = 0, 0, 0
                     event_table = self._create_table(out_file, name='Hits', title='event_data', dtype=au.event_dtype)
@@ -307,40 +336,45 @@ class Analysis(object):
                         out_file.root, name='Cluster',
                         description=self.cluster_dtype,
                         title='Cluster',
-                        filters=tb.Filters(complib='blosc',
-                                           complevel=5,
-                                           fletcher32=False))
-                    if self.tot_calib_file:
-                        cs_tot_size = 2048
-                    else:
-                        cs_tot_size = 256
-                    hist_cs_size = np.zeros(shape=(30, ), dtype=np.uint32)
-                    hist_cs_tot = np.zeros(shape=(cs_tot_size, ), dtype=np.uint32)
-                    hist_cs_shape = np.zeros(shape=(300, ), dtype=np.int32)
+                        expectedrows=self.chunk_size,
+                        filters=self.filters)
+                    # Cluster histograms, filled and written chunk wise. Size and ToT histograms have at least
+                    # the number of bins of the former fixed size histograms and are extended for larger values.
+                    hist_cs_size = au.EArrayHistogram(out_file, name='HistClusterSize', title='Cluster Size Histogram', min_bins=30, filters=self.filters)
+                    hist_cs_tot = au.EArrayHistogram(out_file, name='HistClusterTot', title='Cluster ToT Histogram',
+                                                     min_bins=2048 if self.tot_calib_file else 256, filters=self.filters)
+                    hist_cs_shape = au.EArrayHistogram(out_file, name='HistClusterShape', title='Cluster Shape Histogram', n_bins=300, filters=self.filters)
 
                 interpreter = RawDataInterpreter(n_scan_params=n_scan_params, trigger_data_format=self.tlu_config['DATA_FORMAT'])
                 self.last_chunk = False
                 pbar = tqdm(total=n_words, unit=' Words', unit_scale=True)
                 upd = 0
-                for scan_param_id, words in self._words_of_parameter(par_range, in_file.root.raw_data):
+                if self.raw_data_cache:
+                    raw_data = au.get_raw_data_memmap(self.raw_data_file)
+                else:
+                    raw_data = in_file.root.raw_data
+                for scan_param_id, words in self._words_of_parameter(par_range, raw_data):
                     hit_buffer = np.zeros(shape=4 * self.chunk_size, dtype=au.hit_dtype)
 
-                    hit_dat = interpreter.interpret(
-                        words,
-                        hit_buffer,
-                        scan_param_id
-                    )
+                    with profiling.accumulate('interpret'):
+                        hit_dat = interpreter.interpret(
+                            words,
+                            hit_buffer,
+                            scan_param_id
+                        )
                     upd = words.shape[0]
 
                     if self.store_hits:
-                        hit_table.append(hit_dat)
-                        hit_table.flush()
+                        with profiling.accumulate('store_hits'):
+                            hit_table.append(hit_dat)
+                            hit_table.flush()
                     if self.build_events:
                         if np.count_nonzero(hit_dat["col"] == 1023) > 0:
-                            event_buffer = np.zeros(len(hit_dat), dtype=au.event_dtype)
-                            event_dat, trigger_n, trigger_ts, event_n = build_events(hit_dat, event_buffer, trigger_n, trigger_ts, event_n)
-                            event_table.append(event_dat)
-                            event_table.flush()
+                            with profiling.accumulate('build_events'):
+                                event_buffer = np.zeros(len(hit_dat), dtype=au.event_dtype)
+                                event_dat, trigger_n, trigger_ts, event_n = build_events(hit_dat, event_buffer, trigger_n, trigger_ts, event_n)
+                                event_table.append(event_dat)
+                                event_table.flush()
                         else:
                             self.log.error("No TLU data found in raw data. Check data or disable event building")
                             raise Exception
@@ -351,8 +385,8 @@ class Analysis(object):
                             hit_dat = hit_dat[hit_dat['col'] < 1000]  # Can only call tot_calib for hit data
                             hit_data_cs_fmt = np.zeros(len(hit_dat), dtype=au.event_dtype)
                             hit_data_cs_fmt['event_number'][:] = hit_dat['timestamp'][:]
-                            hit_data_cs_fmt['trigger_number'][:] = -1
-                            hit_data_cs_fmt['frame'][:] = -1
+                            hit_data_cs_fmt['trigger_number'][:] = np.iinfo(np.uint32).max  # no trigger
+                            hit_data_cs_fmt['frame'][:] = np.iinfo(np.uint8).max
                             hit_data_cs_fmt['column'][:] = hit_dat['col'][:]
                             hit_data_cs_fmt['row'][:] = hit_dat['row'][:]
                             hit_data_cs_fmt['charge'][:] = ((hit_dat[:]["te"] - hit_dat[:]["le"]) & 0x7F) + 1
@@ -367,26 +401,25 @@ class Analysis(object):
                                 self.tot_calib[data_to_clusterizer[:]['column'], data_to_clusterizer[:]['row']][:, 2]
                             )
 
-                        _, cluster = self.clz.cluster_hits(data_to_clusterizer)
-                        cluster_table.append(cluster)
-                        # Create actual cluster hists
-                        cs_size = np.bincount(cluster['size'], minlength=30)[:30]
-                        cs_tot = np.bincount(cluster['tot'], minlength=512)[:512]
-                        sel = np.logical_and(cluster['cluster_shape'] > 0, cluster['cluster_shape'] < 300)
-                        cs_shape = np.bincount(cluster['cluster_shape'][sel], minlength=300)[:300]
-                        # Add to total hists
-                        hist_cs_size += cs_size.astype(np.uint32)
-                        hist_cs_tot += cs_tot.astype(np.uint32)
-                        hist_cs_shape += cs_shape.astype(np.uint32)
+                        with profiling.accumulate('cluster'):
+                            _, cluster = self.clz.cluster_hits(data_to_clusterizer)
+                            cluster_table.append(cluster)
+                            cluster_table.flush()
+                            # Add to cluster hists
+                            hist_cs_size.fill(cluster['size'])
+                            hist_cs_tot.fill(cluster['tot'])
+                            hist_cs_shape.fill(cluster['cluster_shape'][cluster['cluster_shape'] > 0])
                     pbar.update(upd)
                 pbar.close()
 
+                if self.cluster_hits:
+                    self._create_cluster_index(cluster_table)
+
                 hist_occ, hist_tot, hist_tdc = interpreter.get_histograms()
 
         self._create_additional_hit_data(hist_occ, hist_tot)
-        if self.cluster_hits:
-            self._create_additional_cluster_data(hist_cs_size, hist_cs_tot, hist_cs_shape)
 
+    @profiling.stage('store_histograms')
     def _create_additional_hit_data(self, hist_occ, hist_tot):
         with tb.open_file(self.analyzed_data_file, 'r+') as out_file:
             scan_id = self.run_config['scan_id']
@@ -395,16 +428,12 @@ class Analysis(object):
                                    name='HistOcc',
                                    title='Occupancy Histogram',
                                    obj=hist_occ,
-                                   filters=tb.Filters(complib='blosc',
-                                                      complevel=5,
-                                                      fletcher32=False))
+                                   filters=self.filters)
             out_file.create_carray(out_file.root,
                                    name='HistTot',
                                    title='ToT Histogram',
                                    obj=hist_tot,
-                                   filters=tb.Filters(complib='blosc',
-                                                      complevel=5,
-                                                      fletcher32=False))
+                                   filters=self.filters)
 
             # if self.analyze_tdc:  # Only store if TDC analysis is used.
             #     out_file.create_carray(out_file.root,
@@ -419,44 +448,28 @@ class Analysis(object):
                 n_injections = self.scan_config['n_injections']
                 hist_scurve = hist_occ.reshape((self.rows * self.columns, -1))
 
-                if scan_id in ['threshold_scan', 'calibrate_tot']:
-                    scan_params = [self.scan_config['VCAL_HIGH'] - v for v in range(self.scan_config['VCAL_LOW_start'],
-                                                                                    self.scan_config['VCAL_LOW_stop'], self.scan_config['VCAL_LOW_step'])]
-                    self.threshold_map, self.noise_map, self.chi2_map = au.fit_scurves_multithread(hist_scurve, scan_params, n_injections, optimize_fit_range=False)
-                elif scan_id == 'autorange_threshold_scan':
-                    scan_params = self.get_scan_param_values(scan_parameter='vcal_high') - self.get_scan_param_values(scan_parameter='vcal_med')
-                    self.threshold_map, self.noise_map, self.chi2_map = au.fit_scurves_multithread(hist_scurve, scan_params, n_injections, optimize_fit_range=False)
+                with profiling.stage('fit_scurves'):
+                    if scan_id in ['threshold_scan', 'calibrate_tot']:
+                        scan_params = [self.scan_config['VCAL_HIGH'] - v for v in range(self.scan_config['VCAL_LOW_start'],
+                                                                                        self.scan_config['VCAL_LOW_stop'], self.scan_config['VCAL_LOW_step'])]
+                        self.threshold_map, self.noise_map, self.chi2_map = au.fit_scurves_multithread(hist_scurve, scan_params, n_injections, optimize_fit_range=False)
+                    elif scan_id == 'autorange_threshold_scan':
+                        scan_params = self.get_scan_param_values(scan_parameter='vcal_high') - self.get_scan_param_values(scan_parameter='vcal_med')
+                        self.threshold_map, self.noise_map, self.chi2_map = au.fit_scurves_multithread(hist_scurve, scan_params, n_injections, optimize_fit_range=False)
 
                 out_file.create_carray(out_file.root, name='ThresholdMap', title='Threshold Map', obj=self.threshold_map,
-                                       filters=tb.Filters(complib='blosc', complevel=5, fletcher32=False))
+                                       filters=self.filters)
                 out_file.create_carray(out_file.root, name='NoiseMap', title='Noise Map', obj=self.noise_map,
-                                       filters=tb.Filters(complib='blosc', complevel=5, fletcher32=False))
+                                       filters=self.filters)
                 out_file.create_carray(out_file.root, name='Chi2Map', title='Chi2 / ndf Map', obj=self.chi2_map,
-                                       filters=tb.Filters(complib='blosc', complevel=5, fletcher32=False))
+                                       filters=self.filters)
 
-    def _create_additional_cluster_data(self, hist_cs_size, hist_cs_tot, hist_cs_shape):
+    @profiling.stage('index_clusters')
+    def _create_cluster_index(self, cluster_table):
         '''
-            Store cluster histograms in analyzed data file
+            Index the cluster table to allow queries without reading the full table.
+            Indexing once after all clusters are stored is much faster than indexing while appending.
         '''
-        with tb.open_file(self.analyzed_data_file, 'r+') as out_file:
-            out_file.create_carray(out_file.root,
-                                   name='HistClusterSize',
-                                   title='Cluster Size Histogram',
-                                   obj=hist_cs_size,
-                                   filters=tb.Filters(complib='blosc',
-                                                      complevel=5,
-                                                      fletcher32=False))
-            out_file.create_carray(out_file.root,
-                                   name='HistClusterTot',
-                                   title='Cluster ToT Histogram',
-                                   obj=hist_cs_tot,
-                                   filters=tb.Filters(complib='blosc',
-                                                      complevel=5,
-                                                      fletcher32=False))
-            out_file.create_carray(out_file.root,
-                                   name='HistClusterShape',
-                                   title='Cluster Shape Histogram',
-                                   obj=hist_cs_shape,
-                                   filters=tb.Filters(complib='blosc',
-                                                      complevel=5,
-                                                      fletcher32=False))
+        self.log.info('Indexing cluster table...')
+        for column in ['event_number', 'seed_col', 'seed_row']:
+            cluster_table.colinstances[column].create_index()
@@ -6,14 +6,17 @@
 #
 
 import ast
+import hashlib
+import json
 import logging
+import os
 import multiprocessing as mp
 import warnings
 from functools import partial
 
 import numba
 import numpy as np
-from scipy.optimize import OptimizeWarning, curve_fit
+import tables as tb
 from scipy.special import erf
 from tqdm import tqdm
 
@@ -78,11 +81,93 @@ class ConfigDict(dict):
             return key, val
 
 
+class EArrayHistogram(object):
+    ''' 1D histogram of non-negative integers that is filled chunk wise and stored
+        in an extensible array of a h5 file.
+
+        Without n_bins the histogram has at least min_bins bins and grows with the largest value filled,
+        otherwise values >= n_bins are omitted.
+    '''
+
+    def __init__(self, h5_file, name, title, dtype=np.uint32, n_bins=None, min_bins=0, filters=None):
+        self.n_bins = n_bins
+        self.dtype = np.dtype(dtype)
+        self.earray = h5_file.create_earray(h5_file.root, name=name, title=title,
+                                            atom=tb.Atom.from_dtype(self.dtype), shape=(0,),
+                                            expectedrows=n_bins if n_bins else max(min_bins, 1000), filters=filters)
+        if n_bins or min_bins:
+            self.earray.append(np.zeros(n_bins if n_bins else min_bins, dtype=self.dtype))
+
+    def fill(self, values):
+        values = values[values >= 0]
+        if self.n_bins:
+            values = values[values < self.n_bins]
+        if values.shape[0] == 0:
+            return
+        hist = np.bincount(values).astype(self.dtype)
+        if hist.shape[0] > self.earray.nrows:  # extend histogram
+            self.earray.append(np.zeros(hist.shape[0] - self.earray.nrows, dtype=self.dtype))
+        self.earray[:hist.shape[0]] = self.earray[:hist.shape[0]] + hist
+        self.earray.flush()
+
+
+def _file_hash(filename, block_size=16 * 1024 * 1024):
+    file_hash = hashlib.blake2b()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def get_raw_data_memmap(raw_data_file, cache_file=None, chunk_size=10000000):
+    ''' Return the raw data of raw_data_file as read-only memory mapped uint32 array.
+
+        The raw data is decompressed once into the sidecar cache_file (default: <raw_data_file>_raw_data.npy).
+        The cache is reused as long as size and hash of the raw data file are unchanged. The hash is calculated
+        from the complete raw data file on every call, only the decompression is saved by the cache.
+    '''
+    if cache_file is None:
+        cache_file = os.path.splitext(raw_data_file)[0] + '_raw_data.npy'
+    info_file = cache_file + '.json'
+    file_info = {'raw_data_file': os.path.basename(raw_data_file),
+                 'size': os.path.getsize(raw_data_file)}
+
+    try:
+        with open(info_file, 'r') as f:
+            cache_info = json.load(f)
+        if cache_info['size'] == file_info['size']:  # cheap check first
+            file_info['hash'] = _file_hash(raw_data_file)
+            if cache_info == file_info and os.path.isfile(cache_file):
+                logger.info('Use raw data cache %s', cache_file)
+                return np.load(cache_file, mmap_mode='r')
+        logger.info('Raw data cache %s is outdated', cache_file)
+    except (IOError, ValueError, KeyError):  # no or corrupt cache
+        pass
+
+    if 'hash' not in file_info:
+        file_info['hash'] = _file_hash(raw_data_file)
+
+    logger.info('Create raw data cache %s', cache_file)
+    tmp_file = cache_file + '.tmp'
+    with tb.open_file(raw_data_file, 'r') as in_file:
+        raw_data = in_file.root.raw_data
+        cache = np.lib.format.open_memmap(tmp_file, mode='w+', dtype=np.uint32, shape=(int(raw_data.shape[0]), ))
+        for start in range(0, raw_data.shape[0], chunk_size):
+            cache[start:start + chunk_size] = raw_data[start:start + chunk_size]
+        cache.flush()
+        del cache
+    os.replace(tmp_file, cache_file)  # cache only valid if completely written
+    with open(info_file, 'w') as f:
+        json.dump(file_info, f)
+
+    return np.load(cache_file, mmap_mode='r')
+
+
 def _tot_response_func(x, a, b, d):
     return (a / x + 1 / b) * (x - d)
 
 
-@numba.njit
+@numba.njit(cache=True)
 def _inv_tot_response_func(tot, a, b, d):
     return (np.sqrt(b**2 * (a - tot)**2 + 2 * b * d * (a + tot) + d**2) - b * a + b * tot + d) * 0.5
 
@@ -114,7 +199,7 @@ def imap_bar(func, args, n_processes=None, unit='it', unit_scale=False):
     return res_list
 
 
-@numba.njit(locals={'cluster_shape': numba.int64})
+@numba.njit(locals={'cluster_shape': numba.int64}, cache=True)
 def calc_cluster_shape(cluster_array):
     '''Boolean 8x8 array to number.
     '''
@@ -125,7 +210,7 @@ def calc_cluster_shape(cluster_array):
     return cluster_shape
 
 
-@numba.njit(numba.int64(numba.uint32, numba.uint32))
+@numba.njit(numba.int64(numba.uint32, numba.uint32), cache=True)
 def xy2d_morton(x, y):
     ''' Tuple to number.
 
@@ -199,6 +284,8 @@ def fit_scurve(scurve_data, scan_params, n_injections, sigma_0):
             (mu, sigma, chi2/ndf)
     '''
 
+    from scipy.optimize import OptimizeWarning, curve_fit  # imported on use, slow to import
+
     # Typecast to working types
     scurve_data = np.array(scurve_data, dtype=float)
     # Scipy bug: fit does not work on float32 values, without any error message
@@ -457,6 +544,8 @@ def _fit_tot_response(data, scan_params):
             (m, b, c, d, chi2/ndf)
     '''
 
+    from scipy.optimize import OptimizeWarning, curve_fit  # imported on use, slow to import
+
     # Typecast to working types
     data = np.array(data, dtype=float)
     # Scipy bug: fit does not work on float32 values, without any error message
@@ -3,10 +3,12 @@ import numpy as np
 from numba import njit
 from tqdm import tqdm
 
+from tjmonopix2 import utils
 from tjmonopix2.analysis import analysis_utils as au
+from tjmonopix2.analysis import hit_storage
 
 
-@njit
+@njit(cache=True)
 def build_events(hits, buffer, trigger_n=0, trigger_ts=0, event_n=0):
     """Build events from interpreted hits (including TLU words). Corrects trigger timestamp overflow
        and searches for hit words within fixed timeframe after trigger word.
@@ -57,15 +59,14 @@ if __name__ == "__main__":
 
     with tb.open_file(input_file, "r") as in_file:
         with tb.open_file(output_file, "w") as out_file:
-            n_words = len(in_file.root.Dut)
+            hit_data = hit_storage.open_hits(in_file.root.Dut)
+            n_words = len(hit_data)
             chunk_size = 1000000
             event_table = out_file.create_table(out_file.root, name='Hits',
                                                 description=au.event_dtype,
                                                 title='events',
                                                 expectedrows=chunk_size,
-                                                filters=tb.Filters(complib='blosc',
-                                                                   complevel=5,
-                                                                   fletcher32=False))
+                                                filters=utils.get_filters('analysis'))
 
             start = 0
             end = min(start + chunk_size, n_words)
@@ -74,7 +75,7 @@ if __name__ == "__main__":
             trigger_n, trigger_ts, event_n = 0, 0, 0
             pbar = tqdm(total=n_words, unit=' Words', unit_scale=True)
             while start < end:
-                hits = in_file.root.Dut[start:end]
+                hits = hit_data[start:end]
                 event_buffer = np.zeros(len(hits), dtype=au.event_dtype)
                 events, trigger_n, trigger_ts, event_n = build_events(hits, event_buffer, trigger_n, trigger_ts, event_n)
                 n_events += len(events)
@@ -0,0 +1,191 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Storage formats of interpreted hit data.
+
+    table:    One row per hit with au.hit_dtype (default)
+    columnar: One compressed array per (packed) column:
+              pixel = col << 9 | row (uint32), tot = le << 7 | te (uint16),
+              token_id, scan_param_id and timestamp differences per chunk.
+              A chunk statistics table allows to skip chunks without reading them.
+
+    Use open_hits() to read hits independent of the format.
+'''
+
+import numpy as np
+import tables as tb
+
+from tjmonopix2.analysis import analysis_utils as au
+
+HIT_FORMATS = ('table', 'columnar')
+
+chunk_stats_dtype = np.dtype([
+    ('index_start', '<u8'),
+    ('index_stop', '<u8'),
+    ('timestamp_start', '<i8'),
+    ('timestamp_min', '<i8'),
+    ('timestamp_max', '<i8'),
+    ('col_min', '<i2'),
+    ('col_max', '<i2'),
+    ('row_min', '<i2'),
+    ('row_max', '<i2'),
+    ('scan_param_id_min', '<i2'),
+    ('scan_param_id_max', '<i2'),
+])
+
+# Array name and atom of each stored column
+_columns = {'pixel': np.uint32,
+            'tot': np.uint16,
+            'token_id': np.int32,
+            'scan_param_id': np.int16,
+            'timestamp_diff': np.int64}
+
+
+def pack_pixel(col, row):
+    return (col.astype(np.uint32) & 0x3FF) << 9 | (row.astype(np.uint32) & 0x1FF)
+
+
+def unpack_pixel(pixel):
+    return (pixel >> 9).astype(np.int16), (pixel & 0x1FF).astype(np.int16)
+
+
+def pack_tot(le, te):
+    return (le.astype(np.uint16) & 0x7F) << 7 | (te.astype(np.uint16) & 0x7F)
+
+
+def unpack_tot(tot):
+    return (tot >> 7).astype(np.int8), (tot & 0x7F).astype(np.int8)
+
+
+class ColumnarHitWriter(object):
+    ''' Appends hit arrays (au.hit_dtype) to a columnar hit group '''
+
+    def __init__(self, h5_file, name, title, filters=None, expectedrows=1000000):
+        self.group = h5_file.create_group(h5_file.root, name=name, title=title)
+        self.group._v_attrs.format = 'columnar'
+        if filters is None:
+            filters = tb.Filters(complib='blosc', complevel=5, shuffle=True, fletcher32=False)
+        self.arrays = {}
+        for column, dtype in _columns.items():
+            self.arrays[column] = h5_file.create_earray(self.group, name=column, atom=tb.Atom.from_dtype(np.dtype(dtype)),
+                                                        shape=(0,), expectedrows=expectedrows, filters=filters)
+        self.chunk_stats = h5_file.create_table(self.group, name='chunk_stats', description=chunk_stats_dtype,
+                                                title='Statistics of appended chunks', filters=filters)
+
+    @property
+    def nrows(self):
+        return self.arrays['pixel'].nrows
+
+    def append(self, hits):
+        if hits.shape[0] == 0:
+            return
+        timestamp_diff = np.zeros(hits.shape[0], dtype=np.int64)
+        timestamp_diff[1:] = np.diff(hits['timestamp'])  # first difference of each chunk is 0, start value is in chunk statistics
+
+        stats = np.zeros(1, dtype=chunk_stats_dtype)
+        stats['index_start'] = self.nrows
+        stats['index_stop'] = self.nrows + hits.shape[0]
+        stats['timestamp_start'] = hits['timestamp'][0]
+        for column, field in (('timestamp', 'timestamp'), ('col', 'col'), ('row', 'row'), ('scan_param_id', 'scan_param_id')):
+            stats[column + '_min'] = hits[field].min()
+            stats[column + '_max'] = hits[field].max()
+
+        self.arrays['pixel'].append(pack_pixel(hits['col'], hits['row']))
+        self.arrays['tot'].append(pack_tot(hits['le'], hits['te']))
+        self.arrays['token_id'].append(hits['token_id'])
+        self.arrays['scan_param_id'].append(hits['scan_param_id'])
+        self.arrays['timestamp_diff'].append(timestamp_diff)
+        self.chunk_stats.append(stats)
+
+    def flush(self):
+        for array in self.arrays.values():
+            array.flush()
+        self.chunk_stats.flush()
+
+
+class ColumnarHits(object):
+    '''
+        Read access to a columnar hit group.
+
+        Slicing returns hits as au.hit_dtype like a hit table. Use read_columns() to
+        only read and decode the needed columns, e.g. col and row for occupancy.
+    '''
+
+    def __init__(self, group):
+        self.group = group
+        self.chunk_stats = group.chunk_stats[:]
+
+    def __len__(self):
+        return self.group.pixel.nrows
+
+    @property
+    def shape(self):
+        return (len(self), )
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            raise TypeError('Columnar hits only support slicing')
+        start, stop, step = item.indices(len(self))
+        hits = self.read(start, stop)
+        return hits[::step] if step != 1 else hits
+
+    def read(self, start=0, stop=None):
+        stop = len(self) if stop is None else stop
+        columns = self.read_columns(au.hit_dtype.names, start, stop)
+        hits = np.zeros(max(stop - start, 0), dtype=au.hit_dtype)
+        for name in au.hit_dtype.names:
+            hits[name] = columns[name]
+        return hits
+
+    def read_columns(self, names, start=0, stop=None):
+        ''' Return dict of hit columns (au.hit_dtype field names) in [start, stop) '''
+        stop = len(self) if stop is None else stop
+        columns = {}
+        if 'col' in names or 'row' in names:
+            columns['col'], columns['row'] = unpack_pixel(self.group.pixel[start:stop])
+        if 'le' in names or 'te' in names:
+            columns['le'], columns['te'] = unpack_tot(self.group.tot[start:stop])
+        if 'token_id' in names:
+            columns['token_id'] = self.group.token_id[start:stop]
+        if 'scan_param_id' in names:
+            columns['scan_param_id'] = self.group.scan_param_id[start:stop]
+        if 'timestamp' in names:
+            columns['timestamp'] = self._read_timestamps(start, stop)
+        return {name: columns[name] for name in names}
+
+    def _read_timestamps(self, start, stop):
+        timestamps = np.zeros(max(stop - start, 0), dtype=np.int64)
+        for chunk in self.chunk_stats:
+            chunk_start, chunk_stop = int(chunk['index_start']), int(chunk['index_stop'])
+            if chunk_stop <= start or chunk_start >= stop:
+                continue
+            # Differences are relative within a chunk, read from chunk start to reconstruct absolute values
+            diff = self.group.timestamp_diff[chunk_start:min(chunk_stop, stop)]
+            values = chunk['timestamp_start'] + np.cumsum(diff)
+            first = max(start, chunk_start)
+            timestamps[first - start:min(chunk_stop, stop) - start] = values[first - chunk_start:]
+        return timestamps
+
+
+def create_hit_storage(h5_file, name, title, hit_format='table', filters=None, expectedrows=1000000):
+    ''' Create hit storage node. Returned object provides append() and flush(). '''
+    if hit_format not in HIT_FORMATS:
+        raise ValueError('Unknown hit format %s, use one of %s' % (hit_format, str(HIT_FORMATS)))
+    if filters is None:
+        filters = tb.Filters(complib='blosc', complevel=5, fletcher32=False)
+    if hit_format == 'columnar':
+        return ColumnarHitWriter(h5_file, name=name, title=title, filters=filters, expectedrows=expectedrows)
+    return h5_file.create_table(h5_file.root, name=name, description=au.hit_dtype, title=title,
+                                expectedrows=expectedrows, filters=filters)
+
+
+def open_hits(node):
+    ''' Return hit reader supporting len() and slicing for hit table or columnar hit group '''
+    if isinstance(node, tb.Group):
+        return ColumnarHits(node)
+    return node
@@ -23,32 +23,32 @@ class_spec = [
 ]
 
 
-@numba.njit
+@numba.njit(cache=True)
 def is_tjmono(word):
     return (word & 0xF8000000) == 0x40000000
 
 
-@numba.njit
+@numba.njit(cache=True)
 def is_tlu(word):
     return word & 0x80000000 == 0x80000000
 
 
-@numba.njit
+@numba.njit(cache=True)
 def is_tdc(word):
     return word & 0xF0000000 == 0x20000000
 
 
-@numba.njit
+@numba.njit(cache=True)
 def is_tjmono_timestamp_msb(word):
     return (word & 0xFC000000) == 0x4C000000
 
 
-@numba.njit
+@numba.njit(cache=True)
 def is_tjmono_timestamp_lsb(word):
     return (word & 0xFC000000) == 0x48000000
 
 
-@numba.njit
+@numba.njit(cache=True)
 def get_tlu_word(word, trigger_data_format):
     if trigger_data_format == 2:
         return word & 0xFFFF, (word >> 16) & 0x7FFF
@@ -58,7 +58,7 @@ def get_tlu_word(word, trigger_data_format):
         return word & 0x7FFFFFFF, 0
 
 
-@numba.njit
+@numba.njit(cache=True)
 def get_tdc_value(word):
     return word & 0xFFF
 
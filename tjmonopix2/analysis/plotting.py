@@ -21,10 +21,10 @@ from matplotlib.figure import Figure
 from matplotlib.artist import setp
 from matplotlib.backends.backend_agg import FigureCanvasAgg as FigureCanvas
 from mpl_toolkits.axes_grid1 import make_axes_locatable
-from matplotlib import colors, cm
+from matplotlib import colors
 from matplotlib.backends.backend_pdf import PdfPages
 
-from tjmonopix2.system import logger
+from tjmonopix2.system import logger, profiling
 from tjmonopix2.analysis import analysis_utils as au
 
 TITLE_COLOR = '#07529a'
@@ -167,6 +167,7 @@ class Plotting(object):
             shutil.copyfile(self.filename, os.path.join(os.path.split(self.filename)[0], 'last_scan.pdf'))
 
     ''' User callable plotting functions '''
+    @profiling.stage('plotting')
     def create_standard_plots(self):
         if self.skip_plotting:
             return
@@ -721,7 +722,7 @@ class Plotting(object):
         ax.set_adjustable('box')
         extent = self.plot_box_bounds
         bounds = np.linspace(start=z_min, stop=z_max + (1 if extend_upper_bound else 0), num=255, endpoint=True)
-        cmap = copy.copy(cm.get_cmap('plasma'))
+        cmap = copy.copy(plt.get_cmap('plasma'))
         cmap.set_bad('w')
         cmap.set_over('r')  # Make noisy pixels red
         cmap.set_under('g')
@@ -833,9 +834,9 @@ class Plotting(object):
         else:
             bounds = np.linspace(start=z_min, stop=z_max, num=int(z_max + 1), endpoint=True)
         if centered_ticks:
-            cmap = copy.copy(cm.get_cmap('plasma', (z_max)))
+            cmap = copy.copy(plt.get_cmap('plasma', (z_max)))
         else:
-            cmap = copy.copy(cm.get_cmap('plasma'))
+            cmap = copy.copy(plt.get_cmap('plasma'))
         cmap.set_bad('w')
         norm = colors.BoundaryNorm(bounds, cmap.N)
 
@@ -937,7 +938,7 @@ class Plotting(object):
         self._add_text(fig)
 
         fig.patch.set_facecolor('white')
-        cmap = copy.copy(cm.get_cmap('cool'))
+        cmap = copy.copy(plt.get_cmap('cool'))
         if np.allclose(hist, 0.0) or hist.max() <= 1:
             z_max = 1.0
         else:
@@ -1013,7 +1014,7 @@ class Plotting(object):
         ax = fig.add_subplot(111)
         self._add_text(fig)
 
-        cmap = copy.copy(cm.get_cmap('viridis', (range_tdac)))
+        cmap = copy.copy(plt.get_cmap('viridis', (range_tdac)))
         # create dicts for tdac data
         data_thres_tdac = {}
         hist_tdac = {}
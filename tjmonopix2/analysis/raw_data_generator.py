@@ -0,0 +1,443 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Synthetic raw data in the format of the readout system, e.g. for benchmarks and tests.
+
+    TJ-Monopix2 data words (identifier 0x4) carry three 9-bit symbols. A frame of hits is
+    SOF, 4 symbols per hit and EOF, padded with IDLE symbols to full data words:
+        col >> 1 | gray(le) << 1, gray(te) >> 6 | gray(te) & 0x3F << 2, col & 1 << 1, row >> 8 | row & 0xFF
+    Timestamp words (0x4C MSB, 0x48 LSB) precede frames, TLU words (bit 31) use one of the trigger
+    data formats (0: 31-bit trigger number, 1: 31-bit timestamp, 2: 15-bit timestamp and 16-bit
+    trigger number), TDC words have identifier 0x2.
+
+    write_scan_file() writes complete scan output files of arbitrary size, e.g. for analysis
+    benchmarks at scale and for fuzzing of the analysis with realistic files.
+'''
+
+import importlib
+import time
+
+import numpy as np
+import tables as tb
+import yaml
+from scipy.special import erf
+
+from tjmonopix2 import utils
+
+SOF, EOF, IDLE = 0x1bc, 0x17c, 0x13c
+TJ_HEADER, TIMESTAMP_LSB_HEADER, TIMESTAMP_MSB_HEADER = 0x40000000, 0x48000000, 0x4C000000
+TLU_HEADER, TDC_HEADER = 0x80000000, 0x20000000
+
+
+def _bin2gray(value):
+    return value ^ (value >> 1)
+
+
+def encode_hits(col, row, le, te, frame_sizes=None):
+    '''
+        Encode hits into TJ-Monopix2 data words
+
+        Parameters:
+        ----------
+        col, row, le, te : np.array
+                Hit information, le and te are 7-bit values
+        frame_sizes : np.array
+                Number of hits per frame, default is one hit per frame
+
+        Returns data words and the index of the first data word of each frame.
+    '''
+    col, row = np.asarray(col, dtype=np.uint32), np.asarray(row, dtype=np.uint32)
+    le_gray, te_gray = _bin2gray(np.asarray(le, dtype=np.uint32) & 0x7F), _bin2gray(np.asarray(te, dtype=np.uint32) & 0x7F)
+    if frame_sizes is None:
+        frame_sizes = np.ones(col.shape[0], dtype=np.int64)
+    frame_sizes = np.asarray(frame_sizes, dtype=np.int64)
+    if frame_sizes.sum() != col.shape[0]:
+        raise ValueError('Sum of frame sizes (%d) has to be the number of hits (%d)' % (frame_sizes.sum(), col.shape[0]))
+
+    symbols = np.empty((col.shape[0], 4), dtype=np.uint32)
+    symbols[:, 0] = (col >> 1) & 0xFF
+    symbols[:, 1] = (le_gray << 1) | (te_gray >> 6)
+    symbols[:, 2] = ((te_gray & 0x3F) << 2) | ((col & 0x1) << 1) | ((row >> 8) & 0x1)
+    symbols[:, 3] = row & 0xFF
+    symbols = symbols.ravel()
+
+    # Frame markers and padding to full data words, inserted in stream order (np.insert is stable)
+    frame_stop = np.cumsum(frame_sizes) * 4
+    frame_start = frame_stop - frame_sizes * 4
+    n_padding = (-(frame_sizes * 4 + 2)) % 3
+    indices = np.concatenate([frame_start, frame_stop, np.repeat(frame_stop, n_padding)])
+    values = np.concatenate([np.full(frame_start.shape[0], SOF), np.full(frame_stop.shape[0], EOF), np.full(n_padding.sum(), IDLE)]).astype(np.uint32)
+    order = np.lexsort((np.concatenate([np.full(frame_start.shape[0], 2), np.zeros_like(frame_stop), np.ones(n_padding.sum(), dtype=np.int64)]), indices))  # EOF, IDLE, SOF
+    symbols = np.insert(symbols, indices[order], values[order]).reshape(-1, 3)
+
+    words = TJ_HEADER | (symbols[:, 0] << 18) | (symbols[:, 1] << 9) | symbols[:, 2]
+    frame_words = (frame_sizes * 4 + 2 + n_padding) // 3
+    return words.astype(np.uint32), np.cumsum(frame_words) - frame_words
+
+
+def timestamp_words(timestamps):
+    ''' MSB and LSB timestamp words, interleaved '''
+    timestamps = np.asarray(timestamps, dtype=np.uint64)
+    words = np.empty((timestamps.shape[0], 2), dtype=np.uint32)
+    words[:, 0] = TIMESTAMP_MSB_HEADER | ((timestamps >> np.uint64(26)) & np.uint64(0x3FFFFFF)).astype(np.uint32)
+    words[:, 1] = TIMESTAMP_LSB_HEADER | (timestamps & np.uint64(0x3FFFFFF)).astype(np.uint32)
+    return words.ravel()
+
+
+def tlu_words(trigger_numbers, timestamps, trigger_data_format=2):
+    ''' TLU words in given trigger data format, the inverse of interpreter.get_tlu_word() '''
+    trigger_numbers, timestamps = np.asarray(trigger_numbers, dtype=np.uint32), np.asarray(timestamps, dtype=np.uint32)
+    if trigger_data_format == 2:
+        words = ((timestamps & 0x7FFF) << 16) | (trigger_numbers & 0xFFFF)
+    elif trigger_data_format == 1:
+        words = timestamps & 0x7FFFFFFF
+    elif trigger_data_format == 0:
+        words = trigger_numbers & 0x7FFFFFFF
+    else:
+        raise ValueError('Unknown trigger data format %s' % trigger_data_format)
+    return (TLU_HEADER | words).astype(np.uint32)
+
+
+def _tlu_timestamps(words, trigger_data_format):
+    ''' Trigger timestamps of TLU words as interpreted, 0 if the format has no timestamp '''
+    if trigger_data_format == 2:
+        return (words >> 16) & 0x7FFF
+    if trigger_data_format == 1:
+        return words & 0x7FFFFFFF
+    return np.zeros_like(words)
+
+
+def tdc_words(values):
+    return (TDC_HEADER | (np.asarray(values, dtype=np.uint32) & 0xFFF)).astype(np.uint32)
+
+
+def insert_words(words, indices, inserted_words):
+    '''
+        Insert blocks of words before the given word indices.
+
+        inserted_words has shape (len(indices), n): n words are inserted at each index in given order
+    '''
+    inserted_words = np.asarray(inserted_words, dtype=np.uint32)
+    n = inserted_words.shape[1]
+    return np.insert(words, np.repeat(indices, n), inserted_words.ravel()).astype(np.uint32)
+
+
+def _random_tot(rng, n_hits, mean_tot=20, max_tot=127):
+    ''' Landau like ToT distribution '''
+    return np.clip(rng.gamma(4., mean_tot / 4., size=n_hits), 1, max_tot).astype(np.uint32)
+
+
+def _hit_words(rng, col, row, tot, frame_sizes=None):
+    le = rng.integers(0, 128, size=col.shape[0], dtype=np.uint32)
+    return encode_hits(col, row, le, (le + tot) & 0x7F, frame_sizes)
+
+
+def uniform_hits(n_hits, hits_per_frame=4, seed=0):
+    ''' Hits uniformly distributed over the matrix with timestamp words before every frame '''
+    rng = np.random.default_rng(seed)
+    frame_sizes = np.full(-(-n_hits // hits_per_frame), hits_per_frame, dtype=np.int64)
+    frame_sizes[-1] = n_hits - hits_per_frame * (frame_sizes.shape[0] - 1)
+    col, row = rng.integers(0, 512, size=n_hits), rng.integers(0, 512, size=n_hits)
+    words, frame_start = _hit_words(rng, col, row, _random_tot(rng, n_hits), frame_sizes)
+    timestamps = np.cumsum(rng.integers(1, 1000, size=frame_sizes.shape[0]))
+    return insert_words(words, frame_start, timestamp_words(timestamps).reshape(-1, 2))
+
+
+def _clusters(rng, n_clusters, mean_cluster_size):
+    ''' Seed pixel and neighbouring pixels of each cluster '''
+    cluster_sizes = 1 + rng.poisson(mean_cluster_size - 1, size=n_clusters)
+    seed_col = np.repeat(rng.integers(1, 511, size=n_clusters), cluster_sizes)
+    seed_row = np.repeat(rng.integers(1, 511, size=n_clusters), cluster_sizes)
+    col = np.clip(seed_col + rng.integers(-1, 2, size=seed_col.shape[0]), 0, 511)
+    row = np.clip(seed_row + rng.integers(-1, 2, size=seed_row.shape[0]), 0, 511)
+    first = np.cumsum(cluster_sizes) - cluster_sizes
+    col[first], row[first] = seed_col[first], seed_row[first]
+    return col, row, cluster_sizes
+
+
+def source_hits(n_clusters, mean_cluster_size=2.5, seed=0):
+    ''' Clustered hits (e.g. radioactive source), one frame with own timestamp per cluster '''
+    rng = np.random.default_rng(seed)
+    col, row, cluster_sizes = _clusters(rng, n_clusters, mean_cluster_size)
+    words, frame_start = _hit_words(rng, col, row, _random_tot(rng, col.shape[0]), cluster_sizes)
+    timestamps = np.cumsum(rng.integers(10, 10000, size=n_clusters))
+    return insert_words(words, frame_start, timestamp_words(timestamps).reshape(-1, 2))
+
+
+def triggered_hits(n_triggers, mean_cluster_size=2.5, trigger_distance=500, hit_delay=200, tdc=True, trigger_data_format=2, seed=0):
+    '''
+        TLU words, TDC words and one cluster per trigger.
+
+        The hit timestamp is hit_delay after the (overflow corrected) trigger timestamp,
+        as expected by the event building. Without trigger timestamp (trigger data format 0)
+        the hit timestamp is hit_delay.
+    '''
+    rng = np.random.default_rng(seed)
+    col, row, cluster_sizes = _clusters(rng, n_triggers, mean_cluster_size)
+    words, frame_start = _hit_words(rng, col, row, _random_tot(rng, col.shape[0]), cluster_sizes)
+
+    trigger_times = np.cumsum(rng.integers(trigger_distance // 2, trigger_distance * 3 // 2, size=n_triggers))
+    tlu = tlu_words(np.arange(1, n_triggers + 1), trigger_times, trigger_data_format)
+    trigger_ts = _tlu_timestamps(tlu, trigger_data_format).astype(np.int64)
+    # Event building adds 0x7FFFFFFF to the trigger timestamp at every overflow of the trigger timestamp
+    n_overflows = np.cumsum(np.append(0, np.diff(trigger_ts) < 0))
+    hit_timestamps = trigger_ts + n_overflows * 0x7FFFFFFF + hit_delay
+
+    header = [tlu]
+    if tdc:
+        header.append(tdc_words(rng.integers(1, 4096, size=n_triggers)))
+    header.append(timestamp_words(hit_timestamps).reshape(-1, 2).T)
+    return insert_words(words, frame_start, np.vstack(header).T)
+
+
+def injection_scan(scan_params, n_injections=100, pixels=None, threshold=30., noise=3., seed=0):
+    '''
+        Hits of a threshold scan, every pixel responds to the injection with
+        the probability of an S-curve with given threshold and noise
+
+        Parameters:
+        ----------
+        scan_params : iterable
+                Injected charge per scan parameter id
+        pixels : tuple of np.array
+                Injected columns and rows, default is every pixel
+        threshold, noise: float or np.array
+                Threshold and noise of each pixel in units of the scan parameter
+
+        Returns list of raw data words per scan parameter id
+    '''
+    rng = np.random.default_rng(seed)
+    if pixels is None:
+        pixels = np.meshgrid(np.arange(512), np.arange(512), indexing='ij')
+    col, row = np.asarray(pixels[0]).ravel(), np.asarray(pixels[1]).ravel()
+    threshold = np.broadcast_to(rng.normal(threshold, noise, size=col.shape[0]) if np.isscalar(threshold) else threshold, col.shape)
+    noise = np.broadcast_to(noise, col.shape)
+
+    raw_data = []
+    for charge in scan_params:
+        probability = 0.5 * (1. + erf((charge - threshold) / (np.sqrt(2.) * np.maximum(noise, 1e-6))))
+        n_hits = rng.binomial(n_injections, probability)
+        hit_col, hit_row = np.repeat(col, n_hits), np.repeat(row, n_hits)
+        tot = np.clip(np.repeat((charge - threshold) / 2., n_hits) + rng.normal(0, 1, size=hit_col.shape[0]), 1, 127).astype(np.uint32)
+        words, _ = _hit_words(rng, hit_col, hit_row, tot)
+        raw_data.append(words)
+    return raw_data
+
+
+# Scan written by write_scan_file() for each kind of data: scan_id, module with the default scan configuration
+SCANS = {'uniform': ('source_scan', 'scan_source'),
+         'source': ('source_scan', 'scan_source'),
+         'triggered': ('ext_trigger_scan', 'scan_ext_trigger'),
+         'threshold': ('threshold_scan', 'scan_threshold')}
+# Approximate raw data words per generated item (hit, cluster, trigger) to size the data blocks
+WORDS_PER_ITEM = {'uniform': 2, 'source': 6, 'triggered': 8}
+
+
+class _DataBlock(object):
+    '''
+        Raw data block that can be written repeatedly as if it was recorded later:
+        timestamps and trigger numbers are shifted, the rest of the data is unchanged
+    '''
+
+    def __init__(self, words, trigger_data_format):
+        self.words = words
+        self.trigger_data_format = trigger_data_format
+
+        self.msb_index = np.flatnonzero((words & 0xFC000000) == TIMESTAMP_MSB_HEADER)
+        self.timestamps = (((words[self.msb_index] & 0x3FFFFFF).astype(np.int64) << 26) |
+                           (words[self.msb_index + 1] & 0x3FFFFFF).astype(np.int64))
+        self.tlu_index = np.flatnonzero(words & TLU_HEADER)
+        trigger_ts = _tlu_timestamps(words[self.tlu_index], trigger_data_format).astype(np.int64)
+        self.triggered = self.tlu_index.shape[0] > 0
+        if self.triggered:
+            self.first_trigger_ts, self.last_trigger_ts = trigger_ts[0], trigger_ts[-1]
+            self.n_overflows = np.count_nonzero(np.diff(trigger_ts) < 0)
+        self.trigger_number_mask = {0: 0x7FFFFFFF, 1: 0, 2: 0xFFFF}[trigger_data_format]
+
+    def timestamp_step(self, next_block):
+        ''' Timestamp shift of the next block relative to this block '''
+        if self.triggered:  # keep the overflow correction of the event building consistent
+            return (self.n_overflows + int(next_block.first_trigger_ts < self.last_trigger_ts)) * 0x7FFFFFFF
+        distance = (self.timestamps[-1] - self.timestamps[0]) // max(self.timestamps.shape[0] - 1, 1) + 1
+        return int(self.timestamps[-1] + distance - next_block.timestamps[0])
+
+    def get_words(self, timestamp_offset=0, trigger_number_offset=0, out=None):
+        ''' Data words shifted by the offsets, written to out if given (array of the block size) '''
+        if timestamp_offset == 0 and trigger_number_offset == 0:
+            return self.words
+        words = np.empty_like(self.words) if out is None else out
+        words[:] = self.words
+        timestamps = self.timestamps + timestamp_offset
+        words[self.msb_index] = TIMESTAMP_MSB_HEADER | (timestamps >> 26).astype(np.uint32)
+        words[self.msb_index + 1] = TIMESTAMP_LSB_HEADER | (timestamps & 0x3FFFFFF).astype(np.uint32)
+        if self.trigger_number_mask:
+            tlu = self.words[self.tlu_index]
+            trigger_numbers = (tlu & self.trigger_number_mask).astype(np.int64) + trigger_number_offset
+            words[self.tlu_index] = (tlu & ~np.uint32(self.trigger_number_mask)) | (trigger_numbers & self.trigger_number_mask).astype(np.uint32)
+        return words
+
+
+def _generate_block(kind, n_words, trigger_data_format, seed, **kwargs):
+    n_items = max(n_words // WORDS_PER_ITEM[kind], 1)
+    if kind == 'uniform':
+        return uniform_hits(n_items, seed=seed, **kwargs)
+    if kind == 'source':
+        return source_hits(n_items, seed=seed, **kwargs)
+    return triggered_hits(n_items, trigger_data_format=trigger_data_format, seed=seed, **kwargs)
+
+
+def _repeat_blocks(pool, n_repeated):
+    ''' Generator of the raw data of n_repeated blocks, blocks of the pool are shifted in time at every repetition '''
+    timestamp_offset, trigger_number_offset = 0, 0
+    previous = None
+    buffers = [np.empty_like(block.words) for block in pool]  # the data of a block is written before the block is repeated
+    for i in range(n_repeated):
+        block = pool[i % len(pool)]
+        if previous is not None:
+            timestamp_offset += previous.timestamp_step(block)
+        yield block.get_words(timestamp_offset, trigger_number_offset, out=buffers[i % len(pool)])
+        trigger_number_offset += block.tlu_index.shape[0]
+        previous = block
+
+
+def write_scan_file(filename, kind='source', n_words=10000000, scan_config=None, trigger_data_format=2, compression='fast-write',
+                    block_words=2 ** 22, n_blocks=4, readout_words=2 ** 16, word_rate=1e7, seed=0, **kwargs):
+    '''
+        Write a raw data file in the format of ScanBase (configuration_in, raw_data, meta_data,
+        scan_param_ranges, rx_status, configuration_out) that can be analyzed and plotted like
+        the output of a scan with the default chip configuration.
+
+        Parameters:
+        ----------
+        kind : string
+                'uniform', 'source' (source scan), 'triggered' (external trigger scan) or 'threshold' (threshold scan)
+        n_words : int
+                Raw data words to write, rounded up to full blocks. For threshold scans the data size is given by the scan configuration.
+        scan_config : dict
+                Overwrites the default scan configuration of the scan
+        trigger_data_format : int
+                Trigger data format of the TLU words, also stored in the TLU test bench settings
+        compression : string
+                Compression profile, see utils.get_filters()
+        block_words, n_blocks : int
+                n_blocks blocks of about block_words words are generated and repeated with shifted
+                timestamps and trigger numbers, thus large files are written with disk speed
+        readout_words, word_rate : int, float
+                Words per readout (meta data row) and words per second for the readout timestamps
+        kwargs :
+                Arguments of the data generator, e.g. mean_cluster_size or (for threshold scans) threshold and noise
+
+        Returns the number of written raw data words.
+    '''
+    # Only needed for writing files, the data generation does not depend on the readout system
+    from tjmonopix2.system import scan_base
+    from tjmonopix2.system.tjmonopix2 import TJMonoPix2
+
+    scan_id, scan_module = SCANS[kind]
+    scan_config = dict(importlib.import_module('tjmonopix2.scans.' + scan_module).scan_configuration, **(scan_config or {}))
+    with open(scan_base.TESTBENCH_DEFAULT_FILE, 'r') as f:
+        bench = yaml.full_load(f)
+    bench['general']['compression'] = compression
+    bench['TLU']['DATA_FORMAT'] = trigger_data_format
+    module_name, module_settings = next(iter(bench.pop('modules').items()))
+    chip_name = next(k for k, v in module_settings.items() if isinstance(v, dict) and 'chip_sn' in v)
+    chip_settings = module_settings.pop(chip_name)
+    chip_settings['chip_config_file'] = scan_base.DEFAULT_CONFIG_FILE
+    module_settings['name'] = module_name
+    with open(scan_base.DEFAULT_CONFIG_FILE, 'r') as f:
+        chip_conf = yaml.full_load(f)
+    chip = TJMonoPix2(None, chip_sn=chip_settings['chip_sn'], chip_id=chip_settings['chip_id'], receiver=chip_settings['receiver'], config=chip_conf)
+    pixels = (slice(scan_config['start_column'], scan_config['stop_column']), slice(scan_config['start_row'], scan_config['stop_row']))
+    chip.masks['enable'][pixels] = True
+
+    # Scan parameters and raw data blocks per scan parameter id
+    scan_parameters = {}
+    if kind == 'threshold':
+        chip.masks['injection'][pixels] = True
+        vcal_low_range = range(scan_config['VCAL_LOW_start'], scan_config['VCAL_LOW_stop'], scan_config['VCAL_LOW_step'])
+        col, row = np.meshgrid(np.arange(512)[pixels[0]], np.arange(512)[pixels[1]], indexing='ij')
+        raw_data = injection_scan([scan_config['VCAL_HIGH'] - vcal_low for vcal_low in vcal_low_range], n_injections=scan_config['n_injections'],
+                                  pixels=(col, row), seed=seed, **kwargs)
+        blocks = []
+        for scan_param_id, vcal_low in enumerate(vcal_low_range):
+            scan_parameters[scan_param_id] = {'vcal_high': scan_config['VCAL_HIGH'], 'vcal_low': vcal_low}
+            blocks.append([raw_data[scan_param_id]])
+        chip.registers['VH'].set(scan_config['VCAL_HIGH'])
+        chip.registers['VL'].set(vcal_low_range[-1])
+    else:
+        pool = [_DataBlock(_generate_block(kind, block_words, trigger_data_format, seed + i, **kwargs), trigger_data_format) for i in range(n_blocks)]
+        pool_words = np.cumsum([block.words.shape[0] for block in pool])
+        n_cycles, n_remaining = divmod(int(n_words), int(pool_words[-1]))
+        n_repeated = n_cycles * n_blocks + (int(np.searchsorted(pool_words, n_remaining)) + 1 if n_remaining else 0)
+        blocks = [_repeat_blocks(pool, n_repeated)]
+
+    # Scan without readout system, only its configuration writing is used
+    scan = scan_base.ScanBase()
+    scan.scan_id = scan_id
+    scan.run_name = time.strftime('%Y%m%d_%H%M%S') + '_' + scan_id
+    scan.configuration = {'bench': bench}
+    scan.scan_parameters = scan_parameters
+    scan.chip, scan.chip_settings, scan.module_settings, scan.scan_config = chip, chip_settings, module_settings, scan_config
+    start_time = time.time()
+    with tb.open_file(filename, mode='w', title=scan_id) as h5_file:
+        h5_file.create_group(h5_file.root, 'configuration_in', 'Configuration before scan')
+        scan._write_config_h5(h5_file, h5_file.root.configuration_in)
+
+        raw_data_earray = h5_file.create_earray(h5_file.root, name='raw_data', atom=tb.UIntAtom(), shape=(0,), title='raw_data',
+                                                filters=utils.get_filters('raw_data', compression))
+        meta_data_table = h5_file.create_table(h5_file.root, name='meta_data', description=scan_base.MetaTable, title='meta_data',
+                                               filters=utils.get_filters('tables', compression))
+        scan_param_range_table = h5_file.create_table(h5_file.root, name='scan_param_ranges', description=scan_base.ScanParamRangeTable,
+                                                      title='Raw data words and readouts of each readout() call', filters=utils.get_filters('tables', compression))
+        h5_file.create_table(h5_file.root, name='rx_status', description=scan_base.RxStatusTable,
+                             title='Changes of RX status and error counters', filters=utils.get_filters('tables', compression))
+
+        for scan_param_id, scan_param_blocks in enumerate(blocks):
+            index_start = raw_data_earray.nrows
+            for words in scan_param_blocks:
+                raw_data_earray.append(words)
+            index_stop = raw_data_earray.nrows
+
+            # One meta data row per readout, readouts of a scan parameter do not include data of other scan parameters
+            readout_start = np.arange(index_start, max(index_stop, index_start + 1), readout_words, dtype=np.int64)
+            meta_data = np.zeros(readout_start.shape[0], dtype=meta_data_table.dtype)
+            meta_data['index_start'] = readout_start
+            meta_data['index_stop'] = np.append(readout_start[1:], index_stop)
+            meta_data['data_length'] = meta_data['index_stop'] - meta_data['index_start']
+            meta_data['timestamp_start'] = start_time + meta_data['index_start'] / word_rate
+            meta_data['timestamp_stop'] = start_time + meta_data['index_stop'] / word_rate
+            meta_data['monotonic_start_ns'] = meta_data['index_start'] * 1e9 / word_rate
+            meta_data['monotonic_stop_ns'] = meta_data['index_stop'] * 1e9 / word_rate
+            meta_data['scan_param_id'] = scan_param_id
+            meta_data_table.append(meta_data)
+            scan_param_range_table.append([(scan_param_id, index_start, index_stop, readout_start.shape[0])])
+        meta_data_table.flush()
+        scan_param_range_table.flush()
+
+        node = h5_file.create_group(h5_file.root, 'configuration_out', 'Configuration after scan step')
+        scan._write_config_h5(h5_file, node)
+        scan._store_scan_par_values(h5_file)
+        return raw_data_earray.nrows
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Write a synthetic scan output file')
+    parser.add_argument('filename')
+    parser.add_argument('--kind', default='source', choices=sorted(SCANS.keys()))
+    parser.add_argument('--n_words', type=float, default=1e7, help='Raw data words, not used for threshold scans')
+    parser.add_argument('--trigger_data_format', type=int, default=2, choices=(0, 1, 2))
+    parser.add_argument('--compression', default='fast-write', choices=sorted(utils.COMPRESSION_PROFILES.keys()))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.time()
+    n_words = write_scan_file(args.filename, kind=args.kind, n_words=int(args.n_words), trigger_data_format=args.trigger_data_format,
+                              compression=args.compression, seed=args.seed)
+    print('Wrote %d words in %.1f s (%.0f MB/s)' % (n_words, time.time() - start, n_words * 4 / (time.time() - start) / 1e6))
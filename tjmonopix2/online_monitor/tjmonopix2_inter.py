@@ -1,8 +1,10 @@
 import numpy as np
+import zmq
 
 from online_monitor.converter.transceiver import Transceiver
 from online_monitor.utils import utils
 
+from tjmonopix2 import utils as tj_utils
 from tjmonopix2.analysis.interpreter import RawDataInterpreter
 from tjmonopix2.analysis import analysis_utils as au
 
@@ -45,14 +47,35 @@ class TJMonopix2(Transceiver):
         self.tps = 0.  # Triggers per second
         self.total_trigger_words = 0
 
+    def recv_data(self):
+        ''' Receive data like the Transceiver, but also multipart messages (scan_base.send_data with multipart) '''
+        while not self.fe_stop.is_set():
+            self.fe_poller.poll(1)  # max block 1 ms
+            raw_data = []
+            # Loop over all frontends
+            for actual_frontend in self.frontends:
+                try:
+                    frames = actual_frontend[1].recv_multipart(flags=zmq.NOBLOCK, copy=False)
+                    raw_data.append((actual_frontend[0], self.deserialize_data(frames)))
+                except zmq.Again:  # no data
+                    pass
+            if raw_data:
+                self.raw_data.put_nowait(raw_data)
+
     def deserialize_data(self, data):
-        ''' Inverse of TJ-Monopix2 serialization '''
-        return utils.simple_dec(data)
+        ''' Inverse of TJ-Monopix2 serialization, single frame (online_monitor) or multipart '''
+        if len(data) == 1:
+            return utils.simple_dec(data[0].bytes)
+        return tj_utils.decode_multipart([data[0].bytes, data[1].buffer])
 
     def _add_to_meta_data(self, meta_data):
         ''' Meta data interpratation is deducing timings '''
 
-        ts_now = float(meta_data['timestamp_stop'])
+        # Monotonic readout time is precise and not affected by clock adjustments, not sent by older versions
+        if meta_data.get('monotonic_stop_ns') is not None:
+            ts_now = meta_data['monotonic_stop_ns'] * 1e-9
+        else:
+            ts_now = float(meta_data['timestamp_stop'])
 
         # Calculate readout per second with smoothing
         if ts_now != self.ts_last_readout:
@@ -10,8 +10,8 @@ import tables as tb
 
 from numba import njit
 
+from tjmonopix2 import utils
 from tjmonopix2.analysis import analysis_utils as au
-from tjmonopix2.analysis import analysis, plotting
 from tjmonopix2.scans.scan_threshold import ThresholdScan
 
 scan_configuration = {
@@ -52,6 +52,8 @@ class CalibrateToT(ThresholdScan):
     scan_id = 'calibrate_tot'
 
     def _analyze(self):
+        from tjmonopix2.analysis import analysis, plotting  # imported on use, slow to import
+
         with analysis.Analysis(raw_data_file=self.output_filename + '.h5', **self.configuration['bench']['analysis']) as a:
             a.analyze_data()
 
@@ -73,9 +75,7 @@ class CalibrateToT(ThresholdScan):
                                    name='InjTotCalibration',
                                    title='Injection Tot Calibration Fit',
                                    obj=inj_tot_cal,
-                                   filters=tb.Filters(complib='blosc',
-                                                      complevel=5,
-                                                      fletcher32=False))
+                                   filters=utils.get_filters('analysis', self.configuration['bench']['analysis'].get('compression', None)))
 
         if self.configuration['bench']['analysis']['create_pdf']:
             with plotting.Plotting(analyzed_data_file=a.analyzed_data_file) as p:
@@ -5,7 +5,6 @@
 # ------------------------------------------------------------
 #
 
-from tjmonopix2.analysis import analysis, plotting
 from tjmonopix2.scans.shift_and_inject import (get_scan_loop_mask_steps,
                                                shift_and_inject)
 from tjmonopix2.system.scan_base import ScanBase
@@ -29,14 +28,11 @@ class AnalogScan(ScanBase):
         # self.chip.masks['hitor'][0, 0] = True
 
         self.chip.masks.apply_disable_mask()
-        self.chip.masks.update(force=True)
+        self.chip.masks.update()
 
-        self.chip.registers["ITHR"].write(50)
-        self.chip.registers["IDB"].write(100)
-
-        self.chip.registers["VL"].write(30)
-        self.chip.registers["VH"].write(150)
-        self.chip.registers["SEL_PULSE_EXT_CONF"].write(0)
+        self.chip.registers.write_values({"ITHR": 50, "IDB": 100,
+                                          "VL": 30, "VH": 150,
+                                          "SEL_PULSE_EXT_CONF": 0})
 
     def _scan(self, n_injections=100, **_):
         pbar = tqdm(total=get_scan_loop_mask_steps(self.chip), unit='Mask steps')
@@ -47,6 +43,8 @@ class AnalogScan(ScanBase):
         self.log.success('Scan finished')
 
     def _analyze(self):
+        from tjmonopix2.analysis import analysis, plotting  # imported on use, slow to import
+
         with analysis.Analysis(raw_data_file=self.output_filename + '.h5', **self.configuration['bench']['analysis']) as a:
             a.analyze_data()
 
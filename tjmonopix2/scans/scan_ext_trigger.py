@@ -9,7 +9,6 @@ import time
 import threading
 from tqdm import tqdm
 
-from tjmonopix2.analysis import analysis, plotting
 from tjmonopix2.system.scan_base import ScanBase
 
 scan_configuration = {
@@ -92,6 +91,8 @@ class ExtTriggerScan(ScanBase):
         self.log.success('Scan finished')
 
     def _analyze(self):
+        from tjmonopix2.analysis import analysis, plotting  # imported on use, slow to import
+
         tot_calib_file = self.configuration['scan'].get('tot_calib_file', None)
         if tot_calib_file is not None:
             self.configuration['bench']['analysis']['cluster_hits'] = True
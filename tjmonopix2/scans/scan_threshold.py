@@ -5,7 +5,6 @@
 # ------------------------------------------------------------
 #
 
-from tjmonopix2.analysis import analysis, plotting
 from tjmonopix2.scans.shift_and_inject import (get_scan_loop_mask_steps,
                                                shift_and_inject)
 from tjmonopix2.system.scan_base import ScanBase
@@ -33,7 +32,7 @@ class ThresholdScan(ScanBase):
         self.chip.masks['injection'][start_column:stop_column, start_row:stop_row] = True
 
         self.chip.masks.apply_disable_mask()
-        self.chip.masks.update(force=True)
+        self.chip.masks.update()
 
         self.chip.registers["SEL_PULSE_EXT_CONF"].write(0)
 
@@ -56,6 +55,8 @@ class ThresholdScan(ScanBase):
         self.log.success('Scan finished')
 
     def _analyze(self):
+        from tjmonopix2.analysis import analysis, plotting  # imported on use, slow to import
+
         with analysis.Analysis(raw_data_file=self.output_filename + '.h5', **self.configuration['bench']['analysis']) as a:
             a.analyze_data()
 
@@ -64,12 +64,9 @@ class GDACTuning(ScanBase):
         self.chip.masks['tdac'][start_column:stop_column, start_row:stop_row] = 0b100
 
         self.chip.masks.apply_disable_mask()
-        self.chip.masks.update(force=True)
+        self.chip.masks.update()
 
-        self.chip.registers["VL"].write(VCAL_LOW)
-        self.chip.registers["VH"].write(VCAL_HIGH)
-
-        self.chip.registers["SEL_PULSE_EXT_CONF"].write(0)
+        self.chip.registers.write_values({"VL": VCAL_LOW, "VH": VCAL_HIGH, "SEL_PULSE_EXT_CONF": 0})
 
         self.data.hist_occ = oa.OccupancyHistogramming()
 
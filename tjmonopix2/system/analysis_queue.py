@@ -0,0 +1,164 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Background analysis queue that outlives single scans.
+
+    Scans submit their analysis (including writing the final configuration
+    to the analyzed file) and continue with data taking while the analysis
+    runs in a worker process. The number of concurrently running analyses is
+    limited by the number of workers and the available memory.
+'''
+
+import atexit
+import multiprocessing
+import queue
+import time
+import traceback
+from collections import OrderedDict
+
+from tjmonopix2 import utils
+from tjmonopix2.system import logger
+
+
+class AnalysisJob(object):
+    ''' Handle of one submitted analysis '''
+
+    def __init__(self, name, process):
+        self.name = name
+        self.process = process
+        self.status = 'queued'  # queued, running, finished, failed
+        self.error = None  # traceback of failed analysis
+
+    @property
+    def done(self):
+        return self.status in ('finished', 'failed')
+
+    def __repr__(self):
+        return 'AnalysisJob %s (%s)' % (self.name, self.status)
+
+
+class AnalysisQueue(object):
+    '''
+        Runs submitted analysis functions in worker processes.
+
+        Every job is forked at submission to inherit the state of the scan, but
+        waits for a free worker slot and enough memory before the analysis starts.
+        A job is marked finished only after the submitted function returned.
+    '''
+
+    def __init__(self, n_workers=None):
+        self.log = logger.setup_derived_logger('AnalysisQueue')
+
+        self.n_workers = n_workers if n_workers else multiprocessing.cpu_count()
+        self.jobs = OrderedDict()
+
+        self._slots = multiprocessing.Semaphore(self.n_workers)
+        self._n_running = multiprocessing.Value('i', 0)
+        self._progress = multiprocessing.Queue()
+
+    def submit(self, name, target, memory=0):
+        '''
+            Submit an analysis
+
+            Parameters:
+            ----------
+            name : str
+                    Unique name of the job, e.g. the raw data file name
+            target : callable
+                    Analysis function without arguments, executed in the worker process
+            memory : int
+                    Estimated peak memory of the analysis in bytes. The analysis does not start
+                    before this amount of memory is available or no other analysis is running.
+        '''
+        if name in self.jobs and not self.jobs[name].done:
+            raise RuntimeError('Analysis %s already submitted' % name)
+
+        slots, n_running, progress = self._slots, self._n_running, self._progress
+
+        def run():
+            with slots:
+                _wait_for_memory(memory, n_running)
+                with n_running.get_lock():
+                    n_running.value += 1
+                progress.put((name, 'running', None))
+                try:
+                    target()
+                except Exception:
+                    progress.put((name, 'failed', traceback.format_exc()))
+                    raise
+                else:
+                    progress.put((name, 'finished', None))
+                finally:
+                    with n_running.get_lock():
+                        n_running.value -= 1
+
+        # Non-daemonic to allow the analysis to use a process pool (e.g. for S-curve fits)
+        proc = multiprocessing.Process(target=run, name='Analysis ' + name)
+        proc.start()
+        self.log.info('Queued analysis of %s (%d pending)', name, self.n_pending() + 1)
+        self.jobs[name] = AnalysisJob(name, proc)
+        return self.jobs[name]
+
+    def update(self):
+        ''' Update the status of all jobs from the worker reports '''
+        while True:
+            try:
+                name, status, message = self._progress.get_nowait()
+            except queue.Empty:
+                break
+            job = self.jobs[name]
+            job.status = status
+            if status == 'running':
+                self.log.info('Analysis of %s started', name)
+            elif status == 'finished':
+                self.log.info('Analysis of %s finished (%d pending)', name, self.n_pending())
+            else:
+                job.error = message
+                self.log.error('Analysis of %s failed (%d pending)', name, self.n_pending())
+        # Catch processes that died without reporting, e.g. killed due to missing memory
+        for job in self.jobs.values():
+            if not job.done and job.process.exitcode is not None and job.process.exitcode < 0:
+                job.status = 'failed'
+                job.error = 'Analysis process of %s terminated with signal %d\n' % (job.name, -job.process.exitcode)
+                self.log.error('Analysis of %s failed (%d pending)', job.name, self.n_pending())
+
+    def wait(self, jobs=None):
+        ''' Block until the given jobs (default: all jobs) are done '''
+        jobs = list(self.jobs.values()) if jobs is None else jobs
+        pending = [job for job in jobs if job.process.is_alive()]
+        if pending:
+            self.log.info('Waiting for %d analysis process(es) to finish...', len(pending))
+        for job in pending:
+            while job.process.is_alive():  # collect reports while waiting, otherwise the queue can block the process exit
+                self.update()
+                job.process.join(timeout=1.)
+        self.update()
+
+    def n_pending(self):
+        return len([job for job in self.jobs.values() if not job.done])
+
+
+def _wait_for_memory(memory, n_running, interval=1.):
+    ''' Wait until the required memory is available, but do not wait if nothing else is running '''
+    while memory and n_running.value > 0:
+        available_memory = utils.get_available_memory()
+        if available_memory is None or available_memory > memory:
+            return
+        time.sleep(interval)
+
+
+_analysis_queue = None
+
+
+def get_analysis_queue(n_workers=None):
+    ''' Return the analysis queue of this process, create it on first use '''
+    global _analysis_queue
+    if _analysis_queue is None:
+        _analysis_queue = AnalysisQueue(n_workers=n_workers)
+        atexit.register(_analysis_queue.wait)  # do not exit before all analyses are done
+    return _analysis_queue
@@ -8,7 +8,6 @@ import collections
 import os
 import time
 
-import pkg_resources
 import yaml
 import numpy as np
 import math
@@ -16,14 +15,16 @@ from basil.dut import Dut
 
 from tjmonopix2.system import logger
 from tjmonopix2.system.tjmono2_rx import tjmono2_rx
-
-VERSION = pkg_resources.get_distribution("tjmonopix2").version
+from tjmonopix2.utils import VERSION
 
 
 class BDAQ53(Dut):
     '''
     Main class for BDAQ53 readout system
     '''
+    # DATA_IDENTIFIER (bits 31..28 of the data words) of the RX modules in the firmware (tjmonopix2_core.v)
+    rx_data_identifiers = {'rx0': 0b0100}
+
     def __init__(self, conf=None, bench_config=None):
         self.log = logger.setup_main_logger()
         self.proj_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
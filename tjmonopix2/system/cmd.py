@@ -82,6 +82,10 @@ class cmd(RegisterHardwareLayer):
         super(cmd, self).init()
         self._mem_size = self.get_mem_size()
 
+    def has_start_addr(self):
+        ''' Commands always start at memory address 0 in this firmware version, the next command cannot be written while a command is sent '''
+        return False
+
     def get_mem_size(self):
         return self.MEM_BYTES
 
@@ -153,8 +157,8 @@ class cmd(RegisterHardwareLayer):
         self.CHIP_TYPE = value
 
     def set_data(self, data, addr=0):
-        if self._mem_size < len(data):
-            raise ValueError('Size of data (%d bytes) is too big for memory (%d bytes)' % (len(data), self._mem_size))
+        if self._mem_size < addr + len(data):
+            raise ValueError('Size of data (%d bytes) at address %d is too big for memory (%d bytes)' % (len(data), addr, self._mem_size))
         self._intf.write(self._conf['base_addr'] + self._mem_offset + addr, data)
 
     def get_data(self, size=None, addr=0):
@@ -0,0 +1,138 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Publishing of raw data to the online monitor from a separate process.
+
+    The readout thread only copies the raw data into a shared memory ring buffer.
+    Serialization and sending happen in the publisher process, thus a slow or
+    stalled online monitor cannot delay the readout and the writing to disk.
+'''
+
+import multiprocessing
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+import zmq
+
+from tjmonopix2 import utils
+from tjmonopix2.system import logger
+
+
+class DataPublisher(object):
+    '''
+        Publish readouts via ZeroMQ PUB socket from a sidecar process.
+
+        Back pressure:
+        - ring buffer full: the readout is not published (counted in n_dropped_buffer)
+        - send queue of socket full: the readout is not published (counted in n_dropped_socket)
+    '''
+
+    def __init__(self, socket_addr, buffer_words=16 * 1024 * 1024, hwm=None, multipart=False, name='ReadoutData'):
+        self.log = logger.setup_derived_logger('DataPublisher')
+        self.socket_addr = socket_addr
+        self.buffer_words = buffer_words
+        self.hwm = hwm
+        self.multipart = multipart
+        self.name = name
+
+        self._shm = shared_memory.SharedMemory(create=True, size=buffer_words * 4)
+        self._buffer = np.ndarray((buffer_words, ), dtype=np.uint32, buffer=self._shm.buf)
+        self._write_pos = 0  # words written in total, only used by readout thread
+        self._read_pos = multiprocessing.Value('q', 0)  # words released by publisher process in total
+        self._messages = multiprocessing.Queue()
+
+        self.n_published = multiprocessing.Value('L', 0)
+        self.n_dropped_socket = multiprocessing.Value('L', 0)
+        self.n_dropped_buffer = 0
+
+        self._ready = multiprocessing.Event()
+        self._proc = multiprocessing.Process(target=self._run, name='DataPublisher', daemon=True)
+        self._proc.start()
+        start_time = time.time()
+        while not self._ready.wait(timeout=0.1):
+            if not self._proc.is_alive() or time.time() - start_time > 10.:
+                self.close()
+                raise RuntimeError('Cannot start data publisher at %s' % socket_addr)
+
+    def send(self, data_tuple, scan_param_id):
+        ''' Queue readout for publishing, returns False if the readout is dropped '''
+        data = data_tuple[0]
+        n_words = data.shape[0]
+        offset = self._write_pos % self.buffer_words
+        padding = 0
+        if offset + n_words > self.buffer_words:  # data has to be continuous, skip end of ring buffer
+            padding = self.buffer_words - offset
+            offset = 0
+        if self._write_pos + padding + n_words - self._read_pos.value > self.buffer_words:
+            self.n_dropped_buffer += 1
+            return False
+
+        self._buffer[offset:offset + n_words] = data
+        meta = dict(name=self.name, timestamp_start=data_tuple[1], timestamp_stop=data_tuple[2], error=data_tuple[3],
+                    monotonic_start_ns=data_tuple[4], monotonic_stop_ns=data_tuple[5], scan_param_id=scan_param_id)
+        self._write_pos += padding + n_words
+        self._messages.put((offset, n_words, self._write_pos, meta))
+        return True
+
+    def _run(self):
+        ''' Publisher process: send queued readouts and release their ring buffer space '''
+        from online_monitor.utils.utils import simple_enc  # imported in the publisher process only
+
+        context = zmq.Context()
+        socket = context.socket(zmq.PUB)
+        socket.setsockopt(zmq.LINGER, 0)
+        if self.hwm:
+            socket.setsockopt(zmq.SNDHWM, self.hwm)
+        socket.setsockopt(zmq.XPUB_NODROP, 1)  # signal full queue (zmq.Again) instead of silently dropping
+        try:
+            socket.bind(self.socket_addr)
+        except zmq.error.ZMQError:
+            self.log.exception('Cannot connect to socket for data sending.')
+            return
+        self._ready.set()
+
+        try:
+            while True:
+                message = self._messages.get()
+                if message is None:
+                    break
+                offset, n_words, write_pos, meta = message
+                data = self._buffer[offset:offset + n_words]
+                try:
+                    if self.multipart:
+                        socket.send_multipart(utils.encode_multipart(data, meta), flags=zmq.NOBLOCK, copy=True)
+                    else:
+                        socket.send(simple_enc(data, meta), flags=zmq.NOBLOCK)
+                    with self.n_published.get_lock():
+                        self.n_published.value += 1
+                except zmq.Again:
+                    with self.n_dropped_socket.get_lock():
+                        self.n_dropped_socket.value += 1
+                self._read_pos.value = write_pos  # data is copied by zmq, release buffer
+        finally:
+            socket.close()
+            context.term()
+
+    def close(self, timeout=10.):
+        ''' Publish remaining readouts and stop the publisher process '''
+        if self._shm is None:  # already closed
+            return
+        if self._proc.is_alive():
+            self._messages.put(None)
+            self._proc.join(timeout=timeout)
+            if self._proc.is_alive():
+                self._proc.terminate()
+        if self.n_dropped_buffer or self.n_dropped_socket.value:
+            self.log.warning('%d readouts were not sent to the online monitor (buffer full: %d, send queue full: %d)',
+                             self.n_dropped_buffer + self.n_dropped_socket.value, self.n_dropped_buffer, self.n_dropped_socket.value)
+        self._messages.close()
+        self._buffer = None
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
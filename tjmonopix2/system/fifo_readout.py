@@ -5,16 +5,35 @@
 # ------------------------------------------------------------
 #
 
-import datetime
 import sys
 from collections import deque
-from queue import Empty, Queue
 from threading import Event, Thread
-from time import mktime, sleep, time
+from time import perf_counter, perf_counter_ns, sleep, time
+
+import numpy as np
 
 from tjmonopix2.system import logger
+from tjmonopix2.system.metrics import ReadoutMetrics
+
+data_iterable = ("data", "timestamp_start", "timestamp_stop", "error", "monotonic_start_ns", "monotonic_stop_ns")
+
+
+def demultiplex_data(data, identifiers):
+    '''
+        Split raw data words by the data identifier (bits 31..28) of the receivers.
+
+        Parameters:
+        ----------
+        data : np.array
+                FIFO data words
+        identifiers : dict
+                Receiver name: data identifier of the words of this receiver
 
-data_iterable = ("data", "timestamp_start", "timestamp_stop", "error")
+        Returns dict of receiver name: data words. Words of other sources (e.g. TLU, TDC) are added to every receiver.
+    '''
+    word_identifiers = data >> 28
+    other_words = ~np.isin(word_identifiers, list(identifiers.values()))
+    return {name: data[(word_identifiers == identifier) | other_words] for name, identifier in identifiers.items()}
 
 
 class FifoError(Exception):
@@ -49,15 +68,20 @@ class FifoReadout(object):
         self.watchdog_thread = None
         self.fill_buffer = False
         self.readout_interval = 0.05
+        self.watchdog_interval = None  # RX status polling interval in seconds, default is 10 x readout_interval
+        self.rx_status_history = deque()  # (time, channel, ready, 8b10b errors, discarded words) on every change
+        self._last_rx_status = {}
         self._moving_average_time_period = 10.0
         self._data_deque = deque()
         self._data_buffer = deque()
-        self._words_per_read = deque(maxlen=int(self._moving_average_time_period / self.readout_interval))
-        self._result = Queue(maxsize=1)
-        self._calculate = Event()
+        self.metrics = ReadoutMetrics(rate_time_period=self._moving_average_time_period)
+        self.metrics.gauges['data_queue_size'] = lambda: len(self._data_deque)
         self.stop_readout = Event()
         self.force_stop = Event()
+        # Wall clock time is derived from the monotonic high resolution counter, anchored once
+        self._wall_time_anchor, self._perf_counter_anchor = time(), perf_counter_ns()
         self.timestamp = None
+        self.timestamp_ns = None
         self.update_timestamp()
         self._is_running = False
         self.reset_rx()
@@ -83,15 +107,7 @@ class FifoReadout(object):
             self.log.warning('Data requested but software data buffer not active')
 
     def data_words_per_second(self):
-        if self._result.full():
-            self._result.get()
-        self._calculate.set()
-        try:
-            result = self._result.get(timeout=2 * self.readout_interval)
-        except Empty:
-            self._calculate.clear()
-            return None
-        return result / float(self._moving_average_time_period)
+        return self.metrics.words_per_second(self._moving_average_time_period)
 
     def start(self, callback=None, errback=None, reset_rx=False, reset_sram_fifo=False, clear_buffer=False, fill_buffer=False, no_data_timeout=None):
         if self._is_running:
@@ -111,7 +127,6 @@ class FifoReadout(object):
             fifo_size = self.daq['FIFO']['FIFO_SIZE']
             if fifo_size != 0:
                 self.log.warning('FIFO not empty when starting FIFO readout: size = %i', fifo_size)
-        self._words_per_read.clear()
         if clear_buffer:
             self._data_deque.clear()
             self._data_buffer.clear()
@@ -188,7 +203,7 @@ class FifoReadout(object):
         time_wait = 0.0
         while not self.force_stop.wait(time_wait if time_wait >= 0.0 else 0.0):
             try:
-                time_read = time()
+                time_read = perf_counter()
                 if no_data_timeout and curr_time + no_data_timeout < self.get_float_time():
                     raise NoDataTimeout('Received no data for %0.1f second(s)' % no_data_timeout)
                 data = self.read_data()
@@ -203,21 +218,18 @@ class FifoReadout(object):
                     break
             else:
                 n_words = data.shape[0]
-                last_time, curr_time = self.update_timestamp()
+                last_time, curr_time, last_time_ns, curr_time_ns = self.update_timestamp()
                 status = 0
                 if self.callback:
-                    self._data_deque.append((data, last_time, curr_time, status))
+                    self._data_deque.append((data, last_time, curr_time, status, last_time_ns, curr_time_ns))
                 if self.fill_buffer:
-                    self._data_buffer.append((data, last_time, curr_time, status))
-                self._words_per_read.append(n_words)
+                    self._data_buffer.append((data, last_time, curr_time, status, last_time_ns, curr_time_ns))
+                self.metrics.add_readout(n_words)
                 # FIXME: busy FE prevents scan termination? To be checked
                 if self.stop_readout.is_set():
                     break
             finally:
-                time_wait = self.readout_interval - (time() - time_read)
-            if self._calculate.is_set():
-                self._calculate.clear()
-                self._result.put(sum(self._words_per_read))
+                time_wait = self.readout_interval - (perf_counter() - time_read)
         if self.callback:
             self._data_deque.append(None)  # last item, will stop worker
         self.log.debug('Stopped %s', self.readout_thread.name)
@@ -240,25 +252,40 @@ class FifoReadout(object):
                         self.callback(data)
                     except Exception:
                         self.errback(sys.exc_info())
+                    self.metrics.add_callback((perf_counter_ns() - data[5]) * 1e-9)  # data[5] is monotonic time of readout
 
         self.log.debug('Stopped %s', self.worker_thread.name)
 
     def watchdog(self):
         self.log.debug('Starting %s', self.watchdog_thread.name)
+        interval = self.watchdog_interval if self.watchdog_interval else self.readout_interval * 10
         while True:
             try:
-                error_count = self.get_rx_8b10b_error_count()
+                status = self.get_rx_status()
+                error_count = [channel_status['decoder_error_counter'] for channel_status in status.values()]
+                discard_count = [channel_status['lost_data_counter'] for channel_status in status.values()]
+                self._record_rx_status(status)
+                self.metrics.rx_8b10b_error_count = error_count
+                self.metrics.rx_discard_count = discard_count
                 if any(error_count):
                     raise EightbTenbError('RX 8b10b error(s) detected ', error_count)
-                discard_count = self.get_rx_fifo_discard_count()
                 if any(discard_count):
                     raise FifoDiscardError('RX FIFO discard error(s) detected ', discard_count)
             except Exception:
                 self.errback(sys.exc_info())
-            if self.stop_readout.wait(self.readout_interval * 10):
+            if self.stop_readout.wait(interval):
                 break
         self.log.debug('Stopped %s', self.watchdog_thread.name)
 
+    def _record_rx_status(self, status):
+        ''' Add changed RX status to the history '''
+        timestamp = self.get_float_time()
+        for name, channel_status in status.items():
+            counters = (channel_status['ready'], channel_status['decoder_error_counter'], channel_status['lost_data_counter'])
+            if self._last_rx_status.get(name) != counters:
+                self._last_rx_status[name] = counters
+                self.rx_status_history.append((timestamp, name) + counters)
+
     def read_data(self):
         '''
             Read FIFO and return data array
@@ -272,10 +299,12 @@ class FifoReadout(object):
         return self.daq['FIFO'].get_data()
 
     def update_timestamp(self):
-        curr_time = self.get_float_time()
-        last_time = self.timestamp
-        self.timestamp = curr_time
-        return last_time, curr_time
+        ''' Returns wall clock (float seconds) and monotonic (int nanoseconds) time of the last and the current call '''
+        curr_time_ns = perf_counter_ns()
+        curr_time = self._wall_time_anchor + (curr_time_ns - self._perf_counter_anchor) * 1e-9
+        last_time, last_time_ns = self.timestamp, self.timestamp_ns
+        self.timestamp, self.timestamp_ns = curr_time, curr_time_ns
+        return last_time, curr_time, last_time_ns, curr_time_ns
 
     def read_status(self):
         raise NotImplementedError()
@@ -296,8 +325,13 @@ class FifoReadout(object):
             [channel for channel in channels if self.daq.rx_channels[channel].reset()]
         else:
             [rx for _, rx in self.daq.rx_channels.items() if rx.reset()]
+        self._last_rx_status.clear()  # counters are reset, record next status
         sleep(0.1)  # Sleep here for a while
 
+    def get_rx_status(self):
+        ''' Return status and counters of all RX channels, read with one transaction per channel '''
+        return {name: rx.get_status() for name, rx in sorted(self.daq.rx_channels.items())}
+
     def get_rx_8b10b_error_count(self, rx_channel=None):
         if rx_channel is None:
             return [rx.get_decoder_error_counter() for _, rx in sorted(self.daq.rx_channels.items())]
@@ -312,8 +346,11 @@ class FifoReadout(object):
 
     def get_float_time(self):
         '''
-            Returns time as double precision floats - Time64 in pytables - mapping to and from python datetime's
+            Returns wall clock time as double precision floats - Time64 in pytables.
+            Derived from the monotonic counter, thus not affected by clock adjustments during the readout.
         '''
-        t1 = time()
-        t2 = datetime.datetime.fromtimestamp(t1)
-        return mktime(t2.timetuple()) + 1e-6 * t2.microsecond
+        return self._wall_time_anchor + (perf_counter_ns() - self._perf_counter_anchor) * 1e-9
+
+    def get_monotonic_time_ns(self):
+        ''' Returns monotonic time in nanoseconds, only differences are meaningful '''
+        return perf_counter_ns()
@@ -0,0 +1,162 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Performance counters of the data taking.
+
+    Every counter is written by one thread only (readout, worker or watchdog thread),
+    readers take snapshots without locking. The metrics can be scraped from a local
+    http endpoint in Prometheus text format (/metrics) or as json (/metrics.json).
+'''
+
+import json
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from tjmonopix2.system import logger
+
+# Upper edges of the callback latency histogram in seconds, last bin is overflow
+LATENCY_BINS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1., 2., 5., 10.)
+
+
+class ReadoutMetrics(object):
+    ''' Counters of the FIFO readout and the data handling '''
+
+    def __init__(self, rate_time_period=10.0):
+        self.rate_time_period = rate_time_period
+        self.gauges = {}  # evaluated on snapshot, name: function
+        self.reset()
+
+    def reset(self):
+        self.start_time = time.time()
+
+        # Readout thread
+        self.words_total = 0
+        self.readouts_total = 0
+        self._readouts = deque(maxlen=10000)  # (time, words) of recent readouts for rates
+
+        # Worker thread
+        self.callbacks_total = 0
+        self.callback_latency_counts = np.zeros(len(LATENCY_BINS) + 1, dtype=np.int64)
+        self.callback_latency_sum = 0.
+        self.durations = {}  # name: [count, total seconds], e.g. hdf5 write or zmq send time
+
+        # Watchdog thread
+        self.rx_discard_count = []
+        self.rx_8b10b_error_count = []
+
+    def add_readout(self, n_words):
+        self.words_total += n_words
+        self.readouts_total += 1
+        self._readouts.append((time.time(), n_words))
+
+    def add_callback(self, latency):
+        ''' Time between readout of data and end of data handling callback in seconds '''
+        self.callbacks_total += 1
+        self.callback_latency_sum += latency
+        self.callback_latency_counts[np.searchsorted(LATENCY_BINS, latency)] += 1
+
+    def add_duration(self, name, duration):
+        try:
+            entry = self.durations[name]
+        except KeyError:
+            self.durations[name] = [1, duration]
+        else:
+            entry[0] += 1
+            entry[1] += duration
+
+    def words_per_second(self, time_period=None):
+        ''' Average data rate of the readouts within the last time_period seconds '''
+        time_period = self.rate_time_period if time_period is None else time_period
+        min_time = time.time() - time_period
+        return sum(n_words for t, n_words in list(self._readouts) if t >= min_time) / float(time_period)
+
+    def readouts_per_second(self, time_period=None):
+        time_period = self.rate_time_period if time_period is None else time_period
+        min_time = time.time() - time_period
+        return len([t for t, _ in list(self._readouts) if t >= min_time]) / float(time_period)
+
+    def snapshot(self):
+        ''' Return all metrics as dict '''
+        snapshot = {'uptime_seconds': time.time() - self.start_time,
+                    'words_total': self.words_total,
+                    'readouts_total': self.readouts_total,
+                    'words_per_second': self.words_per_second(),
+                    'readouts_per_second': self.readouts_per_second(),
+                    'callbacks_total': self.callbacks_total,
+                    'callback_latency_seconds': {'bins': list(LATENCY_BINS) + ['+Inf'],
+                                                 'counts': self.callback_latency_counts.tolist(),
+                                                 'sum': self.callback_latency_sum},
+                    'rx_discard_count': list(self.rx_discard_count),
+                    'rx_8b10b_error_count': list(self.rx_8b10b_error_count)}
+        for name, (count, total) in list(self.durations.items()):
+            snapshot[name + '_total'] = count
+            snapshot[name + '_seconds'] = total
+        for name, gauge in list(self.gauges.items()):
+            snapshot[name] = gauge()
+        return snapshot
+
+    def to_json(self):
+        return json.dumps(self.snapshot())
+
+    def to_prometheus(self, prefix='tjmonopix2_'):
+        ''' Return metrics in Prometheus text exposition format '''
+        lines = []
+        for name, value in self.snapshot().items():
+            if name == 'callback_latency_seconds':
+                cumulative = np.cumsum(value['counts'])
+                lines.append('# TYPE %s%s histogram' % (prefix, name))
+                for edge, count in zip(value['bins'], cumulative):
+                    lines.append('%s%s_bucket{le="%s"} %d' % (prefix, name, edge, count))
+                lines.append('%s%s_sum %f' % (prefix, name, value['sum']))
+                lines.append('%s%s_count %d' % (prefix, name, cumulative[-1]))
+            elif isinstance(value, list):
+                for channel, count in enumerate(value):
+                    lines.append('%s%s{rx="%d"} %s' % (prefix, name, channel, count))
+            else:
+                lines.append('%s%s %s' % (prefix, name, value))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer(object):
+    ''' Serve metrics on http://<address>:<port>/metrics (Prometheus) and /metrics.json '''
+
+    def __init__(self, metrics, port, address='127.0.0.1'):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # imported on use, the server is optional
+
+        self.log = logger.setup_derived_logger('MetricsServer')
+        self.metrics = metrics  # can be replaced, e.g. by the metrics of a new FIFO readout
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):  # noqa: N805
+                if handler.path == '/metrics':
+                    body, content_type = server.metrics.to_prometheus(), 'text/plain; version=0.0.4'
+                elif handler.path == '/metrics.json':
+                    body, content_type = server.metrics.to_json(), 'application/json'
+                else:
+                    handler.send_error(404)
+                    return
+                handler.send_response(200)
+                handler.send_header('Content-Type', content_type)
+                handler.end_headers()
+                handler.wfile.write(body.encode())
+
+            def log_message(handler, *args):  # noqa: N805
+                pass
+
+        self.server = ThreadingHTTPServer((address, port), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, name='MetricsServer', daemon=True)
+        self.thread.start()
+        self.log.debug('Serving metrics at http://%s:%d/metrics', address, self.server.server_port)
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
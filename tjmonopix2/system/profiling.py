@@ -0,0 +1,237 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Opt-in profiling of the scan stages (configure, scan, analyze and their sub-stages).
+
+    Stages are nested, e.g. scan/readout/readout_stop, and record wall time, CPU time of the process and
+    the peak resident memory of the process at the end of the stage. Functions that are called very often
+    (mask updates, command writes, analysis of a chunk) only add up their time in the enclosing stage.
+    Every hook is a no-op if no profiler is active. Stages are recorded in the main thread only.
+
+    The cProfile (or pyinstrument if installed) profile of one stage can be captured in addition.
+'''
+
+import cProfile
+import functools
+import io
+import pstats
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import tables as tb
+
+from tjmonopix2.system import logger
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+try:
+    import pyinstrument
+except ImportError:
+    pyinstrument = None
+
+_active_profiler = None
+
+
+class ProfilingTable(tb.IsDescription):
+    stage = tb.StringCol(128, pos=0)
+    chip = tb.StringCol(64, pos=1)
+    scan_param_id = tb.Int32Col(pos=2)  # -1 outside of readouts
+    calls = tb.UInt32Col(pos=3)  # > 1 for accumulated function calls
+    wall_time = tb.Float64Col(pos=4)
+    cpu_time = tb.Float64Col(pos=5)
+    peak_rss_mb = tb.Float64Col(pos=6)  # high water mark of the process at the end of the stage
+
+
+def get_peak_rss_mb():
+    if resource is None:
+        return 0.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 1e6 if sys.platform == 'darwin' else peak_rss / 1e3  # bytes on macOS, kB on Linux
+
+
+class StageProfiler(object):
+    '''
+        Records the stages of a scan
+
+        capture_stage: name of the stage to capture the function profile of, e.g. 'scan' or 'analyze'
+        capture_tool: 'cprofile' or 'pyinstrument'
+        output_prefix: path prefix of the captured profile files (.prof for cProfile, .html for pyinstrument)
+    '''
+
+    def __init__(self, capture_stage=None, capture_tool='cprofile', output_prefix='profile'):
+        self.log = logger.setup_derived_logger('StageProfiler')
+        self.capture_stage = capture_stage
+        self.capture_tool = capture_tool
+        self.output_prefix = output_prefix
+        if capture_tool == 'pyinstrument' and pyinstrument is None:
+            self.log.warning('pyinstrument is not installed, use cProfile to capture stage %s', capture_stage)
+            self.capture_tool = 'cprofile'
+        self.records = []  # [stage, chip, scan_param_id, calls, wall time, cpu time, peak rss in MB]
+        self.captured_files = []
+        self._stack = []  # open stages: [path, chip, scan_param_id, accumulated durations]
+        self._thread = threading.current_thread()
+
+    @contextmanager
+    def stage(self, name, chip=None, scan_param_id=None):
+        ''' Record the enclosed code as stage, chip and scan_param_id default to the ones of the enclosing stage '''
+        if threading.current_thread() is not self._thread:
+            yield
+            return
+        parent = self._stack[-1] if self._stack else ('', '', -1, None)
+        path = parent[0] + '/' + name if parent[0] else name
+        entry = (path, parent[1] if chip is None else chip, parent[2] if scan_param_id is None else scan_param_id, OrderedDict())
+        self._stack.append(entry)
+        capture = self._start_capture() if name == self.capture_stage else None
+        start_time, start_cpu_time = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            wall_time, cpu_time = time.perf_counter() - start_time, time.process_time() - start_cpu_time
+            if capture is not None:
+                self._stop_capture(capture, path)
+            self._stack.pop()
+            peak_rss = get_peak_rss_mb()
+            self.records.append([path, entry[1], entry[2], 1, wall_time, cpu_time, peak_rss])
+            for function_name, (calls, function_wall_time, function_cpu_time) in entry[3].items():
+                self.records.append([path + '/' + function_name, entry[1], entry[2], calls, function_wall_time, function_cpu_time, peak_rss])
+
+    def add_duration(self, name, wall_time, cpu_time):
+        ''' Add time of a function call to the enclosing stage '''
+        if not self._stack or threading.current_thread() is not self._thread:
+            return
+        durations = self._stack[-1][3]
+        try:
+            calls, total_wall_time, total_cpu_time = durations[name]
+        except KeyError:
+            calls, total_wall_time, total_cpu_time = 0, 0., 0.
+        durations[name] = (calls + 1, total_wall_time + wall_time, total_cpu_time + cpu_time)
+
+    def _start_capture(self):
+        if self.capture_tool == 'pyinstrument':
+            profiler = pyinstrument.Profiler()
+        else:
+            profiler = cProfile.Profile()
+        try:
+            if self.capture_tool == 'pyinstrument':
+                profiler.start()
+            else:
+                profiler.enable()
+        except ValueError:  # another profiler is active
+            self.log.warning('Cannot capture profile of stage %s, another profiler is active', self.capture_stage)
+            return None
+        return profiler
+
+    def _stop_capture(self, profiler, path):
+        filename = self.output_prefix + '_' + path.replace('/', '_')
+        if self.capture_tool == 'pyinstrument':
+            profiler.stop()
+            filename += '.html'
+            with open(filename, 'w') as f:
+                f.write(profiler.output_html())
+        else:
+            profiler.disable()
+            filename += '.prof'
+            profiler.dump_stats(filename)
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(20)
+            self.log.debug('Profile of stage %s:\n%s', path, stream.getvalue())
+        self.captured_files.append(filename)
+
+    def get_records(self, chip=None, start=0):
+        ''' Records of given chip and the records of all chips (e.g. FIFO readout setup) '''
+        return [record for record in self.records[start:] if chip is None or record[1] in (chip, '')]
+
+    def write_table(self, h5_file, chip=None, start=0):
+        ''' Append the records to the profiling table of an open h5 file '''
+        try:
+            table = h5_file.root.profiling
+        except tb.NoSuchNodeError:
+            table = h5_file.create_table(h5_file.root, name='profiling', description=ProfilingTable,
+                                         title='Wall time, CPU time and peak memory of the scan stages')
+        records = self.get_records(chip, start)
+        if records:
+            table.append([tuple(record) for record in records])
+            table.flush()
+
+    def summary(self):
+        ''' Table of the stages (summed over chips and scan parameters) as list of text lines '''
+        stages = OrderedDict()
+        for path, _, _, calls, wall_time, cpu_time, peak_rss in self.records:
+            entry = stages.setdefault(path, [0, 0., 0., 0.])
+            entry[0] += calls
+            entry[1] += wall_time
+            entry[2] += cpu_time
+            entry[3] = max(entry[3], peak_rss)
+        lines = ['%-50s %10s %12s %12s %14s' % ('Stage', 'Calls', 'Wall [s]', 'CPU [s]', 'Peak RSS [MB]')]
+        for path in sorted(stages.keys()):
+            calls, wall_time, cpu_time, peak_rss = stages[path]
+            lines.append('%-50s %10d %12.3f %12.3f %14.1f' % (path, calls, wall_time, cpu_time, peak_rss))
+        return lines
+
+    def log_summary(self):
+        self.log.info('Profiling of scan stages:\n' + '\n'.join(self.summary()))
+        for filename in self.captured_files:
+            self.log.info('Profile captured in %s', filename)
+
+
+def get_profiler():
+    return _active_profiler
+
+
+def set_profiler(profiler):
+    ''' Activate a StageProfiler for all hooks, None deactivates profiling '''
+    global _active_profiler
+    _active_profiler = profiler
+
+
+@contextmanager
+def stage(name, chip=None, scan_param_id=None):
+    ''' Record the enclosed code as stage of the active profiler '''
+    profiler = _active_profiler
+    if profiler is None:
+        yield
+    else:
+        with profiler.stage(name, chip=chip, scan_param_id=scan_param_id):
+            yield
+
+
+@contextmanager
+def accumulate(name):
+    ''' Add the time of the enclosed code to the enclosing stage of the active profiler, for frequently called code '''
+    profiler = _active_profiler
+    if profiler is None:
+        yield
+        return
+    start_time, start_cpu_time = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        profiler.add_duration(name, time.perf_counter() - start_time, time.process_time() - start_cpu_time)
+
+
+def timed(name):
+    ''' Decorator, the time of every function call is added to the enclosing stage of the active profiler '''
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = _active_profiler
+            if profiler is None:
+                return func(*args, **kwargs)
+            start_time, start_cpu_time = time.perf_counter(), time.process_time()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.add_duration(name, time.perf_counter() - start_time, time.process_time() - start_cpu_time)
+        return wrapper
+    return decorator
@@ -8,7 +8,6 @@
 import ast
 import collections
 import inspect
-import multiprocessing
 import os
 import time
 import traceback
@@ -21,19 +20,20 @@ import numpy as np
 import tables as tb
 import yaml
 import zmq
-from online_monitor.utils import utils as ou
 
 from tjmonopix2 import utils
 from tjmonopix2.analysis import analysis_utils as au
-from tjmonopix2.system import fifo_readout, logger
+from tjmonopix2.system import fifo_readout, logger, profiling
+from tjmonopix2.system.analysis_queue import get_analysis_queue
+from tjmonopix2.system.data_publisher import DataPublisher
 from tjmonopix2.system.bdaq53 import BDAQ53
 from tjmonopix2.system.fifo_readout import FifoReadout
-from tjmonopix2.system.mio3 import MIO3
+from tjmonopix2.system.metrics import MetricsServer
 from tjmonopix2.system.tjmonopix2 import TJMonoPix2
 
 # Compression for data files
-FILTER_RAW_DATA = tb.Filters(complib='blosc', complevel=5, fletcher32=False)
-FILTER_TABLES = tb.Filters(complib='zlib', complevel=5, fletcher32=False)
+FILTER_RAW_DATA = utils.get_filters('raw_data')  # default profile, use ScanBase._get_filters() for the configured one
+FILTER_TABLES = utils.get_filters('tables')
 # Default locations
 PROJECT_FOLDER = os.path.join(os.path.dirname(__file__), '..')
 SYSTEM_FOLDER = os.path.join(PROJECT_FOLDER, 'system')
@@ -48,11 +48,25 @@ def fill_dict_from_conf_table(table):
     return conf
 
 
-def send_data(socket, data, scan_param_id, name='ReadoutData'):
+simple_enc = None  # online_monitor serialization, imported at socket setup since it pulls in matplotlib
+
+
+def import_simple_enc():
+    ''' Import the online_monitor serialization of send_data() once, outside of the readout '''
+    global simple_enc
+    if simple_enc is None:
+        from online_monitor.utils.utils import simple_enc
+    return simple_enc
+
+
+def send_data(socket, data, scan_param_id, name='ReadoutData', multipart=False):
     '''Sends the data of every read out (raw data and meta data)
 
         via ZeroMQ to a specified socket.
-        Uses a serialization provided by the online_monitor package
+        Uses a serialization provided by the online_monitor package or if multipart is set
+        a meta data frame and the raw data buffer without copy (see utils.encode_multipart).
+
+        Returns False if the data was dropped since the send queue is full
     '''
 
     data_meta_data = dict(
@@ -60,13 +74,19 @@ def send_data(socket, data, scan_param_id, name='ReadoutData'):
         timestamp_start=data[1],  # float
         timestamp_stop=data[2],  # float
         error=data[3],  # int
+        monotonic_start_ns=data[4],  # int
+        monotonic_stop_ns=data[5],  # int
         scan_param_id=scan_param_id
     )
     try:
-        data_ser = ou.simple_enc(data[0], meta=data_meta_data)
-        socket.send(data_ser, flags=zmq.NOBLOCK)
+        if multipart:
+            socket.send_multipart(utils.encode_multipart(data[0], meta=data_meta_data), flags=zmq.NOBLOCK, copy=False)
+        else:
+            data_ser = (simple_enc or import_simple_enc())(data[0], meta=data_meta_data)
+            socket.send(data_ser, flags=zmq.NOBLOCK)
     except zmq.Again:
-        pass
+        return False
+    return True
 
 
 class MetaTable(tb.IsDescription):
@@ -78,6 +98,23 @@ class MetaTable(tb.IsDescription):
     scan_param_id = tb.UInt32Col(pos=5)
     error = tb.UInt32Col(pos=6)
     trigger = tb.Float64Col(pos=7)
+    monotonic_start_ns = tb.Int64Col(pos=8)  # monotonic clock, for precise time differences
+    monotonic_stop_ns = tb.Int64Col(pos=9)
+
+
+class ScanParamRangeTable(tb.IsDescription):
+    scan_param_id = tb.UInt32Col(pos=0)
+    index_start = tb.Int64Col(pos=1)
+    index_stop = tb.Int64Col(pos=2)
+    n_readouts = tb.UInt32Col(pos=3)
+
+
+class RxStatusTable(tb.IsDescription):
+    timestamp = tb.Float64Col(pos=0)
+    receiver = tb.StringCol(16, pos=1)
+    ready = tb.UInt8Col(pos=2)
+    decoder_error_counter = tb.UInt8Col(pos=3)
+    lost_data_counter = tb.UInt8Col(pos=4)
 
 
 class MapTable(tb.IsDescription):
@@ -137,15 +174,85 @@ class ChipContainer:
         self.h5_file = None
         self.raw_data_earray = None
         self.meta_data_table = None
+        self.scan_param_range_table = None
+        self.rx_status_table = None
         # self.trigger_table = None
         # self.ptot_table = None
         self.scan_parameters = OrderedDict()
         self.socket = None
+        self.publisher = None  # publisher process, used instead of socket if configured
+        self.n_dropped_messages = 0  # readouts not sent to online monitor due to full send queue
 
     def __repr__(self):
         return 'ChipContainer for %s (%s) of %s with data at %s' % (self.name, self.chip_settings['chip_sn'], self.module_settings['name'], self.output_dir)
 
 
+class ScanSession(object):
+    '''
+        Keeps the readout system, the chip objects, the FIFO readout and the ZeroMQ context for several scans,
+        e.g. a tuning chain. The hardware is initialized by the first scan only, the following scans write
+        only the register and mask changes to the chips.
+
+        Usage:
+            with ScanSession(bench_config=bench_config) as session:
+                session.run(GDACTuning, scan_config=gdac_tuning_configuration)
+                session.run(TDACTuning, scan_config=tdac_tuning_configuration)
+                session.run(ThresholdScan, scan_config=threshold_scan_configuration)
+
+        A failed scan invalidates the chip state and the next scan initializes the hardware again.
+    '''
+
+    def __init__(self, daq_conf=None, bench_config=None):
+        self.log = logger.setup_derived_logger('ScanSession')
+        self.daq_conf = daq_conf
+        self.bench_config = bench_config
+
+        # Set by the first scan
+        self.daq = None
+        self.chips = {}  # chip objects per module_chip name
+        self.fifo_readout = None
+        self.metrics_server = None
+        self.hardware_initialized = False
+
+        self.context = zmq.Context()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def run(self, scan_class, scan_config={}, scan_config_per_chip=None, suffix='', analyze=True):
+        ''' Init, configure, scan, analyze and close a scan with the hardware of this session, returns the scan object '''
+        scan = scan_class(daq_conf=self.daq_conf, bench_config=self.bench_config, scan_config=scan_config,
+                          scan_config_per_chip=scan_config_per_chip, suffix=suffix, session=self)
+        with scan:
+            if analyze:
+                scan.start()
+            else:
+                scan.configure()
+                scan.scan()
+        return scan
+
+    def invalidate(self):
+        ''' Chip state is unknown, e.g. after a failed scan: the next scan initializes the hardware '''
+        self.hardware_initialized = False
+
+    def close(self):
+        if self.metrics_server:
+            self.metrics_server.close()
+            self.metrics_server = None
+        if self.daq:
+            self.daq.close()
+            self.daq = None
+        self.chips.clear()
+        self.fifo_readout = None
+        self.hardware_initialized = False
+        if self.context:
+            self.context.term()
+            self.context = None
+
+
 class ScanBase(object):
     '''
         Basic run meta class.
@@ -154,7 +261,7 @@ class ScanBase(object):
 
     is_parallel_scan = False  # Parallel readout of ExtTrigger-type scans etc.; must be overridden in the derived classes if needed
 
-    def __init__(self, daq_conf=None, bench_config=None, scan_config={}, scan_config_per_chip=None, suffix=''):
+    def __init__(self, daq_conf=None, bench_config=None, scan_config={}, scan_config_per_chip=None, suffix='', session=None):
         '''
             Initializer.
 
@@ -186,6 +293,10 @@ class ScanBase(object):
 
             record_chip_status : boolean
                     Add chip statuses to the output files after the scan
+
+            session : ScanSession
+                    Use the readout system and chips of the session, they are initialized only once for all scans
+                    of the session and only register and mask changes are written to the chips
         '''
         # Allow changes without changing originals
         if isinstance(daq_conf, dict):
@@ -205,13 +316,17 @@ class ScanBase(object):
         self.scan_config_per_chip_par = scan_config_per_chip
 
         self.proj_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        self.ana_proc = None  # analysis process for non-blocking analysis
+        self.ana_jobs = OrderedDict()  # analysis jobs per chip for non-blocking analysis
+        self._ana_errors_reported = set()  # names of failed analysis jobs already added to errors_occured
+        self.metrics_server = None  # http endpoint of readout metrics
+        self.profiler = None  # records the scan stages if profiling is enabled in the test bench
         self.log = logger.setup_derived_logger(self.__class__.__name__)  # setup logger
         self._log_handlers_per_scan = []  # FIXME: all log handlers of all chips
         self.hardware_initialized = False
         self.initialized = False
 
         self.daq = None  # readout system, defined during scan init if not existing
+        self.session = session  # owns readout system and chips if given
 
         # Needed for parallel scans where several readout threads change the chip handles
         self.chip_handle_lock = Lock()
@@ -219,13 +334,17 @@ class ScanBase(object):
         # All chips data containers
         self.chips = {}
         self.suffix = suffix
+        self.rx_data_identifiers = None  # data identifier per receiver if the data words are routed to several chips
 
     def init(self, force=False):
         try:
             self.errors_occured = False
             self._init_environment()
-            self._init_hardware(force)
-            self._init_files()
+            with profiling.stage('init'):
+                with profiling.stage('init_hardware'):
+                    self._init_hardware(force)
+                with profiling.stage('init_files'):
+                    self._init_files()
             self.initialized = True
         except Exception as e:
             # if self.periphery:
@@ -237,28 +356,31 @@ class ScanBase(object):
         try:
             if not self.initialized:
                 raise RuntimeError('Cannot call configure() before init() is called!')
-            # Deactivate receiver to prevent recording useless data
-            for _ in self.iterate_chips():
-                self._set_receiver_enabled(receiver=self.chip.receiver, enabled=False)
-            for i, _ in enumerate(self.iterate_chips()):
-                with self._logging_through_handler(self.log_fh):
-                    self.log.info('Configuring chip {0}...'.format(self.chip.get_sn()))
-                    # Load masks from config
-                    self._set_receiver_enabled(receiver=self.chip.receiver, enabled=True)
-                    self._configure_masks()
-                    # Scan dependent configuration step before actual scan can be started (set enable masks etc.)
-                    ret_values[i] = self._configure(**self.scan_config)
-                    # self.periphery.get_module_power(module=self.module_settings['name'], log=True)
+            with profiling.stage('configure'):
+                # Deactivate receiver to prevent recording useless data
+                for _ in self.iterate_chips():
                     self._set_receiver_enabled(receiver=self.chip.receiver, enabled=False)
+                for i, _ in enumerate(self.iterate_chips()):
+                    with self._logging_through_handler(self.log_fh):
+                        self.log.info('Configuring chip {0}...'.format(self.chip.get_sn()))
+                        # Load masks from config
+                        self._set_receiver_enabled(receiver=self.chip.receiver, enabled=True)
+                        with profiling.stage('configure_masks', chip=self.name):
+                            self._configure_masks()
+                        # Scan dependent configuration step before actual scan can be started (set enable masks etc.)
+                        with profiling.stage('configure_scan', chip=self.name):
+                            ret_values[i] = self._configure(**self.scan_config)
+                        # self.periphery.get_module_power(module=self.module_settings['name'], log=True)
+                        self._set_receiver_enabled(receiver=self.chip.receiver, enabled=False)
 
-            # Create general FIFO readout (for all chips/modules)
-            self._configure_fifo_readout()
+                # Create general FIFO readout (for all chips/modules)
+                self._configure_fifo_readout()
 
-            # Enable receivers
-            for _ in self.iterate_chips():
-                self._set_receiver_enabled(receiver=self.chip.receiver, enabled=True)
-            # # Make sure monitor filter is blocking for all receivers before starting scan
-            # self.daq.set_monitor_filter(mode='block')
+                # Enable receivers
+                for _ in self.iterate_chips():
+                    self._set_receiver_enabled(receiver=self.chip.receiver, enabled=True)
+                # # Make sure monitor filter is blocking for all receivers before starting scan
+                # self.daq.set_monitor_filter(mode='block')
 
             return ret_values
         except Exception as e:
@@ -276,35 +398,39 @@ class ScanBase(object):
             except AttributeError:  # configure not called
                 raise RuntimeError('scan() called before configure(). This is deprecated!')
 
-            if self.is_parallel_scan:
-                # Enable all channels of defined chips
-                for _ in self.iterate_chips():
-                    self._set_receiver_enabled(receiver=self.chip.receiver, enabled=True)
-                self.daq.reset_fifo()
-                self._scan(**self.scan_config)
-                for _ in self.iterate_chips():
-                    self._set_receiver_enabled(receiver=self.chip.receiver, enabled=False)
-            else:
-                self.daq.reset_fifo()
-                for i, _ in enumerate(self.iterate_chips()):
-                    with self._logging_through_handler(self.log_fh):
+            with profiling.stage('scan'):
+                if self.is_parallel_scan:
+                    # Enable all channels of defined chips
+                    for _ in self.iterate_chips():
                         self._set_receiver_enabled(receiver=self.chip.receiver, enabled=True)
-                        ret_values[i] = self._scan(**self.scan_config)
+                    self.daq.reset_fifo()
+                    with profiling.stage('scan_chips'):
+                        self._scan(**self.scan_config)
+                    for _ in self.iterate_chips():
                         self._set_receiver_enabled(receiver=self.chip.receiver, enabled=False)
-            # Finalize scan
-            # Disable tlu module in case it was enabled.
-            if self.daq.tlu_module_enabled:
-                self.daq.disable_tlu_module()
-
-            # Add status info
-            self._set_readout_status()
-            for _ in self.iterate_chips():
-                # Add additional after scan data
-                self._add_chip_status()
-                node = self.h5_file.create_group(self.h5_file.root, 'configuration_out', 'Configuration after scan step')
-                self._write_config_h5(self.h5_file, node)
-                self._store_scan_par_values(self.h5_file)  # store scan params in out node, since it is defined during scan step
-                self.h5_file.close()
+                else:
+                    self.daq.reset_fifo()
+                    for i, _ in enumerate(self.iterate_chips()):
+                        with self._logging_through_handler(self.log_fh):
+                            self._set_receiver_enabled(receiver=self.chip.receiver, enabled=True)
+                            with profiling.stage('scan_chip', chip=self.name):
+                                ret_values[i] = self._scan(**self.scan_config)
+                            self._set_receiver_enabled(receiver=self.chip.receiver, enabled=False)
+                # Finalize scan
+                # Disable tlu module in case it was enabled.
+                if self.daq.tlu_module_enabled:
+                    self.daq.disable_tlu_module()
+
+                # Add status info
+                self._set_readout_status()
+                for _ in self.iterate_chips():
+                    # Add additional after scan data
+                    self._add_chip_status()
+                    with profiling.stage('write_configuration', chip=self.name):
+                        node = self.h5_file.create_group(self.h5_file.root, 'configuration_out', 'Configuration after scan step')
+                        self._write_config_h5(self.h5_file, node)
+                        self._store_scan_par_values(self.h5_file)  # store scan params in out node, since it is defined during scan step
+                    self.h5_file.close()
 
             return ret_values
         except Exception as e:
@@ -320,26 +446,22 @@ class ScanBase(object):
         try:
             if self.configuration['bench']['analysis'].get('skip', False):
                 return
-            for i, _ in enumerate(self.iterate_chips()):
-                with self._logging_through_handler(self.log_fh):
-                    # Perform actual analysis
-                    self.log.info('Starting analysis for ' + self.name + ' (' + self.chip_settings['chip_sn'] + ')')
-                    if self.configuration['bench']['analysis'].get('blocking', True):
-                        ret_values[i] = self._analyze()
-                    else:
-                        # Sockets must be closed before process fork, otherwise sockets cannot be closed in
-                        # main process. This should be OK, since parallel analysis + redoing a scan is unlikely
-                        self._close_sockets()
-
-                        def analyze_and_close_file():
-                            self._analyze()
-                            self._close_h5_file()
-
-                        self.wait_for_analysis()  # wait for previous analysis
-                        self.log.info('Analysis in seperate process')
-                        self.ana_proc = multiprocessing.Process(target=analyze_and_close_file)
-                        self.ana_proc.daemon = True
-                        self.ana_proc.start()
+            blocking = self.configuration['bench']['analysis'].get('blocking', True)
+            if not blocking:
+                # Sockets must be closed before process fork, otherwise sockets cannot be closed in
+                # main process. This should be OK, since parallel analysis + redoing a scan is unlikely
+                self._close_sockets()
+                self.analysis_queue = get_analysis_queue(n_workers=self.configuration['bench']['analysis'].get('n_processes', None))
+            with profiling.stage('analyze'):
+                for i, _ in enumerate(self.iterate_chips()):
+                    with self._logging_through_handler(self.log_fh):
+                        # Perform actual analysis
+                        self.log.info('Starting analysis for ' + self.name + ' (' + self.chip_settings['chip_sn'] + ')')
+                        if blocking:
+                            with profiling.stage('analyze_chip', chip=self.name):
+                                ret_values[i] = self._analyze()
+                        else:
+                            self._start_analysis_process()
             return ret_values
         except Exception as e:
             self._on_exception()
@@ -378,14 +500,25 @@ class ScanBase(object):
             Free hardware resources and store final config
         '''
         if self.initialized:
-            self.daq.close()
+            if self.session is None:  # readout system and metrics server are closed with the session
+                self.daq.close()
+            elif self.errors_occured:
+                self.session.invalidate()
             # self.periphery.close()
             self._close_sockets()
+            if self.metrics_server and self.session is None:
+                self.metrics_server.close()
+                self.metrics_server = None
             self.initialized = False
-        if not self.ana_proc:  # h5 files are closed in ana proc
+        if not self.ana_jobs:  # h5 files are closed in analysis jobs
             for _ in self.iterate_chips():
                 self._close_h5_file()
         with self._logging_through_handlers():
+            self._collect_analysis_results()
+            if self.profiler is not None:
+                self.profiler.log_summary()
+                profiling.set_profiler(None)
+                self.profiler = None
             if self.errors_occured:
                 self.log.error(self.errors_occured)
                 self.log.error('Scan failed!')
@@ -460,10 +593,13 @@ class ScanBase(object):
         return len(self.chips)
 
     def wait_for_analysis(self):
-        ''' Block exction until analysis is finished '''
-        if self.ana_proc:
-            self.log.info('Waiting for analysis process to finish...')
-            self.ana_proc.join()
+        ''' Block execution until the analyses of this scan are finished
+
+            Errors that occurred in the analysis processes are set to self.errors_occured
+        '''
+        if self.ana_jobs:
+            self.analysis_queue.wait(list(self.ana_jobs.values()))
+        self._collect_analysis_results()
 
     def get_module_cfgs(self):
         ''' Returns the module configurations defined in the test bench '''
@@ -493,11 +629,51 @@ class ScanBase(object):
     def _analyze(self, **_):
         self.log.warning('analyze() method not implemented; do not analyze data')
 
+    def _estimate_analysis_memory(self):
+        ''' Rough estimate of the peak memory of one analysis in bytes
+
+            Dominated by the interpreter histograms per scan parameter and the hit buffer
+        '''
+        chunk_size = self.configuration['bench']['analysis'].get('chunk_size', 1000000)
+        n_scan_params = max(len(self.scan_parameters), 1)
+        hist_size = 512 * 512 * n_scan_params * (4 + 128 * 2)  # occupancy (uint32) and ToT (uint16, 128 bins) histogram
+        hit_buffer_size = 4 * chunk_size * au.hit_dtype.itemsize
+        return hist_size + hit_buffer_size
+
+    def _start_analysis_process(self):
+        ''' Submit the analysis of the current chip to the analysis queue
+
+            The job is finished after the final configuration is written to the analyzed data file.
+        '''
+        def analyze_and_close_file():
+            self._analyze()
+            self._close_h5_file()
+
+        self.log.info('Analysis in seperate process')
+        name = '%s (%s)' % (self.name, self.chip_settings['chip_sn'])
+        self.ana_jobs[name] = self.analysis_queue.submit(name=self.output_filename, target=analyze_and_close_file,
+                                                         memory=self._estimate_analysis_memory())
+
+    def _collect_analysis_results(self):
+        ''' Propagate errors of finished analysis jobs of this scan to self.errors_occured '''
+        if not self.ana_jobs:
+            return
+        self.analysis_queue.update()
+        for name, job in self.ana_jobs.items():
+            if job.status == 'failed' and name not in self._ana_errors_reported:
+                self._ana_errors_reported.add(name)
+                self.errors_occured = (self.errors_occured or '') + job.error
+
     def _init_environment(self):
         self.timestamp = time.strftime("%Y%m%d_%H%M%S")
         self.run_name = self.timestamp + '_' + self.scan_id
         # self.ext_trig_num = 0  # reqired for trigger based analysis
-        self.context = zmq.Context.instance()  # one context per process to manage sockets
+        if self.session is not None:
+            self.context = self.session.context
+            self.daq = self.session.daq
+            self.hardware_initialized = self.session.hardware_initialized
+        else:
+            self.context = zmq.Context.instance()  # one context per process to manage sockets
         # Configuration with testbench and scan configuration configs (dict-like object)
         self.configuration = self._load_testbench_cfg(self.bench_config_par)  # fill self.configuration['bench'] with provided testbench config
         utils.recursive_update(self.configuration['bench'], self.scan_config_par.get('bench', {}))  # Update testbench configuration from scan configuration
@@ -508,6 +684,8 @@ class ScanBase(object):
         else:
             self.working_dir = os.path.join(os.getcwd(), "output_data")
 
+        self._setup_profiler()
+
         self._create_chip_container(self.scan_config_par, self.scan_config_per_chip_par)  # fill self.chips with chip container objects from testbench and parameters
 
         # Instantiate periphery and RO hardware (append log to all chip log files)
@@ -519,17 +697,24 @@ class ScanBase(object):
                 else:
                     readout_system = 'bdaq53'
                 if readout_system == "mio3":
+                    from tjmonopix2.system.mio3 import MIO3
                     self.daq = MIO3(conf=self.daq_conf_par, bench_config=self.configuration['bench'])
                 else:
                     self.daq = BDAQ53(conf=self.daq_conf_par, bench_config=self.configuration['bench'])
+                if self.session is not None:
+                    self.session.daq = self.daq
 
         # Instantiate TJ-Monopix2 chip
         for _ in self.iterate_chips():
             with self._logging_through_handler(self.log_fh):
                 if self.chip:  # create chip object only once
                     continue
+                elif self.session is not None and self.hardware_initialized:  # chip object of previous scan in session
+                    self.chip = self.session.chips[self.module_settings['name'] + '_' + self.name]
                 else:
                     self.chip = TJMonoPix2(self.daq, chip_sn=self.chip_settings['chip_sn'], chip_id=self.chip_settings['chip_id'], receiver=self.chip_settings['receiver'], config=self.chip_conf)
+                    if self.session is not None:
+                        self.session.chips[self.module_settings['name'] + '_' + self.name] = self.chip
 
     def _init_files(self):
         for _ in self.iterate_chips():
@@ -540,9 +725,13 @@ class ScanBase(object):
 
             # Create data nodes
             self.raw_data_earray = self.h5_file.create_earray(self.h5_file.root, name='raw_data', atom=tb.UIntAtom(),
-                                                              shape=(0,), title='raw_data', filters=FILTER_RAW_DATA)
+                                                              shape=(0,), title='raw_data', filters=self._get_filters('raw_data'))
             self.meta_data_table = self.h5_file.create_table(self.h5_file.root, name='meta_data', description=MetaTable,
-                                                             title='meta_data', filters=FILTER_TABLES)
+                                                             title='meta_data', filters=self._get_filters('tables'))
+            self.scan_param_range_table = self.h5_file.create_table(self.h5_file.root, name='scan_param_ranges', description=ScanParamRangeTable,
+                                                                    title='Raw data words and readouts of each readout() call', filters=self._get_filters('tables'))
+            self.rx_status_table = self.h5_file.create_table(self.h5_file.root, name='rx_status', description=RxStatusTable,
+                                                             title='Changes of RX status and error counters', filters=self._get_filters('tables'))
             # self.trigger_table = self.h5_file.create_table(self.h5_file.root, name='trigger_table', description=MapTable,
             #                                                title='trigger_table', filters=FILTER_TABLES)
             # self.ptot_table = self.h5_file.create_table(self.h5_file.root, name='ptot_table', description=PtotTable,
@@ -550,17 +739,43 @@ class ScanBase(object):
 
             # Setup data sending
             socket_addr = self.chip_settings.get('send_data', None)
-            if socket_addr:
+            self.socket, self.publisher = None, None
+            if socket_addr and self.chip_settings.get('send_data_process', False):
+                try:
+                    self.publisher = DataPublisher(socket_addr, hwm=self.chip_settings.get('send_data_hwm', None),
+                                                   multipart=self.chip_settings.get('send_data_multipart', False))
+                    self.log.debug('Sending data to server %s from publisher process', socket_addr)
+                except RuntimeError:
+                    self.log.exception('Cannot start publisher process for data sending.')
+            elif socket_addr:
                 try:
                     self.socket = self.context.socket(zmq.PUB)  # publisher socket
                     self.socket.setsockopt(zmq.LINGER, 0)
+                    if self.chip_settings.get('send_data_hwm', None):
+                        self.socket.setsockopt(zmq.SNDHWM, self.chip_settings['send_data_hwm'])
+                    self.socket.setsockopt(zmq.XPUB_NODROP, 1)  # signal full queue (zmq.Again) instead of silently dropping
                     self.socket.bind(socket_addr)
+                    if not self.chip_settings.get('send_data_multipart', False):
+                        import_simple_enc()  # not on use in the readout thread
                     self.log.debug('Sending data to server %s', socket_addr)
                 except zmq.error.ZMQError:
                     self.log.exception('Cannot connect to socket for data sending.')
                     self.socket = None
-            else:
-                self.socket = None
+
+    def _setup_profiler(self):
+        ''' Record the scan stages if profiling is enabled in the test bench, captured profiles are stored in the working directory '''
+        general = self.configuration['bench']['general']
+        if not general.get('profiling', False) or self.profiler is not None:
+            return
+        if not os.path.exists(self.working_dir):
+            os.makedirs(self.working_dir)
+        self.profiler = profiling.StageProfiler(capture_stage=general.get('profile_stage', None), capture_tool=general.get('profile_tool', 'cprofile'),
+                                                output_prefix=os.path.join(self.working_dir, self.run_name + '_profile'))
+        profiling.set_profiler(self.profiler)
+
+    def _get_filters(self, kind):
+        ''' Filters of h5 nodes for the compression profile of the test bench '''
+        return utils.get_filters(kind, self.configuration['bench']['general'].get('compression', None))
 
     def _init_hardware(self, force):
         if not self.hardware_initialized or force:
@@ -578,20 +793,7 @@ class ScanBase(object):
                     self.chip.init()  # resets masks to std. config
                     # pass
 
-                    # Set mask settings
-                    # Set TDAC mask, only available if previous file exists
-                    # Do not set other masks, but use std. config for them
-                    # Not really easy to understand logic: https://gitlab.cern.ch/silab/bdaq53/-/issues/401
-                    if self.chip_conf['masks']:
-                        self.chip.masks['tdac'] = deepcopy(self.chip_conf['masks']['tdac'])
-                    if not np.any(self.chip_conf['use_pixel']):  # first scan has no use_pixel mask defined
-                        self.chip_conf['use_pixel'] = np.ones_like(self.chip.masks['enable'])
-                    # # Unset disabled pixels in use_pixel mask, issue #456
-                    if self.chip_conf.get('disable_pixel'):
-                        for p in self.chip_conf.get('disable_pixel'):
-                            p_idx = ast.literal_eval(p)
-                            self.chip_conf['use_pixel'][p_idx] = 0
-                    self.chip.masks.disable_mask = deepcopy(self.chip_conf['use_pixel'])
+                    self._set_masks_from_config()
 
                     # # Check if chip is configured properly
                     # if self.daq.board_version != 'SIMULATION':
@@ -600,10 +802,36 @@ class ScanBase(object):
                     self._set_receiver_enabled(receiver=self.chip.receiver, enabled=False)
 
             self.hardware_initialized = True
+            if self.session is not None:
+                self.session.hardware_initialized = True
+        elif self.session is not None:
+            with self._logging_through_handlers():
+                self.log.info('Hardware initialized by previous scan of session, write configuration changes only')
+            for _ in self.iterate_chips():
+                with self._logging_through_handler(self.log_fh):
+                    self.chip.update_configuration(self.chip_conf)  # registers and masks to std. config
+                    self._set_masks_from_config()
+                    self._set_receiver_enabled(receiver=self.chip.receiver, enabled=False)
         else:
             with self._logging_through_handlers():
                 self.log.info('Hardware already initialized, skip initialization!')
 
+    def _set_masks_from_config(self):
+        ''' Set TDAC and disable mask from the chip configuration '''
+        # Set TDAC mask, only available if previous file exists
+        # Do not set other masks, but use std. config for them
+        # Not really easy to understand logic: https://gitlab.cern.ch/silab/bdaq53/-/issues/401
+        if self.chip_conf['masks']:
+            self.chip.masks['tdac'] = deepcopy(self.chip_conf['masks']['tdac'])
+        if not np.any(self.chip_conf['use_pixel']):  # first scan has no use_pixel mask defined
+            self.chip_conf['use_pixel'] = np.ones_like(self.chip.masks['enable'])
+        # # Unset disabled pixels in use_pixel mask, issue #456
+        if self.chip_conf.get('disable_pixel'):
+            for p in self.chip_conf.get('disable_pixel'):
+                p_idx = ast.literal_eval(p)
+                self.chip_conf['use_pixel'][p_idx] = 0
+        self.chip.masks.disable_mask = deepcopy(self.chip_conf['use_pixel'])
+
     def _set_chip_handles(self, chip):
         ''' Add the chip properties that are kept in the chip container
             to this class.
@@ -637,6 +865,7 @@ class ScanBase(object):
         if chip:  # set scan base handles to one chip
             for name in chip.__dict__.keys():  # loop instance attributes
                 set_property_one_chip(name, chip)
+            self._chip_container = chip
             self.configuration['scan'] = chip.scan_config  # API compatibility
         else:  # set scan base handles to all chips
             raise NotImplementedError('Multi chip handles are not supported')
@@ -858,10 +1087,10 @@ class ScanBase(object):
         # Chip masks
         mask_node = h5_file.create_group(chip_node, 'masks', 'Pixel masks (configuration per pixel and virtual disable mask)')
         for name, value in self.chip.masks.items():
-            h5_file.create_carray(mask_node, name=name, title=name.capitalize(), obj=value, filters=FILTER_RAW_DATA)
+            h5_file.create_carray(mask_node, name=name, title=name.capitalize(), obj=value, filters=self._get_filters('raw_data'))
 
         # Virtual enable mask
-        h5_file.create_carray(chip_node, name='use_pixel', title='Select pixels to be used in scans', obj=self.chip.masks.disable_mask, filters=FILTER_RAW_DATA)
+        h5_file.create_carray(chip_node, name='use_pixel', title='Select pixels to be used in scans', obj=self.chip.masks.disable_mask, filters=self._get_filters('raw_data'))
 
         bench_node = h5_file.create_group(node, 'bench', 'Test bench settings')
 
@@ -965,7 +1194,7 @@ class ScanBase(object):
 
         scan_par_table = h5_file.create_table(h5_file.root.configuration_out.scan, name='scan_params', title='Scan parameter values per scan parameter id', description=np.dtype(fields))
         for par_id, par_values in self.scan_parameters.items():
-            a = np.full(shape=(1,), fill_value=np.NaN).astype(np.dtype(fields))
+            a = np.full(shape=(1,), fill_value=np.nan).astype(np.dtype(fields))
             for key, val in par_values.items():
                 a['scan_param_id'] = par_id
                 a[key] = np.float32(val)
@@ -983,16 +1212,47 @@ class ScanBase(object):
         #         # Automatically enable hitbus if PToT mode is enabled
         #         self.chip.masks['hitbus'] = self.chip.masks['enable']
 
-        self.chip.masks.update(force=True)  # write all masks to chip
+        self.chip.masks.update(force=self.session is None)  # write all masks to chip, a session knows the masks written by the previous scans
 
     def _configure_fifo_readout(self):
-        self.fifo_readout = FifoReadout(self.daq)
+        if self.session is not None and self.session.fifo_readout is not None:
+            self.fifo_readout = self.session.fifo_readout
+            self.metrics_server = self.session.metrics_server
+        else:
+            self.fifo_readout = FifoReadout(self.daq)
+        self.fifo_readout.watchdog_interval = self.configuration['bench']['general'].get('rx_status_interval', None)
+        metrics_port = self.configuration['bench']['general'].get('metrics_port', None)
+        if metrics_port and self.metrics_server is None:
+            try:
+                self.metrics_server = MetricsServer(self.fifo_readout.metrics, port=metrics_port)
+            except OSError:
+                self.log.exception('Cannot start metrics server at port %s', metrics_port)
+        elif self.metrics_server:
+            self.metrics_server.metrics = self.fifo_readout.metrics
+        if self.session is not None:
+            self.session.fifo_readout, self.session.metrics_server = self.fifo_readout, self.metrics_server
         self._first_read = False
+        # Parallel scans of several chips: route the data words of each receiver to its chip
+        self.rx_data_identifiers = self._get_rx_data_identifiers() if self.is_parallel_scan and self.n_chips() > 1 else None
         # for receiver in self.daq.receivers:
         #     if self.daq.board_version != 'SIMULATION':  # Causes a timing issue in simulation
         #         self.daq.rx_channels[receiver].reset_logic()  # TODO: was done before at readout start, maybe not needed here
         #     self.daq.rx_channels[receiver].reset_counters()
 
+    def _get_rx_data_identifiers(self):
+        ''' Data identifier of the receiver of each chip, the words of a readout are split by it '''
+        known_identifiers = getattr(self.daq, 'rx_data_identifiers', {})  # defined by the readout system classes
+        identifiers = {}
+        for chip in self.chips.values():
+            receiver = chip.chip_settings['receiver']
+            if receiver not in known_identifiers:
+                raise ValueError('Unknown receiver %s of chip %s, data identifiers are only known for receivers %s'
+                                 % (receiver, chip.name, ', '.join(sorted(known_identifiers)) or 'none'))
+            if receiver in identifiers:
+                raise ValueError('Receiver %s is used by several chips, the data cannot be assigned to a chip' % receiver)
+            identifiers[receiver] = known_identifiers[receiver]
+        return identifiers
+
     def _set_receiver_enabled(self, receiver=None, enabled=True):
         if receiver is not None:
             self.daq.rx_channels[receiver].set_en(enabled)
@@ -1013,6 +1273,10 @@ class ScanBase(object):
                 node = h5_file.create_group(h5_file.root, 'configuration_out', 'Configuration after scan analysis')
                 self._write_config_h5(h5_file, node)
                 self._store_scan_par_values(h5_file)
+        # Reopen raw data file to append the profiling of all scan stages
+        if self.profiler is not None and os.path.isfile(self.output_filename + '.h5'):
+            with tb.open_file(self.output_filename + '.h5', 'a') as h5_file:
+                self.profiler.write_table(h5_file, chip=self.name)
 
     def _on_exception(self):
         ''' Called when exception occurs in main process '''
@@ -1038,11 +1302,17 @@ class ScanBase(object):
                 try:
                     if self.socket:
                         self.log.debug('Closing socket connection')
+                        if self.n_dropped_messages:
+                            self.log.warning('%d readouts were not sent to the online monitor (send queue full)', self.n_dropped_messages)
                         self.socket.close()
                         self.socket = None
+                    if self.publisher:
+                        self.publisher.close()
+                        self.publisher = None
                 except AttributeError:
                     pass
-            self.context.term()
+            if self.session is None:  # context of a session is terminated with the session
+                self.context.term()
             self.context = None
 
     @contextmanager
@@ -1069,7 +1339,7 @@ class ScanBase(object):
 
         self.scan_param_id = scan_param_id
 
-        callback = kwargs.pop('callback', self.handle_data)
+        callback = kwargs.pop('callback', self.handle_data_per_receiver if self.rx_data_identifiers else self.handle_data)
         errback = kwargs.pop('errback', self.handle_err)
         fill_buffer = kwargs.pop('fill_buffer', False)
         clear_buffer = kwargs.pop('clear_buffer', False)
@@ -1077,14 +1347,36 @@ class ScanBase(object):
         if kwargs:
             self.store_scan_par_values(scan_param_id, **kwargs)
 
-        self.start_readout(callback=callback, clear_buffer=clear_buffer, fill_buffer=fill_buffer, errback=errback, **kwargs)
-        try:
-            yield
-        finally:
-            if self.daq.board_version == 'SIMULATION':
-                for _ in range(100):
-                    self.daq.rx_channels[self.chip.receiver].is_done()
-            self.stop_readout(timeout=timeout)
+        # Chip handles can change within the readout context
+        chips = list(self.chips.values()) if callback == self.handle_data_per_receiver else [self._chip_container]
+        starts = [(chip.raw_data_earray.nrows, chip.meta_data_table.nrows) for chip in chips]
+
+        with profiling.stage('readout', chip=chips[0].name if len(chips) == 1 else '', scan_param_id=scan_param_id):
+            self.start_readout(callback=callback, clear_buffer=clear_buffer, fill_buffer=fill_buffer, errback=errback, **kwargs)
+            try:
+                yield
+            finally:
+                if self.daq.board_version == 'SIMULATION':
+                    for _ in range(100):
+                        self.daq.rx_channels[self.chip.receiver].is_done()
+                with profiling.stage('readout_stop'):  # waiting until all data is read and stored
+                    self.stop_readout(timeout=timeout)
+                # Summary of this readout, allows the analysis to get the words per scan parameter without reading all meta data
+                for chip, (index_start, n_readouts_start) in zip(chips, starts):
+                    chip.scan_param_range_table.append([(scan_param_id, index_start, chip.raw_data_earray.nrows, chip.meta_data_table.nrows - n_readouts_start)])
+                    chip.scan_param_range_table.flush()
+                self._write_rx_status([chip.rx_status_table for chip in chips])
+
+    def _write_rx_status(self, rx_status_tables):
+        ''' Move RX status changes recorded by the readout watchdog to the raw data file(s) '''
+        history = self.fifo_readout.rx_status_history
+        rows = []
+        while history:
+            rows.append(history.popleft())
+        if rows:
+            for rx_status_table in rx_status_tables:
+                rx_status_table.append(rows)
+                rx_status_table.flush()
 
     def start_readout(self, **kwargs):
         # Pop parameters for fifo_readout.start
@@ -1105,26 +1397,51 @@ class ScanBase(object):
         '''
             Handling of the data.
         '''
-        total_words = self.raw_data_earray.nrows
+        self._store_data(self._chip_container, data_tuple)
+
+    def handle_data_per_receiver(self, data_tuple):
+        '''
+            Handling of the data of parallel scans with several chips.
+            Every chip only gets the data words of its receiver and the trigger words.
+        '''
+        data_per_receiver = fifo_readout.demultiplex_data(data_tuple[0], self.rx_data_identifiers)
+        for chip in self.chips.values():
+            self._store_data(chip, (data_per_receiver[chip.chip_settings['receiver']], ) + tuple(data_tuple[1:]))
+
+    def _store_data(self, chip, data_tuple):
+        ''' Write readout to raw data file of chip and send it to its online monitor '''
+        raw_data_earray, meta_data_table = chip.raw_data_earray, chip.meta_data_table
+        total_words = raw_data_earray.nrows
 
-        self.raw_data_earray.append(data_tuple[0])
-        self.raw_data_earray.flush()
+        start_time = time.time()
+        raw_data_earray.append(data_tuple[0])
+        raw_data_earray.flush()
 
         len_raw_data = data_tuple[0].shape[0]
-        self.meta_data_table.row['timestamp_start'] = data_tuple[1]
-        self.meta_data_table.row['timestamp_stop'] = data_tuple[2]
-        self.meta_data_table.row['error'] = data_tuple[3]
-        self.meta_data_table.row['data_length'] = len_raw_data
-        self.meta_data_table.row['index_start'] = total_words
+        meta_data_table.row['timestamp_start'] = data_tuple[1]
+        meta_data_table.row['timestamp_stop'] = data_tuple[2]
+        meta_data_table.row['error'] = data_tuple[3]
+        meta_data_table.row['monotonic_start_ns'] = data_tuple[4]
+        meta_data_table.row['monotonic_stop_ns'] = data_tuple[5]
+        meta_data_table.row['data_length'] = len_raw_data
+        meta_data_table.row['index_start'] = total_words
         total_words += len_raw_data
-        self.meta_data_table.row['index_stop'] = total_words
-        self.meta_data_table.row['scan_param_id'] = self.scan_param_id
-
-        self.meta_data_table.row.append()
-        self.meta_data_table.flush()
-
-        if self.socket:
-            send_data(self.socket, data=data_tuple, scan_param_id=self.scan_param_id)
+        meta_data_table.row['index_stop'] = total_words
+        meta_data_table.row['scan_param_id'] = self.scan_param_id
+
+        meta_data_table.row.append()
+        meta_data_table.flush()
+        self.fifo_readout.metrics.add_duration('hdf5_write', time.time() - start_time)
+
+        start_time = time.time()
+        if chip.socket:
+            if not send_data(chip.socket, data=data_tuple, scan_param_id=self.scan_param_id, multipart=chip.chip_settings.get('send_data_multipart', False)):
+                chip.n_dropped_messages += 1
+        elif chip.publisher:
+            chip.publisher.send(data_tuple, scan_param_id=self.scan_param_id)
+        else:
+            return
+        self.fifo_readout.metrics.add_duration('send_data', time.time() - start_time)
 
     def handle_err(self, exc):
         ''' Handle errors when readout is started '''
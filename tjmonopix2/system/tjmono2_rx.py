@@ -63,3 +63,11 @@ class tjmono2_rx(RegisterHardwareLayer):
 
     def get_lost_data_counter(self):
         return self.LOST_DATA_COUNTER
+
+    def get_status(self):
+        ''' Read status and counters with one bus transaction (addresses 2 to 6) '''
+        data = self.get_bytes(addr=2, size=5)
+        return {'ready': data[0] & 0x01,
+                'fifo_size': data[1] | data[2] << 8,
+                'decoder_error_counter': data[3],
+                'lost_data_counter': data[4]}
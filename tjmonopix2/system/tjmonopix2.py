@@ -19,7 +19,7 @@ try:
 except ImportError:  # fallback to python parser
     from yaml import SafeLoader  # noqa
 
-from tjmonopix2.system import logger
+from tjmonopix2.system import logger, profiling
 
 FLAVOR_COLS = {'MONOPIX2': range(0, 224),
                'MONOPIX2_CASC': range(224, 448),
@@ -63,6 +63,120 @@ def encode_cmd(address, data):
     return [symbols[word_1], symbols[word_2], symbols[word_3], symbols[word_4], symbols[word_5], symbols[word_6]]
 
 
+CMD_SYMBOLS = np.array([0b01101010, 0b01101100, 0b01110001, 0b01110010, 0b01110100, 0b10001011, 0b10001101, 0b10001110,
+                        0b10010011, 0b10010101, 0b10010110, 0b10011001, 0b10011010, 0b10011100, 0b10100011, 0b10100101,
+                        0b10100110, 0b10101001, 0b01011001, 0b10101100, 0b10110001, 0b10110010, 0b10110100, 0b11000011,
+                        0b11000101, 0b11000110, 0b11001001, 0b11001010, 0b11001100, 0b11010001, 0b11010010, 0b11010100], dtype=np.uint8)
+
+
+def encode_cmds(addresses, data):
+    ''' Vectorized encode_cmd, returns the 6 symbols of every (address, data) pair as one row of an array '''
+    addresses, data = np.broadcast_arrays(np.asarray(addresses, dtype=np.uint32), np.asarray(data, dtype=np.uint32))
+    words = np.column_stack((addresses >> 5, addresses & 0x1f, data >> 11, (data >> 6) & 0x1f, (data >> 1) & 0x1f, (data & 0x1) << 4))
+    return CMD_SYMBOLS[words]
+
+
+class CommandChunk(bytearray):
+    '''
+        Command chunk with the register writes {address: data} it contains.
+        The shadow registers are updated with them when the chunk is written (TJMonoPix2.write_command()).
+    '''
+
+    def __init__(self, data, register_writes=None):
+        super(CommandChunk, self).__init__(data)
+        self.register_writes = register_writes if register_writes is not None else {}
+
+
+class CommandBuffer(object):
+    '''
+        Command stream in a preallocated buffer with the size of a command chunk (TJMonoPix2.get_cmd_chunk_size()).
+
+        Commands are appended as a whole and are never split. The buffer is flushed as one chunk
+        if the next command does not fit. Flushed chunks are written to the chip if write is True and are
+        kept in chunks. Chunks are CommandChunks (bytearrays) that the interface takes without element-wise conversion.
+        The register writes given with the commands are committed to the shadow registers only when a chunk is written,
+        chunks that are not written leave the shadow registers unchanged.
+
+        If the command encoder supports pipelined commands the chunks are written alternately to both halves of
+        the command memory, a chunk is uploaded while the previous chunk is sent. close() waits for the last chunk.
+    '''
+
+    def __init__(self, chip, write=True, size=None):
+        self.chip = chip
+        self.write = write
+        self.size = chip.get_cmd_chunk_size() if size is None else size
+        self.pipelined = write and chip.get_cmd_chunk_size() < chip.get_cmd_mem_size() and self.size <= chip.get_cmd_chunk_size()
+        self.data = bytearray(self.size)
+        self.array = np.frombuffer(self.data, dtype=np.uint8)  # numpy view of the buffer
+        self.n_bytes = 0
+        self.register_writes = {}  # register writes of the current chunk
+        self.chunks = []
+
+    def __len__(self):
+        return self.n_bytes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+    def append(self, command, register_writes=()):
+        ''' Append one command, a list of bytes or a bytes-like object, with the (address, data) of its register writes '''
+        size = len(command)
+        if size > self.size:
+            raise ValueError('Size of command (%d bytes) is too big for memory (%d bytes)' % (size, self.size))
+        if self.n_bytes + size > self.size:
+            self.flush()
+        self.data[self.n_bytes:self.n_bytes + size] = command
+        self.n_bytes += size
+        self.register_writes.update(register_writes)
+
+    def append_rows(self, commands, addresses=None, data=None):
+        '''
+            Append the commands given as rows of an uint8 array, e.g. from TJMonoPix2._encode_register_writes().
+            The register writes of the rows are given by addresses and data with one row per command row.
+        '''
+        commands = np.asarray(commands, dtype=np.uint8)
+        if addresses is not None:
+            addresses, data = np.broadcast_arrays(np.asarray(addresses), np.asarray(data))
+            addresses, data = addresses.reshape(commands.shape[0], -1), data.reshape(commands.shape[0], -1)
+        row_size = commands.shape[1]
+        if row_size > self.size:
+            raise ValueError('Size of command (%d bytes) is too big for memory (%d bytes)' % (row_size, self.size))
+        index = 0
+        while index < commands.shape[0]:
+            n_rows = min((self.size - self.n_bytes) // row_size, commands.shape[0] - index)
+            if n_rows == 0:
+                self.flush()
+                continue
+            self.array[self.n_bytes:self.n_bytes + n_rows * row_size] = commands[index:index + n_rows].ravel()
+            self.n_bytes += n_rows * row_size
+            if addresses is not None:
+                self.register_writes.update(zip(addresses[index:index + n_rows].ravel().tolist(), data[index:index + n_rows].ravel().tolist()))
+            index += n_rows
+
+    def flush(self):
+        ''' Finish the current chunk and write it to the chip '''
+        if self.n_bytes == 0:
+            return
+        chunk = CommandChunk(memoryview(self.data)[:self.n_bytes], self.register_writes)  # the buffer is reused for the next chunk
+        self.n_bytes = 0
+        self.register_writes = {}
+        self.chunks.append(chunk)
+        if self.pipelined:
+            self.chip._write_command_chunk(chunk, index=len(self.chunks) - 1)
+        elif self.write:
+            self.chip.write_command(chunk)
+
+    def close(self):
+        ''' Flush the last chunk and wait until all chunks are sent '''
+        self.flush()
+        if self.pipelined and self.chunks:
+            self.chip.wait_for_cmd_done()
+
+
 class Register(dict):
     def __init__(self, chip, name, address, offset, size, default, value, mode, reset, description):
         self.log = logger.setup_derived_logger('TJ-Monopix2 - Register')
@@ -80,6 +194,7 @@ class Register(dict):
         self['mode'] = mode
         self['reset'] = reset
         self['description'] = description
+        self.bit_mask = ((1 << size) - 1) << offset  # bits of the register in the data word of the address
 
     def __str__(self, *args, **kwargs):
         text = self['name']
@@ -132,11 +247,11 @@ class Register(dict):
         self.log.debug(('Writing value 0b{0:0' + str(self['size']) + 'b} to register {1}').format(self['value'], self['name']))
 
         if self['size'] <= 16:
-            wr_value = 0x0000
-            for reg in self.chip.registers.get_all_at_address(self['address']):
-                wr_value |= reg['value'] << reg['offset']
-
-            self.chip._write_register(self['address'], wr_value)
+            registers = self.chip.registers
+            wr_value = registers.get_address_value(self['address'])
+            if verify or not registers.holds(self['address'], wr_value):  # skip writes without effect
+                self.chip._write_register(self['address'], wr_value)
+            registers.set_unchanged(self['address'])
         else:
             raise RuntimeError("Register size is too big, set with _write_register()")
 
@@ -151,13 +266,9 @@ class Register(dict):
             self.set(value)
 
         if self['size'] <= 16:
-            wr_value = 0x0000
-            for reg in self.chip.registers.get_all_at_address(self['address']):
-                wr_value |= reg['value'] << reg['offset']
-
+            wr_value = self.chip.registers.get_address_value(self['address'])
             return self.chip._write_register(self['address'], wr_value, write=False)
         else:
-            wr_value = eval('0b' + '0' * self['size'])
             indata = []
             for i in range(0, self['size'], 16):
                 reg_value = (self['value'] & (0xFF << i)) >> i
@@ -169,8 +280,8 @@ class Register(dict):
 
     def read(self):
         val = self.chip._get_register_value(self['address'])
-        bit_mask = eval('0b' + '1' * self['size']) << self['offset']
-        val = (val & bit_mask) >> self['offset']
+        self.chip.registers.shadow[self['address']] = val
+        val = (val & self.bit_mask) >> self['offset']
         if val != self['value'] and self['mode'] == 1 and self['name'] != 'PIX_PORTAL':
             self.log.warning(
                 (
@@ -197,6 +308,8 @@ class RegisterObject(OrderedDict):
 
     def __init__(self, chip, lookup_file=None):
         self.chip = chip
+        self.shadow = {}  # address: data word that the chip holds, set when register writes are sent and on reads
+        self.address_index = {}  # address: registers at this address
         super(RegisterObject, self).__init__()
 
         if lookup_file is None:
@@ -217,39 +330,87 @@ class RegisterObject(OrderedDict):
                       reset=reg['reset'],
                       description=reg['description'])
 
+        # Writing these addresses has an effect even if the chip holds the value already (pixel data port, reset pulses)
+        self.uncached_addresses = set(reg['address'] for reg in self.values() if 'PORTAL' in reg['name'] or reg['name'].endswith('_RST'))
+
     def _add(self, name, address, offset, size, default, mode, reset, value=None, description=''):
         if value is None:
             value = default
         self[name] = Register(chip=self.chip, name=name, address=address, offset=offset, size=size, default=default, mode=mode, reset=reset, value=value, description=description)
+        self.address_index.setdefault(address, []).append(self[name])
 
     def get_all_at_address(self, address):
-        regs = []
-        for reg in self.values():
-            if reg['address'] is address:
-                regs.append(reg)
-        if len(regs) > 0:
-            return regs
-        raise ValueError('No register found with address {0}'.format(address))
-
-    def write_all(self, force=False):
+        try:
+            return self.address_index[address]
+        except KeyError:
+            raise ValueError('No register found with address {0}'.format(address))
+
+    def get_address_value(self, address):
+        ''' Data word of an address, combined from all registers at this address '''
+        value = 0x0000
+        for reg in self.get_all_at_address(address):
+            value |= reg['value'] << reg['offset']
+        return value
+
+    def holds(self, address, value):
+        ''' True if the chip holds the value at the address already and writing it again has no effect '''
+        return address not in self.uncached_addresses and self.shadow.get(address) == value
+
+    def set_unchanged(self, address):
+        for reg in self.get_all_at_address(address):
+            reg.changed = False
+
+    def clear_shadow(self):
+        ''' Chip state is unknown, e.g. after power on: the next register writes are not skipped '''
+        self.shadow.clear()
+
+    def write_all(self, force=False, write=True):
         '''
         Collect all registers that were changed in software and write to chip
         If force==True, write all software values to chip
+
+        The pixel portal is a data port to the pixel selected by the last mask update and is written with force only
+        Returns the commands, a list of command chunks, e.g. to write them later with write_command().
+        With write=False the registers stay changed until the chunks are written.
         '''
-        indata = self.chip.write_sync(write=False)
-        for reg in self.values():
-            if (reg['mode'] != 1 or (not force and not reg.changed)) and 'PIXEL_PORTAL' not in reg['name']:
-                continue
+        regs = [reg for reg in self.values() if reg['mode'] == 1 and (force or (reg.changed and 'PIXEL_PORTAL' not in reg['name']))]
+        return self._write_registers(regs, force=force, write=write)
 
-            indata += self[reg['name']].get_write_command()
-            indata += self.chip.write_sync(write=False) * 16
+    def write_values(self, values, write=True):
+        ''' Set the registers {name: value} and write them to the chip with one command, returns the command chunks '''
+        for name, value in values.items():
+            self[name].set(value)
+        return self._write_registers([self[name] for name in values], write=write)
 
-            if len(indata) > 3500:
-                indata += self.chip.write_sync(write=False) * 16
-                self.chip.write_command(indata)
-                indata = self.chip.write_sync(write=False)
+    def _write_registers(self, regs, force=False, write=True):
+        '''
+        Write the registers with as few commands as possible: registers at the same address
+        are written together and addresses that hold the value already are skipped unless force is set
 
-        self.chip.write_command(indata)
+        The commands are split into chunks that fit into the command encoder memory, the list of chunks is returned
+        '''
+        buffer = CommandBuffer(self.chip, write=write)
+        addresses = set()
+        for reg in regs:
+            if reg['address'] in addresses:  # written together with a register at the same address
+                continue
+            addresses.add(reg['address'])
+
+            if reg['size'] > 16:
+                buffer.append(reg.get_write_command() + self.chip.write_sync(write=False) * 16)
+                if write:
+                    reg.changed = False
+                continue
+            value = self.get_address_value(reg['address'])
+            if not force and self.holds(reg['address'], value):
+                self.set_unchanged(reg['address'])
+                continue
+            buffer.append(self.chip._write_register(reg['address'], value, write=False) + self.chip.write_sync(write=False) * 16,
+                          register_writes=[(reg['address'], value)])
+            if write:
+                self.set_unchanged(reg['address'])
+        buffer.close()
+        return buffer.chunks
 
     def check_all(self, correct=False):
         ''' Compare all chip registers to software and log result '''
@@ -439,6 +600,22 @@ class MaskObject(dict):
         dat = np.logical_or.reduce(self[mask], axis=0)[rowgroup * 16: (rowgroup + 1) * 16]
         return np.packbits(dat, bitorder='little').view(np.uint16)[0]
 
+    def _get_pixel_portal_data(self):
+        ''' get_pixel_portal_data() of all column groups and rows, shape (column groups, rows) '''
+        pixel_data = np.where(self['enable'], self['tdac'] & 0b111, 0).astype(np.uint16).reshape(-1, 4, self.dimensions[1])
+        return pixel_data[:, 0] | pixel_data[:, 1] << 4 | pixel_data[:, 2] << 8 | pixel_data[:, 3] << 12
+
+    def _get_column_group_data(self, mask):
+        ''' get_column_group_data() of all column groups '''
+        dat = np.logical_or.reduce(self[mask], axis=1).reshape(-1, 16)
+        return np.packbits(dat, axis=1, bitorder='little').view(np.uint16)[:, 0]
+
+    def _get_row_group_data(self, mask):
+        ''' get_row_group_data() of all row groups '''
+        dat = np.logical_or.reduce(self[mask], axis=0).reshape(-1, 16)
+        return np.packbits(dat, axis=1, bitorder='little').view(np.uint16)[:, 0]
+
+    @profiling.timed('mask_update')
     def update(self, force=False):
         ''' Write the actual pixel register configuration
 
@@ -457,77 +634,38 @@ class MaskObject(dict):
             inj_write_mask = self.inj_to_write
             pix_write_mask = self.pix_to_write
             hor_write_mask = self.hor_to_write
-        inj_to_write = np.column_stack((np.where(inj_write_mask)))
-        pix_to_write = np.column_stack((np.where(pix_write_mask)))
-        hor_to_write = np.column_stack((np.where(hor_write_mask)))
-
-        data = []
-        indata = self.chip.write_sync(write=False) * 10
-        if len(pix_to_write) > 0:
-            written = set()
-            for (col, row) in pix_to_write:
-                colgroup = int(col / 4)
-
-                # Speedup
-                if (colgroup, row) in written:
-                    continue
-
-                indata += self.chip._write_register(17, (colgroup & 0x7f) << 9 | (row & 0x1ff), write=False)  # Write colgroup and row at the same time for speedup
-                indata += self.chip.registers["PIXEL_PORTAL"].get_write_command(self.get_pixel_portal_data(colgroup, row))
-                indata += self.chip.write_sync(write=False)
-                written.add((colgroup, row))
-                if len(indata) > 4000:  # Write command to chip before it gets too long
-                    self.chip.write_command(indata)
-                    data.append(indata)
-                    indata = self.chip.write_sync(write=False)
-            self.chip.write_command(indata)
-            data.append(indata)
-        if len(inj_to_write) > 0:
-            written = set()
-            for (col, row) in inj_to_write:
-                colgroup = int(col / 16)
-                rowgroup = int(row / 16)
-
-                # Speedup
-                if (colgroup, rowgroup) in written:
-                    continue
-
-                indata += self.chip._write_register(82 + colgroup, self.get_column_group_data('injection', colgroup))
-                indata += self.chip._write_register(114 + rowgroup, self.get_row_group_data('injection', rowgroup))
-                indata += self.chip.write_sync(write=False)
-                written.add((colgroup, rowgroup))
-                if len(indata) > 4000:  # Write command to chip before it gets too long
-                    self.chip.write_command(indata)
-                    data.append(indata)
-                    indata = self.chip.write_sync(write=False)
-            self.chip.write_command(indata)
-            data.append(indata)
-        if len(hor_to_write) > 0:
-            written = set()
-            for (col, row) in inj_to_write:
-                colgroup = int(col / 16)
-                rowgroup = int(row / 16)
-
-                # Speedup
-                if (colgroup, rowgroup) in written:
-                    continue
-
-                indata += self.chip._write_register(18 + colgroup, self.get_column_group_data('hitor', colgroup))
-                indata += self.chip._write_register(50 + rowgroup, self.get_row_group_data('hitor', rowgroup))
-                indata += self.chip.write_sync(write=False)
-                written.add((colgroup, rowgroup))
-                if len(indata) > 4000:  # Write command to chip before it gets too long
-                    self.chip.write_command(indata)
-                    data.append(indata)
-                    indata = self.chip.write_sync(write=False)
-            self.chip.write_command(indata)
-            data.append(indata)
+        sync = self.chip.write_sync(write=False)
+        buffer = CommandBuffer(self.chip)
+        if np.any(pix_write_mask) or np.any(inj_write_mask) or np.any(hor_write_mask):
+            buffer.append(sync * 10)
+        # Pixels are written in groups of 4 columns, select column group and row at the same time for speedup
+        colgroups, rows = np.nonzero(np.any(pix_write_mask.reshape(-1, 4, self.dimensions[1]), axis=1))
+        if len(rows) > 0:
+            portal_data = self._get_pixel_portal_data()[colgroups, rows]
+            selections = (colgroups & 0x7f) << 9 | (rows & 0x1ff)
+            buffer.append_rows(np.hstack((self.chip._encode_register_writes(17, selections),
+                                          self.chip._encode_register_writes(16, portal_data),
+                                          np.tile(np.array(sync, dtype=np.uint8), (len(rows), 1)))),
+                               addresses=(17, 16), data=np.column_stack((selections, portal_data)))
+            self.chip.registers['PIXEL_PORTAL'].set(int(portal_data[-1]))
+        for mask, write_mask, col_address, row_address in (('injection', inj_write_mask, 82, 114), ('hitor', hor_write_mask, 18, 50)):
+            # Masks are the product of column and row groups of 16 pixels, every group is written once
+            colgroups = np.flatnonzero(np.any(write_mask, axis=1).reshape(-1, 16).any(axis=1))
+            rowgroups = np.flatnonzero(np.any(write_mask, axis=0).reshape(-1, 16).any(axis=1))
+            if len(colgroups) == 0:
+                continue
+            for addresses, data in ((col_address + colgroups, self._get_column_group_data(mask)[colgroups]),
+                                    (row_address + rowgroups, self._get_row_group_data(mask)[rowgroups])):
+                buffer.append_rows(np.hstack((self.chip._encode_register_writes(addresses, data),
+                                              np.tile(np.array(sync, dtype=np.uint8), (len(addresses), 1)))),
+                                   addresses=addresses, data=data)
+        buffer.close()
 
         # Set this mask as last mask to be able to find changes in next update()
         for name, mask in self.items():
             self.was[name][:] = mask[:]
 
-        return data
+        return buffer.chunks
 
 
 class ShiftPatternBase(object):
@@ -669,12 +807,27 @@ class TJMonoPix2(object):
                 self.masks.disable_mask[pix[0], pix[1]] = False
 
         self.debug = 0
+        self.cmd_mem_size = None
+        self.pipelined_commands = True  # write the next command chunk while a chunk is sent, if supported by the firmware
 
     def get_sn(self):
         return self.chip_sn
 
+    def get_cmd_mem_size(self):
+        ''' Size of the command encoder memory in bytes, read from the firmware once '''
+        if self.cmd_mem_size is None:
+            self.cmd_mem_size = self.daq['cmd'].get_mem_size()
+        return self.cmd_mem_size
+
+    def get_cmd_chunk_size(self):
+        ''' Maximum size of a command chunk, half of the command memory for pipelined commands '''
+        if self.pipelined_commands and self.daq['cmd'].has_start_addr():
+            return self.get_cmd_mem_size() // 2
+        return self.get_cmd_mem_size()
+
     def init(self):
         # super(TJMonoPix2, self).init()
+        self.registers.clear_shadow()  # register values after power on are not known
         self.daq['cmd'].set_chip_type(1)  # ITkpixV1-like
 
         # power on
@@ -731,13 +884,18 @@ class TJMonoPix2(object):
                 "VDDP", "VDDD", "VDDA", "VDDA_DAC"] else self.daq[pwr].get_current(unit='mA')
         return status
 
-    def configure_rx(self, delay=40, rd_frz_dly=40):
-        self.registers["FREEZE_START_CONF"].write(1 + delay)
-        self.registers["READ_START_CONF"].write(1 + delay + rd_frz_dly)
-        self.registers["READ_STOP_CONF"].write(5 + delay + rd_frz_dly)
-        self.registers["LOAD_CONF"].write(39 + delay + rd_frz_dly)
-        self.registers["FREEZE_STOP_CONF"].write(40 + delay + rd_frz_dly)
-        self.registers["STOP_CONF"].write(40 + delay + rd_frz_dly)
+    def configure_rx(self, delay=40, rd_frz_dly=40, write=True):
+        values = [("FREEZE_START_CONF", 1 + delay),
+                  ("READ_START_CONF", 1 + delay + rd_frz_dly),
+                  ("READ_STOP_CONF", 5 + delay + rd_frz_dly),
+                  ("LOAD_CONF", 39 + delay + rd_frz_dly),
+                  ("FREEZE_STOP_CONF", 40 + delay + rd_frz_dly),
+                  ("STOP_CONF", 40 + delay + rd_frz_dly)]
+        if write:
+            self.registers.write_values(OrderedDict(values))
+        else:  # set in software only, e.g. to write with registers.write_all()
+            for reg, val in values:
+                self.registers[reg].set(val)
 
     def reset(self):
         if self.daq.board_version == 'SIMULATION':
@@ -752,6 +910,23 @@ class TJMonoPix2(object):
         self.masks.reset_all()  # Set all masks to default and
         self.masks.update(force=True)   # write all masks to chip
 
+    def update_configuration(self, config):
+        '''
+            Set registers and masks to default values and the given chip configuration like reset(),
+            but only write the registers that differ from the last written values. The masks are
+            written with the next masks.update().
+        '''
+        self.configuration = config
+        for reg in self.registers.values():
+            if reg['reset'] == 1:
+                reg.set(reg['default'])
+        for reg, val in self.configuration['registers'].items():
+            self.registers[reg].set(val)
+        self.configure_rx(delay=40, rd_frz_dly=40, write=False)  # as set by init()
+        self.registers.write_all()
+
+        self.masks.reset_all()
+
     def interpret_direct_hit(self, raw_data):
         hit_dtype = np.dtype(
             [("col", "<u2"), ("row", "<u2"), ("le", "<u1"), ("te", "<u1"), ("noise", "<u1")])
@@ -897,14 +1072,16 @@ class TJMonoPix2(object):
         return np.average(temp[temp != float("nan")])
 
     # COMMAND DECODER
+    @profiling.timed('write_command')
     def write_command(self, data, repetitions=1, wait_for_done=True, wait_for_ready=False):
         '''
             Write data to the command encoder.
+            The shadow registers are updated with the register writes of CommandChunks when they are written.
 
             Parameters:
             ----------
-                data : list
-                    Up to [get_cmd_size()] bytes
+                data : list or bytearray
+                    Up to [get_cmd_mem_size()] bytes, or a list of these chunks. Nothing is written if empty.
                 repetitions : integer
                     Sets repetitions of the current request. 1...2^16-1. Default value = 1.
                 wait_for_done : boolean
@@ -912,7 +1089,12 @@ class TJMonoPix2(object):
                 wait_for_ready : boolean
                     Wait for completion of preceding commands before sending the command.
         '''
-        if isinstance(data[0], list):
+        if len(data) == 0:  # e.g. no register changes compiled by write_all(write=False)
+            return
+        if isinstance(data[0], (list, bytearray)):
+            if len(data) > 1 and self.get_cmd_chunk_size() < self.get_cmd_mem_size() and max(len(indata) for indata in data) <= self.get_cmd_chunk_size():
+                self._write_command_pipelined(data, repetitions, wait_for_done)
+                return
             for indata in data:
                 self.write_command(indata, repetitions, wait_for_done)
             return
@@ -925,15 +1107,52 @@ class TJMonoPix2(object):
             while (not self.daq['cmd'].is_done()):
                 pass
 
+        if self.daq['cmd'].has_start_addr():
+            self.daq['cmd'].set_start_addr(0)
         self.daq['cmd'].set_data(data)
         self.daq['cmd'].set_size(len(data))
         self.daq['cmd'].set_repetitions(repetitions)
         self.daq['cmd'].start()
+        if isinstance(data, CommandChunk):
+            self.registers.shadow.update(data.register_writes)
 
         if wait_for_done:
             while (not self.daq['cmd'].is_done()):
                 pass
 
+    def _write_command_pipelined(self, chunks, repetitions=1, wait_for_done=True):
+        '''
+            Write command chunks double-buffered: the next chunk is written to the other half
+            of the command memory while the current chunk is sent to the chip.
+        '''
+        for i, chunk in enumerate(chunks):
+            self._write_command_chunk(chunk, i, repetitions)
+
+        if wait_for_done:
+            self.wait_for_cmd_done()
+
+    def _write_command_chunk(self, chunk, index, repetitions=1):
+        '''
+            Write the chunk with the given index of a pipelined command stream to the half (index % 2) of the command
+            memory while the previous chunk is sent from the other half, then start it without waiting for completion.
+        '''
+        cmd = self.daq['cmd']
+        addr = self.get_cmd_mem_size() // 2 * (index % 2)
+        if index == 0:  # preceding command may be in any half
+            self.wait_for_cmd_done()
+        cmd.set_data(chunk, addr=addr)
+        self.wait_for_cmd_done()  # previous chunk is sent
+        cmd.set_start_addr(addr)
+        cmd.set_size(len(chunk))
+        cmd.set_repetitions(repetitions)
+        cmd.start()
+        if isinstance(chunk, CommandChunk):
+            self.registers.shadow.update(chunk.register_writes)
+
+    def wait_for_cmd_done(self):
+        while (not self.daq['cmd'].is_done()):
+            pass
+
     def write_sync(self, write=True):
         indata = [0b10000001, 0b01111110]
         if write:
@@ -974,7 +1193,35 @@ class TJMonoPix2(object):
 
         if write:
             self.write_command(indata)
+            self.registers.shadow[address] = data
+        else:  # the chip holds an unknown value until the command is written, see CommandBuffer for writes that keep the shadow registers
+            self.registers.shadow.pop(address, None)
+
+        return indata
+
+    def _encode_register_writes(self, addresses, data):
+        '''
+            Vectorized _write_register(write=False), e.g. to append many register writes to a CommandBuffer
 
+            Parameters:
+            ----------
+                addresses : int or array of int
+                    Addresses of the registers to be written to
+                data : int or array of int
+                    Values to write into the registers
+
+            Returns:
+            ----------
+                indata : numpy.ndarray
+                    Register write commands, one row of 8 bytes per register write.
+        '''
+        addresses, data = np.broadcast_arrays(np.asarray(addresses), np.asarray(data))
+        indata = np.empty((addresses.shape[0], 8), dtype=np.uint8)
+        indata[:, 0] = self.CMD_REGISTER
+        indata[:, 1] = self.cmd_data_map[self.chip_id]
+        indata[:, 2:] = encode_cmds(addresses, data)
+        for address in np.unique(addresses).tolist():  # unknown until the commands are written, see CommandBuffer.append_rows()
+            self.registers.shadow.pop(address, None)
         return indata
 
     def _read_register(self, address, write=True):
@@ -1056,9 +1303,11 @@ class TJMonoPix2(object):
         return indata
 
     def inject(self, PulseStartCnfg=1, PulseStopCnfg=10, repetitions=1, latency=400, wait_cycles=0, write=True):
-        indata = self.write_sync(write=False) * 4
-        indata += self.write_cal(PulseStartCnfg=PulseStartCnfg, PulseStopCnfg=PulseStopCnfg, wait_cycles=wait_cycles, write=False)  # Injection
-        indata += self.write_sync(write=False) * latency
+        ''' Injection command followed by latency sync commands as bytearray, that is written without conversion '''
+        sync = bytearray(self.write_sync(write=False))
+        indata = sync * 4
+        indata += bytearray(self.write_cal(PulseStartCnfg=PulseStartCnfg, PulseStopCnfg=PulseStopCnfg, wait_cycles=wait_cycles, write=False))  # Injection
+        indata += sync * latency
 
         if write:
             self.write_command(indata, repetitions=repetitions)
@@ -15,6 +15,7 @@ import tables as tb
 import tjmonopix2
 # Required to trigger imports of mocked objects
 from tjmonopix2.system import scan_base  # noqa: F401
+from tjmonopix2.tests.test_software.replay import FifoReplay
 
 
 class TJMonopix2Mock(object):
@@ -23,12 +24,15 @@ class TJMonopix2Mock(object):
         raw_data_file: h5 raw data file from a scan
             Chip raw data can be simulated by providing a raw_data_file. Timings are not preserved since
             FIFO readout is asynchronous.
+        word_rate: words per second
+            Replay the raw data of raw_data_file at this rate instead of one readout per read (see replay.FifoReplay).
         send_commands_file: h5 file
             Create an h5 file and stores *all* commands send to chip. Useful for testing and debuging.
     """
 
-    def __init__(self, raw_data_file=None, send_commands_file=None, create_chip_data=True):
+    def __init__(self, raw_data_file=None, send_commands_file=None, create_chip_data=True, word_rate=None):
         self.raw_data_file = raw_data_file
+        self.word_rate = word_rate
         self.send_commands_file = send_commands_file
         self.create_chip_data = create_chip_data
         self.patches = {}
@@ -57,6 +61,7 @@ class TJMonopix2Mock(object):
 
         self.patch_function('tjmonopix2.system.bdaq53.BDAQ53.init', init_mock)
         self.patch_function('tjmonopix2.system.bdaq53.BDAQ53.get_tlu_erros', lambda *args, **kwargs_: (0, 0))
+        self.patch_function('tjmonopix2.system.tjmonopix2.TJMonoPix2.get_cmd_mem_size', lambda _: 4096)  # command encoder memory of the firmware
 
         self.bdaq53_patcher.append(mock.patch('tjmonopix2.system.bdaq53.BDAQ53.__getitem__'))  # basil dict access
         self.bdaq53_patcher[-1].return_value = 0
@@ -101,6 +106,8 @@ class TJMonopix2Mock(object):
 
         self.patch_function('tjmonopix2.system.fifo_readout.FifoReadout.get_rx_fifo_discard_count', get_count)
         self.patch_function('tjmonopix2.system.fifo_readout.FifoReadout.get_rx_8b10b_error_count', get_count)
+        self.patch_function('tjmonopix2.system.fifo_readout.FifoReadout.get_rx_status',
+                            lambda _: {'rx0': {'ready': 1, 'fifo_size': 0, 'decoder_error_counter': 0, 'lost_data_counter': 0}})
 
         # Speed up testing time drastically, by not calling mask shifting
         self.patch_function('tjmonopix2.system.tjmonopix2.MaskObject.update')
@@ -111,9 +118,13 @@ class TJMonopix2Mock(object):
             self.raw_data = self.in_file_h5.root.raw_data
             n_readouts = self.meta_data.shape[0]
             self.i_ro = 0
+            if self.word_rate:
+                self.replay = FifoReplay(self.raw_data[:], word_rate=self.word_rate)
 
         def read_data(cls):
             if self.create_chip_data:
+                if self.raw_data_file and self.word_rate:  # return chip raw data from file at given rate
+                    return self.replay.get_data() | (self.enabled_rx[0] << 20)
                 if self.raw_data_file:  # return chip raw data from file
                     if self.i_ro < n_readouts:
                         # Raw data indeces of readout
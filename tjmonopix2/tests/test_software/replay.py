@@ -0,0 +1,128 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+'''
+    Replay of recorded raw data through the FIFO readout without hardware.
+
+    FifoReplay stands in for daq['FIFO'] and returns the raw data words at a
+    configurable word rate and burst profile, ReplayDaq provides the minimal
+    readout system interface needed by FifoReadout.
+'''
+
+from time import perf_counter
+
+import numpy as np
+import tables as tb
+
+
+class FifoReplay(object):
+    '''
+        Stand-in for daq['FIFO'] returning recorded raw data words
+
+        raw_data: np.array of data words or h5 file name with raw_data node
+        word_rate: average words per second, None returns the data as fast as it is read
+        burst_profile: sequence of (duration in seconds, relative rate) that is repeated,
+                       e.g. ((0.09, 0.), (0.01, 10.)) for 10 ms bursts every 100 ms at the same average rate
+        fifo_size: maximum number of words returned per get_data() call
+        loop: start from the beginning when all data was returned, until n_words are returned
+    '''
+
+    def __init__(self, raw_data, word_rate=None, burst_profile=None, fifo_size=2 ** 21, loop=False, n_words=None):
+        if isinstance(raw_data, str):
+            with tb.open_file(raw_data) as in_file:
+                raw_data = in_file.root.raw_data[:]
+        self.raw_data = np.ascontiguousarray(raw_data, dtype=np.uint32)
+        self.word_rate = word_rate
+        self.fifo_size = fifo_size
+        self.loop = loop
+        self.n_words = n_words if n_words is not None else (None if loop else self.raw_data.shape[0])
+
+        if burst_profile is None:
+            burst_profile = ((1., 1.), )
+        durations = np.array([duration for duration, _ in burst_profile], dtype=np.float64)
+        rates = np.array([rate for _, rate in burst_profile], dtype=np.float64)
+        rates *= durations.sum() / (durations * rates).sum()  # normalize average rate to 1
+        self._edges = np.append(0., np.cumsum(durations))
+        self._words = np.append(0., np.cumsum(durations * rates))  # relative words at the edges within one period
+
+        self.reset()
+
+    def reset(self):
+        self.words_returned = 0
+        self._start_time = None
+
+    def __getitem__(self, name):
+        if name == 'RESET':
+            self.reset()
+            return 0
+        if name == 'FIFO_SIZE':
+            return self._available_words() if self._start_time is not None else 0
+        raise KeyError(name)
+
+    @property
+    def done(self):
+        return self.n_words is not None and self.words_returned >= self.n_words
+
+    def _words_until(self, elapsed):
+        ''' Words to return within elapsed seconds after the first readout '''
+        period = self._edges[-1]
+        n_periods, time_in_period = divmod(elapsed, period)
+        words = n_periods * self._words[-1] + np.interp(time_in_period, self._edges, self._words)
+        return int(words * self.word_rate)
+
+    def _available_words(self):
+        if self.word_rate is None or self._start_time is None:
+            n_words = self.fifo_size
+        else:
+            n_words = self._words_until(perf_counter() - self._start_time) - self.words_returned
+        if self.n_words is not None:
+            n_words = min(n_words, self.n_words - self.words_returned)
+        return max(min(n_words, self.fifo_size), 0)
+
+    def get_data(self):
+        if self._start_time is None:
+            self._start_time = perf_counter()
+        n_words = self._available_words()
+        if n_words == 0:
+            return np.empty(0, dtype=np.uint32)
+        start = self.words_returned % self.raw_data.shape[0]
+        if start + n_words <= self.raw_data.shape[0]:
+            data = self.raw_data[start:start + n_words].copy()
+        else:  # wrap around
+            indices = np.arange(start, start + n_words) % self.raw_data.shape[0]
+            data = self.raw_data[indices]
+        self.words_returned += n_words
+        return data
+
+
+class ReplayRx(object):
+    ''' Receiver without errors '''
+
+    def reset(self):
+        pass
+
+    def get_status(self):
+        return {'ready': 1, 'fifo_size': 0, 'decoder_error_counter': 0, 'lost_data_counter': 0}
+
+    def get_decoder_error_counter(self):
+        return 0
+
+    def get_lost_data_counter(self):
+        return 0
+
+
+class ReplayDaq(object):
+    ''' Minimal readout system for FifoReadout with replayed FIFO data '''
+
+    def __init__(self, fifo, receivers=('rx0', )):
+        self.fifo = fifo
+        self.rx_channels = {receiver: ReplayRx() for receiver in receivers}
+
+    def __getitem__(self, name):
+        if name == 'FIFO':
+            return self.fifo
+        raise KeyError(name)
@@ -0,0 +1,102 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import tables as tb
+
+from tjmonopix2.analysis import analysis_utils as au
+from tjmonopix2.analysis import hit_storage
+from tjmonopix2.tests.test_software import utils as sw_utils
+
+
+class TestAnalysis(unittest.TestCase):
+    """ Histograms and hit storage of the analysis, with synthetic scan files as input """
+
+    def setUp(self) -> None:
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.output_dir)
+
+    def analyze(self, analysis_kwargs={}, **kwargs):
+        return sw_utils.analyze_synthetic_scan(self.output_dir, analysis_kwargs, **kwargs)
+
+    def test_cluster_histograms(self) -> None:
+        ''' Cluster histograms are filled chunk wise and have a variable length of at least 30 (size) and 256 (ToT) bins '''
+        with self.analyze(analysis_kwargs={'cluster_hits': True}, kind='source') as in_file:
+            cluster = in_file.root.Cluster[:]
+            assert cluster.shape[0] > 0
+            for name, column, min_bins in (('HistClusterSize', 'size', 30), ('HistClusterTot', 'tot', 256)):
+                hist = in_file.root[name][:]
+                expected = np.bincount(cluster[column])
+                assert hist.shape[0] == max(min_bins, expected.shape[0])
+                assert np.array_equal(hist[:expected.shape[0]], expected)
+                assert not np.any(hist[expected.shape[0]:])
+            assert in_file.root.HistClusterShape.shape == (300, )
+            assert in_file.root.Cluster.cols.event_number.is_indexed
+
+    def test_columnar_hits(self) -> None:
+        ''' Hits of the columnar format read back equal to the hit table '''
+        with self.analyze(kind='source') as in_file:
+            table_hits = in_file.root.Dut[:]
+        with self.analyze(analysis_kwargs={'hit_format': 'columnar'}, kind='source') as in_file:
+            hits = hit_storage.open_hits(in_file.root.Dut)
+            assert len(hits) == table_hits.shape[0]
+            assert np.array_equal(hits[:], table_hits)
+            assert np.array_equal(hits[1000:5000:3], table_hits[1000:5000:3])
+            columns = hits.read_columns(['col', 'row', 'timestamp'], 100, 200)
+            for name in ('col', 'row', 'timestamp'):
+                assert np.array_equal(columns[name], table_hits[name][100:200])
+
+    def test_raw_data_memmap(self) -> None:
+        ''' Raw data cache is created once, reused while the raw data file is unchanged and rebuilt otherwise '''
+        raw_data_file = os.path.join(self.output_dir, 'scan.h5')
+        cache_file = os.path.join(self.output_dir, 'scan_raw_data.npy')
+        raw_data = np.arange(100000, dtype=np.uint32)
+        with tb.open_file(raw_data_file, 'w') as out_file:  # uncompressed, the file size does not change with the data
+            out_file.create_earray(out_file.root, name='raw_data', atom=tb.UIntAtom(), shape=(0, ), obj=raw_data)
+
+        def get_memmap():
+            with mock.patch.object(au.tb, 'open_file', wraps=tb.open_file) as open_file:
+                data = au.get_raw_data_memmap(raw_data_file, chunk_size=30000)
+            return data, open_file.call_count > 0  # raw data was decompressed
+
+        data, created = get_memmap()
+        assert created and os.path.isfile(cache_file) and os.path.isfile(cache_file + '.json')
+        assert isinstance(data, np.memmap) and np.array_equal(data, raw_data)
+        assert not get_memmap()[1]  # reused
+
+        size = os.path.getsize(raw_data_file)
+        with tb.open_file(raw_data_file, 'a') as out_file:
+            out_file.root.raw_data[10] = 0
+        raw_data[10] = 0
+        assert os.path.getsize(raw_data_file) == size
+        data, created = get_memmap()
+        assert created and np.array_equal(data, raw_data)  # same size, other hash
+
+        with tb.open_file(raw_data_file, 'a') as out_file:
+            out_file.root.raw_data.append(raw_data[:1000])
+        data, created = get_memmap()
+        assert created and data.shape[0] == 101000
+
+        with open(cache_file + '.json', 'w') as f:
+            f.write('{"size": ')
+        with open(cache_file + '.tmp', 'w') as f:  # left over from an aborted cache creation
+            f.write('corrupt')
+        data, created = get_memmap()
+        assert created and data.shape[0] == 101000 and not os.path.isfile(cache_file + '.tmp')
+        assert not get_memmap()[1]
+
+
+if __name__ == '__main__':
+    unittest.main()
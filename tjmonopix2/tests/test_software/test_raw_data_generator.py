@@ -0,0 +1,45 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from tjmonopix2.tests.test_software import utils as sw_utils
+
+
+class TestRawDataGenerator(unittest.TestCase):
+    """ Analysis of synthetic scan files, the data blocks are repeated several times to cover the time shift of repeated blocks """
+
+    def setUp(self) -> None:
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.output_dir)
+
+    def analyze(self, analysis_kwargs={}, **kwargs):
+        return sw_utils.analyze_synthetic_scan(self.output_dir, analysis_kwargs, **kwargs)
+
+    def test_source_scan(self) -> None:
+        with self.analyze(kind='source') as in_file:
+            hits = in_file.root.Dut[:]
+            assert in_file.root.HistOcc[:].sum() == np.count_nonzero(hits['col'] < 512) > 0
+            assert np.all(np.diff(hits['timestamp'].astype(np.int64)) >= 0)  # repeated blocks are recorded later
+
+    def test_trigger_data_formats(self) -> None:
+        for trigger_data_format in (0, 1, 2):
+            with self.analyze(kind='triggered', trigger_data_format=trigger_data_format) as in_file:
+                hits = in_file.root.Dut[:]
+                n_hits = np.count_nonzero(hits['col'] < 512)
+                assert in_file.root.Hits.nrows == n_hits > 0  # every hit is assigned to its trigger
+                assert np.unique(in_file.root.Hits[:]['event_number']).shape[0] == np.count_nonzero(hits['col'] == 1023)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import urllib.error
+import urllib.request
+from unittest import mock
+
+import numpy as np
+import tables as tb
+
+from tjmonopix2 import utils
+from tjmonopix2.system import fifo_readout, scan_base
+from tjmonopix2.system.bdaq53 import BDAQ53
+from tjmonopix2.system.metrics import MetricsServer, ReadoutMetrics
+from tjmonopix2.system.mio3 import MIO3
+
+
+class TestReadout(unittest.TestCase):
+    """ Routing of the data words of parallel scans to the chips by the data identifier of the receivers """
+
+    rx_data_identifiers = {'rx0': 0b0100, 'rx1': 0b0101}
+
+    def setUp(self) -> None:
+        self.output_dir = tempfile.mkdtemp()
+        self.h5_files = []
+
+    def tearDown(self) -> None:
+        for h5_file in self.h5_files:
+            h5_file.close()
+        shutil.rmtree(self.output_dir)
+
+    def get_scan(self, receivers):
+        ''' Scan with one chip per receiver writing to its own raw data file '''
+        scan = scan_base.ScanBase()
+        scan.daq = mock.MagicMock()
+        scan.daq.rx_data_identifiers = self.rx_data_identifiers
+        scan.fifo_readout = mock.MagicMock()
+        scan.scan_param_id = 3
+        for i, receiver in enumerate(receivers):
+            name = 'module_0_chip_%d' % i
+            chip = scan_base.ChipContainer(name=name, chip_settings={'receiver': receiver}, chip_conf=None, module_settings={'name': 'module_0'},
+                                           output_filename=os.path.join(self.output_dir, 'scan_%d' % len(self.h5_files)), output_dir=self.output_dir, log_fh=None, scan_config={})
+            h5_file = tb.open_file(chip.output_filename + '.h5', mode='w')
+            self.h5_files.append(h5_file)
+            chip.raw_data_earray = h5_file.create_earray(h5_file.root, name='raw_data', atom=tb.UIntAtom(), shape=(0,), filters=utils.get_filters('raw_data'))
+            chip.meta_data_table = h5_file.create_table(h5_file.root, name='meta_data', description=scan_base.MetaTable, filters=utils.get_filters('tables'))
+            scan.chips[name] = chip
+        return scan
+
+    def test_demultiplex_data(self) -> None:
+        data = np.array([0x40000001, 0x50000002, 0x80000003, 0x40000004, 0x20000005, 0x50000006], dtype=np.uint32)
+        data_per_receiver = fifo_readout.demultiplex_data(data, self.rx_data_identifiers)
+        assert data_per_receiver['rx0'].tolist() == [0x40000001, 0x80000003, 0x40000004, 0x20000005]  # trigger and TDC words go to every receiver
+        assert data_per_receiver['rx1'].tolist() == [0x50000002, 0x80000003, 0x20000005, 0x50000006]
+
+        data_per_receiver = fifo_readout.demultiplex_data(np.zeros(0, dtype=np.uint32), self.rx_data_identifiers)
+        assert all(words.shape == (0, ) for words in data_per_receiver.values())
+
+    def test_store_data_per_receiver(self) -> None:
+        scan = self.get_scan(['rx0', 'rx1'])
+        scan.rx_data_identifiers = scan._get_rx_data_identifiers()
+        assert scan.rx_data_identifiers == self.rx_data_identifiers
+
+        data = np.array([0x40000001, 0x50000002, 0x80000003, 0x40000004], dtype=np.uint32)
+        for _ in range(2):
+            scan.handle_data_per_receiver((data, 1.0, 2.0, 0, 10, 20))
+        chip_0, chip_1 = scan.chips.values()
+        assert chip_0.raw_data_earray[:].tolist() == [0x40000001, 0x80000003, 0x40000004] * 2
+        assert chip_1.raw_data_earray[:].tolist() == [0x50000002, 0x80000003] * 2
+        meta_data = chip_1.meta_data_table[:]
+        assert meta_data['index_start'].tolist() == [0, 2] and meta_data['index_stop'].tolist() == [2, 4]
+        assert np.all(meta_data['scan_param_id'] == 3) and np.all(meta_data['monotonic_stop_ns'] == 20)
+
+    def test_unknown_receiver(self) -> None:
+        with self.assertRaisesRegex(ValueError, 'Unknown receiver rx2'):
+            self.get_scan(['rx0', 'rx2'])._get_rx_data_identifiers()
+        with self.assertRaisesRegex(ValueError, 'used by several chips'):
+            self.get_scan(['rx1', 'rx1'])._get_rx_data_identifiers()
+
+        scan = self.get_scan(['rx0', 'rx1'])
+        scan.daq = mock.MagicMock(spec=[])  # readout system without data identifiers
+        with self.assertRaisesRegex(ValueError, 'Unknown receiver rx0'):
+            scan._get_rx_data_identifiers()
+        assert MIO3.rx_data_identifiers == BDAQ53.rx_data_identifiers  # same firmware core
+
+    def test_rx_status(self) -> None:
+        ''' Only changes of the RX status are recorded and written to the raw data file '''
+        snapshots = {'rx0': [(1, 0, 0), (1, 0, 0), (1, 2, 0), (1, 2, 0), (0, 2, 5)],
+                     'rx1': [(0, 0, 0), (1, 0, 0), (1, 0, 0), (1, 0, 0), (1, 0, 0)]}
+        daq = mock.MagicMock()
+        daq.rx_channels = {name: mock.MagicMock() for name in snapshots}
+        for name, rx in daq.rx_channels.items():
+            rx.get_status.side_effect = [{'ready': ready, 'fifo_size': 10, 'decoder_error_counter': errors, 'lost_data_counter': lost}
+                                         for ready, errors, lost in snapshots[name]]
+        readout = fifo_readout.FifoReadout(daq)
+        for _ in range(len(snapshots['rx0'])):
+            readout._record_rx_status(readout.get_rx_status())
+        history = list(readout.rx_status_history)
+        assert [row[1:] for row in history] == [('rx0', 1, 0, 0), ('rx1', 0, 0, 0), ('rx1', 1, 0, 0), ('rx0', 1, 2, 0), ('rx0', 0, 2, 5)]
+        assert all(history[i][0] <= history[i + 1][0] for i in range(len(history) - 1))
+
+        scan = scan_base.ScanBase()
+        scan.fifo_readout = readout
+        h5_file = tb.open_file(os.path.join(self.output_dir, 'rx_status.h5'), mode='w')
+        self.h5_files.append(h5_file)
+        rx_status_table = h5_file.create_table(h5_file.root, name='rx_status', description=scan_base.RxStatusTable)
+        scan._write_rx_status([rx_status_table])
+        rows = rx_status_table[:]
+        assert [(row['receiver'].decode(), row['ready'], row['decoder_error_counter'], row['lost_data_counter']) for row in rows] == [row[1:] for row in history]
+        assert np.array_equal(rows['timestamp'], [row[0] for row in history])
+        assert not readout.rx_status_history  # moved to the file
+
+        scan._write_rx_status([rx_status_table])
+        assert rx_status_table.nrows == len(history)
+
+
+class TestMetrics(unittest.TestCase):
+    """ Readout metrics and their http endpoint """
+
+    def setUp(self) -> None:
+        self.metrics = ReadoutMetrics()
+        self.server = MetricsServer(self.metrics, port=0)  # free port
+        self.url = 'http://127.0.0.1:%d' % self.server.server.server_port
+
+    def tearDown(self) -> None:
+        self.server.close()
+
+    def get(self, path):
+        with urllib.request.urlopen(self.url + path, timeout=5) as response:
+            return response.read().decode()
+
+    def test_counters(self) -> None:
+        for n_words in (100, 200, 300):
+            self.metrics.add_readout(n_words)
+        self.metrics.add_callback(0.003)
+        self.metrics.add_callback(20.)
+        self.metrics.add_duration('hdf5_write', 0.5)
+        self.metrics.add_duration('hdf5_write', 0.25)
+        self.metrics.rx_discard_count = [0, 4]
+
+        snapshot = json.loads(self.get('/metrics.json'))
+        assert snapshot['words_total'] == 600 and snapshot['readouts_total'] == 3 and snapshot['callbacks_total'] == 2
+        assert snapshot['words_per_second'] == 600 / self.metrics.rate_time_period
+        assert snapshot['callback_latency_seconds']['counts'][2] == 1 and snapshot['callback_latency_seconds']['counts'][-1] == 1
+        assert snapshot['hdf5_write_total'] == 2 and snapshot['hdf5_write_seconds'] == 0.75
+
+        lines = self.get('/metrics').splitlines()
+        assert 'tjmonopix2_words_total 600' in lines
+        assert 'tjmonopix2_callback_latency_seconds_bucket{le="0.005"} 1' in lines
+        assert 'tjmonopix2_callback_latency_seconds_count 2' in lines
+        assert 'tjmonopix2_rx_discard_count{rx="1"} 4' in lines
+
+        with self.assertRaises(urllib.error.HTTPError):
+            self.get('/other')
+
+    def test_replaced_metrics(self) -> None:
+        ''' Metrics of a new FIFO readout are served after replacing them at the server '''
+        self.metrics.add_readout(100)
+        metrics = ReadoutMetrics()
+        metrics.add_readout(5)
+        self.server.metrics = metrics
+        assert json.loads(self.get('/metrics.json'))['words_total'] == 5
+
+
+if __name__ == '__main__':
+    unittest.main()
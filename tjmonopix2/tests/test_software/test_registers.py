@@ -0,0 +1,257 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from tjmonopix2.system.tjmonopix2 import CommandBuffer, TJMonoPix2, encode_cmd
+
+
+class TestRegisters(unittest.TestCase):
+    """ Register writes of the chip object without hardware, the commands are collected by a command encoder fake """
+
+    def setUp(self) -> None:
+        self.encoder = CommandEncoder()
+        daq = mock.MagicMock()
+        daq.board_version = 'BDAQ53'
+        daq.__getitem__.return_value = self.encoder
+        self.chip = TJMonoPix2(daq, config={'registers': {}})
+        self.commands = self.encoder.sent  # commands sent to the chip
+        self.written = []  # (address, data) of all register writes
+        write_register = self.chip._write_register
+
+        def record_write_register(address, data, write=True):
+            self.written.append((address, data))
+            return write_register(address, data, write)
+        self.chip._write_register = record_write_register
+
+    def test_skip_writes_without_effect(self) -> None:
+        registers = self.chip.registers
+        registers['VL'].write(30)
+        registers['VL'].write(30)
+        registers['VH'].write(registers['VH'].get())
+        assert self.written == [(8, registers.get_address_value(8))]  # chip holds the values already
+
+        registers.clear_shadow()  # e.g. after power on
+        registers['VL'].write(30)
+        assert len(self.written) == 2
+
+        registers.shadow[8] = 0  # e.g. read back a different value
+        registers['VL'].write(30)
+        assert len(self.written) == 3
+
+    def test_coalesced_writes(self) -> None:
+        registers = self.chip.registers
+        registers.write_values({'VL': 40, 'VH': 140, 'ITHR': 30, 'IBIAS': 60})
+        assert self.written == [(8, 140 << 8 | 40), (0, 30 << 8 | 60)]  # one write per address
+        assert len(self.commands) == 1
+        assert not any(reg.changed for reg in registers.values())
+
+        registers.write_values({'VL': 40, 'VH': 140})
+        assert len(self.commands) == 1  # nothing to write
+
+        for name in ('MON_EN_IBIAS', 'MON_EN_ITHR', 'OVR_EN_IBIAS'):
+            registers[name].set(1)
+        registers.write_all()
+        assert self.written[2:] == [(4, 0b1_0000_0011)]
+
+    def test_uncached_addresses(self) -> None:
+        registers = self.chip.registers
+        for _ in range(2):
+            registers['PIXEL_PORTAL'].write(0x1234)  # writes pixel data
+            registers['WR_BCID_CNT_RST'].write(0)  # reset pulse
+        assert len(self.written) == 4
+
+    def test_write_all_force(self) -> None:
+        registers = self.chip.registers
+        registers.write_all(force=True)
+        addresses = set(reg['address'] for reg in registers.values() if reg['mode'] == 1 and reg['size'] <= 16)
+        written = [address for address, _ in self.written if address in addresses]
+        assert sorted(written) == sorted(addresses)  # registers at the same address are written together
+        n_written = len(self.written)
+        registers.write_all(force=True)
+        assert len(self.written) == 2 * n_written  # force writes also values the chip holds already
+
+    def test_address_index(self) -> None:
+        registers = self.chip.registers
+        for address in set(reg['address'] for reg in registers.values()):
+            assert registers.get_all_at_address(address) == [reg for reg in registers.values() if reg['address'] == address]
+        with self.assertRaises(ValueError):
+            registers.get_all_at_address(1000)
+
+        registers.shadow[8] = 0xFFFF
+        self.chip._get_register_value = lambda address, *args, **kwargs: registers.shadow[address]
+        registers['VL'].set(0xFF)
+        assert registers['VL'].read() == 0xFF  # bits of VH are masked
+        assert registers['VL'].bit_mask == 0x00FF and registers['VH'].bit_mask == 0xFF00
+
+    def test_compile_commands(self) -> None:
+        registers = self.chip.registers
+        registers['VL'].set(30)
+        chunks = registers.write_all(force=True, write=False)
+        assert not self.commands  # nothing sent
+        assert chunks and all(len(chunk) <= 2048 for chunk in chunks)  # chunks fit into one half of the command encoder memory
+        assert registers['VL'].changed and 8 not in registers.shadow  # chip holds the values only after the chunks are written
+
+        self.chip.write_command(chunks)
+        assert self.commands == [bytes(chunk) for chunk in chunks]
+        assert registers.shadow[8] == registers.get_address_value(8)
+        assert registers.write_all(write=False) == []  # chip holds all values
+        self.chip.write_command(registers.write_all(write=False))
+        assert len(self.commands) == len(chunks)  # nothing to send
+
+    def test_shadow_of_unsent_commands(self) -> None:
+        registers = self.chip.registers
+        registers['VL'].write(30)
+        registers['VL'].set(40)
+        registers.write_all(write=False)  # not sent
+        registers['VL'].write(30)
+        assert self.written[-1] == (8, registers.get_address_value(8))  # chip may hold 40 or 30, written again
+
+        registers['VL'].get_write_command(40)
+        registers['VL'].write(30)
+        assert len(self.commands) == 3
+
+        masks = self.chip.masks
+        masks['enable'][0, 0] = True
+        masks.update()
+        assert registers.shadow[17] == 0  # column group and row of the last written pixel
+
+    def test_command_buffer(self) -> None:
+        with CommandBuffer(self.chip, size=20) as buffer:
+            buffer.append(self.chip._write_register(1, 2, write=False), register_writes=[(1, 2)])
+            buffer.append(self.chip._write_register(3, 4, write=False), register_writes=[(3, 4)])
+            assert not self.commands
+            buffer.append(self.chip._write_register(5, 6, write=False), register_writes=[(5, 6)])  # does not fit, first chunk is written
+            assert len(self.commands) == 1
+            assert registers_shadow_subset({1: 2, 3: 4}, self.chip.registers.shadow) and 5 not in self.chip.registers.shadow
+            buffer.append_rows(self.chip._encode_register_writes([7, 8, 9], 10), addresses=[7, 8, 9], data=10)
+        assert [len(chunk) for chunk in buffer.chunks] == [16, 16, 16]  # commands are not split
+        assert all(isinstance(chunk, bytearray) for chunk in buffer.chunks)
+        assert self.commands[2][-6:] == bytearray(encode_cmd(9, 10))
+        assert registers_shadow_subset({1: 2, 3: 4, 5: 6, 7: 10, 8: 10, 9: 10}, self.chip.registers.shadow)
+        assert buffer.chunks[2].register_writes == {8: 10, 9: 10}
+
+        with self.assertRaises(ValueError):
+            buffer.append(self.chip.write_sync(write=False) * 11)
+
+        buffer = CommandBuffer(self.chip, write=False)
+        buffer.append_rows(self.chip._encode_register_writes([1, 3], 0), addresses=[1, 3], data=0)
+        buffer.flush()
+        assert not any(address in self.chip.registers.shadow for address in (1, 3))  # not sent, chip state unknown
+
+    def test_mask_update(self) -> None:
+        masks = self.chip.masks
+        masks['enable'][4:8, 10] = True
+        masks['tdac'][4:8, 10] = [1, 2, 3, 4]
+        masks['injection'][20, 100] = True
+        masks.update()
+        written = get_register_writes(self.commands)
+        assert written == [(17, 1 << 9 | 10), (16, 0x4321), (82 + 1, 0b10000), (114 + 6, 0b10000)]  # only changed pixel and group
+        assert masks._get_pixel_portal_data()[1, 10] == masks.get_pixel_portal_data(1, 10)
+
+        n_commands = len(self.commands)
+        masks.update()
+        assert len(self.commands) == n_commands  # nothing changed
+
+    def test_pipelined_mask_update(self) -> None:
+        masks = self.chip.masks
+        masks['enable'][:64, :] = True
+        masks['injection'][:64, :] = True
+        masks.update(force=True)
+        starts = [addr for call, addr in self.encoder.calls if call == 'start']
+        assert len(starts) > 2 and starts == [2048 * (i % 2) for i in range(len(starts))]  # chunks are sent alternately from both halves
+        # Next chunk is uploaded while the previous chunk is sent
+        assert self.encoder.calls == [call for i in range(len(starts)) for call in (('set_data', 2048 * (i % 2)), ('start', 2048 * (i % 2)))]
+        assert all(len(command) <= 2048 for command in self.commands)
+        assert registers_shadow_subset({82: 0xFFFF, 85: 0xFFFF, 86: 0, 114 + 31: 0xFFFF}, self.chip.registers.shadow)
+
+        n_calls = len(self.encoder.calls)
+        self.chip.registers.write_values({'VL': 20, 'VH': 100})
+        assert self.encoder.calls[n_calls:] == [('set_data', 0), ('start', 0)]
+
+    def test_pipelined_commands(self) -> None:
+        encoder = CommandEncoder()
+        daq = mock.MagicMock()
+        daq.__getitem__.return_value = encoder
+        chip = TJMonoPix2(daq, config={'registers': {}})
+        assert chip.get_cmd_chunk_size() == 2048
+
+        chunks = [chip.write_sync(write=False) * n for n in (1000, 1024, 10, 500)]
+        chip.write_command(chunks)
+        assert encoder.sent == [bytes(chunk) for chunk in chunks]
+        # Next chunk is written to the other half while the chunk is sent
+        assert encoder.calls == [('set_data', 0), ('start', 0), ('set_data', 2048), ('start', 2048),
+                                 ('set_data', 0), ('start', 0), ('set_data', 2048), ('start', 2048)]
+
+        chip.write_command(chip.write_sync(write=False))
+        assert encoder.calls[-2:] == [('set_data', 0), ('start', 0)]
+
+        chip.pipelined_commands = False
+        chip.write_command([chip.write_sync(write=False) * 1500] * 3)
+        assert encoder.calls[-6:] == [('set_data', 0), ('start', 0)] * 3
+
+
+class CommandEncoder(object):
+    ''' Command encoder of the firmware that sends the command immediately at start '''
+
+    def __init__(self, mem_size=4096):
+        self.mem = bytearray(mem_size)
+        self.start_addr = 0
+        self.size = 0
+        self.calls = []
+        self.sent = []
+
+    def get_mem_size(self):
+        return len(self.mem)
+
+    def has_start_addr(self):
+        return True
+
+    def is_done(self):
+        return True
+
+    def set_data(self, data, addr=0):
+        self.mem[addr:addr + len(data)] = data
+        self.calls.append(('set_data', addr))
+
+    def set_start_addr(self, value):
+        self.start_addr = value
+
+    def set_size(self, value):
+        self.size = value
+
+    def set_repetitions(self, value):
+        pass
+
+    def start(self):
+        self.sent.append(bytes(self.mem[self.start_addr:self.start_addr + self.size]))
+        self.calls.append(('start', self.start_addr))
+
+
+def registers_shadow_subset(values, shadow):
+    return all(shadow[address] == value for address, value in values.items())
+
+
+def get_register_writes(commands):
+    ''' Decode the (address, data) of the register writes in a command stream of register writes and syncs '''
+    symbols = {symbol: value for value, symbol in TJMonoPix2.cmd_data_map.items()}
+    stream, writes, index = np.concatenate([np.frombuffer(bytes(command), dtype=np.uint8) for command in commands]), [], 0
+    while index < len(stream):
+        if stream[index] == TJMonoPix2.CMD_REGISTER:
+            words = [symbols[symbol] for symbol in stream[index + 2:index + 8]]
+            writes.append((words[0] << 5 | words[1], words[2] << 11 | words[3] << 6 | words[4] << 1 | words[5] >> 4))
+            index += 8
+        else:  # sync
+            index += 2
+    return writes
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,10 +10,15 @@ import os
 import shutil
 import time
 import unittest
+from copy import deepcopy
+from unittest import mock
 
+import tables as tb
 import tjmonopix2
 import yaml
 from tjmonopix2.scans.scan_analog import AnalogScan
+from tjmonopix2.system import scan_base
+from tjmonopix2.system.tjmonopix2 import TJMonoPix2
 from tjmonopix2.tests.test_software import utils as sw_utils
 from tjmonopix2.tests.test_software.mock import TJMonopix2Mock
 
@@ -56,6 +61,68 @@ class TestScans(unittest.TestCase):
 
         assert self.check_scan_success(scan_log_messages)
 
+    def test_non_blocking_analysis(self) -> None:
+        class FailingAnalysisScan(AnalogScan):
+            def _analyze(self):
+                raise RuntimeError('Analysis failed')
+
+        bench_config = deepcopy(self.bench_config)
+        bench_config['analysis']['skip'] = False
+        bench_config['analysis']['blocking'] = False
+
+        with FailingAnalysisScan(scan_config=scan_configuration, bench_config=bench_config) as scan:
+            scan.start()
+            scan.wait_for_analysis()
+
+            assert len(scan.ana_jobs) == 1
+            assert 'Analysis failed' in scan.errors_occured
+
+    def test_profiling(self) -> None:
+        bench_config = deepcopy(self.bench_config)
+        bench_config['general']['profiling'] = True
+        bench_config['general']['profile_stage'] = 'configure'
+
+        with AnalogScan(scan_config=scan_configuration, bench_config=bench_config) as scan:
+            scan.start()
+            output_filename = scan.output_filename
+            profiler = scan.profiler
+
+        with tb.open_file(output_filename + '.h5') as in_file:
+            stages = set(s.decode() for s in in_file.root.profiling[:]['stage'])
+        assert {'init', 'configure/configure_masks', 'scan/scan_chip', 'scan/scan_chip/readout', 'scan/scan_chip/readout/readout_stop'} <= stages
+        assert 'scan/scan_chip/readout/write_command' in stages  # time of frequent calls is added up in the enclosing stage
+        assert len(profiler.captured_files) == 1 and os.path.isfile(profiler.captured_files[0])
+
+    def test_scan_session(self) -> None:
+        scan_logger = logging.getLogger(AnalogScan.__name__)
+        scan_log_handler = sw_utils.MockLoggingHandler(level='DEBUG')
+        scan_logger.addHandler(scan_log_handler)
+
+        with mock.patch.object(TJMonoPix2, 'reset', autospec=True, side_effect=TJMonoPix2.reset) as reset, \
+                mock.patch.object(TJMonoPix2, 'update_configuration', autospec=True, side_effect=TJMonoPix2.update_configuration) as update_configuration:
+            with scan_base.ScanSession(bench_config=self.bench_config) as session:
+                scans = [session.run(AnalogScan, scan_config=scan_configuration, suffix='_%d' % i) for i in range(3)]
+                daq, chips = session.daq, list(session.chips.values())
+            assert session.daq is None and not session.chips  # hardware is released with the session
+
+        assert all(scan.daq is daq for scan in scans)
+        assert len(chips) == 1
+        assert reset.call_count == 1  # full register and mask write by the first scan only
+        assert update_configuration.call_count == 2
+        assert self.check_scan_success(scan_log_handler.messages)
+
+    def test_scan_session_analysis(self) -> None:
+        bench_config = deepcopy(self.bench_config)
+        bench_config['analysis']['skip'] = False
+
+        with mock.patch.object(AnalogScan, '_analyze', autospec=True) as analyze:  # the analysis of the mocked data fails
+            with scan_base.ScanSession(bench_config=bench_config) as session:
+                for i in range(2):
+                    session.run(AnalogScan, scan_config=scan_configuration, suffix='_%d' % i)
+                assert analyze.call_count == 2  # once per scan
+                session.run(AnalogScan, scan_config=scan_configuration, suffix='_2', analyze=False)
+                assert analyze.call_count == 2
+
     def check_scan_success(self, scan_log_messages: dict) -> bool:
         """ Check the log output if scan was successfull """
         if scan_log_messages['error']:
@@ -0,0 +1,54 @@
+#
+# ------------------------------------------------------------
+# Copyright (c) All rights reserved
+# SiLab, Institute of Physics, University of Bonn
+# ------------------------------------------------------------
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import tables as tb
+
+from tjmonopix2 import utils
+from tjmonopix2.tests.test_software import utils as sw_utils
+
+
+class TestUtils(unittest.TestCase):
+    """ Recompression of data files, with synthetic scan files as input """
+
+    def setUp(self) -> None:
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self) -> None:
+        shutil.rmtree(self.output_dir)
+
+    def analyze(self, analysis_kwargs={}, **kwargs):
+        return sw_utils.analyze_synthetic_scan(self.output_dir, analysis_kwargs, **kwargs)
+
+    def test_recompress(self) -> None:
+        ''' Recompressed files have the same data, the filters of their kind of data and keep the column indexes '''
+        with self.analyze(analysis_kwargs={'cluster_hits': True}, kind='source') as in_file:
+            interpreted_file = in_file.filename
+        raw_data_file = os.path.join(self.output_dir, 'scan.h5')
+        for filename in (raw_data_file, interpreted_file):
+            out_filename = filename[:-3] + '_archive.h5'
+            utils.recompress_h5_file(filename, out_filename=out_filename, profile='balanced', chunk_size=30000)
+            with tb.open_file(filename) as in_file, tb.open_file(out_filename) as out_file:
+                assert utils._verify_h5_files(in_file, out_file, chunk_size=30000)
+        with tb.open_file(raw_data_file[:-3] + '_archive.h5') as out_file:
+            assert out_file.root.raw_data.filters.complib == 'blosc' and out_file.root.meta_data.filters.complib == 'zlib'
+        with tb.open_file(out_filename) as out_file:
+            assert out_file.root.Cluster.filters.complib == 'blosc'  # analysis filters for all nodes of analyzed data files
+            assert out_file.root.Cluster.cols.event_number.is_indexed
+
+        with tb.open_file(out_filename, 'a') as out_file:
+            out_file.root.Cluster.modify_column(start=0, stop=1, column=[1000], colname='size')
+        with tb.open_file(interpreted_file) as in_file, tb.open_file(out_filename) as out_file:
+            assert not utils._verify_h5_files(in_file, out_file, chunk_size=30000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -6,6 +6,26 @@
 #
 
 import logging
+import os
+
+import numpy as np
+import tables as tb
+
+from tjmonopix2.analysis import raw_data_generator
+from tjmonopix2.analysis.analysis import Analysis
+
+
+def analyze_synthetic_scan(output_dir, analysis_kwargs={}, **kwargs):
+    ''' Write and analyze a small synthetic scan file (see raw_data_generator.write_scan_file), returns the opened analyzed file '''
+    raw_data_file = os.path.join(output_dir, 'scan.h5')
+    n_words = raw_data_generator.write_scan_file(raw_data_file, n_words=200000, block_words=2 ** 14, n_blocks=3, readout_words=10000, **kwargs)
+    with Analysis(raw_data_file=raw_data_file, build_events=kwargs.get('kind') == 'triggered', chunk_size=50000, **analysis_kwargs) as a:
+        a.analyze_data()
+    with tb.open_file(raw_data_file) as in_file:
+        assert in_file.root.raw_data.nrows == n_words >= 200000
+        assert np.all(in_file.root.meta_data[:]['data_length'] <= 10000)
+        assert in_file.root.scan_param_ranges[0]['index_stop'] == n_words
+    return tb.open_file(a.analyzed_data_file)
 
 
 class MockLoggingHandler(logging.Handler):
@@ -5,16 +5,39 @@
 # ------------------------------------------------------------
 #
 
+import json
 import os
-import pkg_resources
 import collections
+import multiprocessing as mp
 
 from copy import deepcopy
+from importlib.metadata import version
 
+import numpy as np
 import tables as tb
 
+from tjmonopix2.system import logger
 
-VERSION = pkg_resources.get_distribution("tjmonopix2").version
+
+VERSION = version("tjmonopix2")  # importlib.metadata is much faster to import than pkg_resources
+
+# Compression settings of h5 nodes per profile and node kind:
+# raw_data: raw data and configuration arrays, tables: meta data and other tables written during the scan,
+# analysis: all nodes of analyzed data files
+COMPRESSION_PROFILES = {
+    'balanced': {'raw_data': dict(complib='blosc', complevel=5),
+                 'tables': dict(complib='zlib', complevel=5),
+                 'analysis': dict(complib='blosc', complevel=5)},
+    'fast-write': {'raw_data': dict(complib='blosc:lz4', complevel=1, shuffle=True),
+                   'tables': dict(complib='blosc:lz4', complevel=1, shuffle=True),
+                   'analysis': dict(complib='blosc:lz4', complevel=1, shuffle=True)},
+    'archive': {'raw_data': dict(complib='blosc:zstd', complevel=5, shuffle=True),
+                'tables': dict(complib='blosc:zstd', complevel=5, shuffle=True),
+                'analysis': dict(complib='blosc:zstd', complevel=5, shuffle=True)},
+    'uncompressed': {'raw_data': dict(complevel=0),
+                     'tables': dict(complevel=0),
+                     'analysis': dict(complevel=0)},
+}
 
 
 def recursive_update(first, second={}):
@@ -133,6 +156,49 @@ def get_latest_config_node_from_files(directory):
             f.close()
 
 
+def get_filters(kind='raw_data', profile=None):
+    ''' Return the tables.Filters of a node kind ('raw_data', 'tables', 'analysis') for a compression profile
+
+        profile: name of profile in COMPRESSION_PROFILES, default is 'balanced'
+    '''
+    if profile is None:
+        profile = 'balanced'
+    try:
+        settings = COMPRESSION_PROFILES[profile][kind]
+    except KeyError:
+        raise ValueError('Unknown compression profile %s or node kind %s. Profiles: %s' % (profile, kind, ', '.join(COMPRESSION_PROFILES.keys())))
+    return tb.Filters(fletcher32=False, **settings)
+
+
+def encode_multipart(data, meta):
+    ''' Encode a numpy array and its meta data as ZeroMQ multipart message without copying the array.
+
+        Returns the frames [meta data (json), data buffer], see decode_multipart()
+    '''
+    meta = dict(meta)
+    meta['data_meta'] = {'dtype': data.dtype.str, 'shape': data.shape}
+    return [json.dumps(meta).encode(), np.ascontiguousarray(data)]
+
+
+def decode_multipart(frames):
+    ''' Inverse of encode_multipart(), returns data and meta data like online_monitor simple_dec '''
+    meta = json.loads(bytes(frames[0]))
+    data_meta = meta['data_meta']
+    data = np.frombuffer(frames[1], dtype=np.dtype(data_meta['dtype'])).reshape(data_meta['shape'])
+    return data, meta
+
+
+def get_available_memory():
+    ''' Return the available physical memory in bytes.
+
+        Returns None if the platform does not allow to determine it.
+    '''
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):  # e.g. Windows
+        return None
+
+
 def get_software_version():
     return VERSION
 
@@ -150,3 +216,141 @@ def get_latest_h5file(directory, scan_pattern=('scan', 'tuning', 'calibration'),
 
 def get_latest_chip_configuration_file(directory, file_timestamps=False):
     return get_latest_file(directory=directory, condition=lambda file: (file.split('.')[-1] == 'yaml' and file.split('.')[-2] == 'cfg'), file_timestamps=file_timestamps)
+
+
+def _recompress_node(node, parent, profile, chunkshape=None, analysis=False):
+    ''' Copy node recursively to parent with the filters of the compression profile.
+        Nodes of analyzed data files (analysis=True) get the analysis filters like a new analysis would write them.
+        Leaves are copied in buffers and do not need to fit into memory.
+    '''
+    if isinstance(node, tb.Group):
+        group = parent._v_file.create_group(parent, node._v_name, title=node._v_title)
+        node._v_attrs._f_copy(group)
+        for child in node._f_iter_nodes():
+            _recompress_node(child, group, profile, chunkshape, analysis)
+        return
+    if analysis:
+        kind = 'analysis'
+    else:
+        kind = 'tables' if isinstance(node, tb.Table) else 'raw_data'
+    kwargs = {'propindexes': True} if isinstance(node, tb.Table) else {}  # keep column indexes, e.g. of the cluster table
+    if chunkshape and node._v_pathname == '/raw_data':
+        kwargs['chunkshape'] = chunkshape
+    node.copy(newparent=parent, filters=get_filters(kind, profile), **kwargs)
+
+
+def _verify_h5_files(first_file, second_file, chunk_size=10000000):
+    ''' Return True if both files have the same nodes with identical data, compared chunk wise '''
+    for leaf in first_file.walk_nodes('/', classname='Leaf'):
+        try:
+            other = second_file.get_node(leaf._v_pathname)
+        except tb.NoSuchNodeError:
+            return False
+        if leaf.shape != other.shape or leaf.dtype != other.dtype:
+            return False
+        if leaf.shape == ():
+            if not np.array_equal(leaf.read(), other.read()):
+                return False
+            continue
+        for start in range(0, leaf.nrows, chunk_size):
+            if not np.array_equal(leaf.read(start, start + chunk_size), other.read(start, start + chunk_size)):
+                return False
+    return True
+
+
+def recompress_h5_file(filename, out_filename=None, profile='archive', chunkshape=None, chunk_size=10000000):
+    '''
+        Rewrite all nodes of a h5 file (raw data, meta data and configuration) with the filters
+        of a compression profile and verify that the data is unchanged.
+
+        Parameters:
+        ----------
+        filename : string
+                Input h5 file
+        out_filename : string
+                Output h5 file. If not defined the input file is replaced after successful verification.
+        profile : string
+                Compression profile, see COMPRESSION_PROFILES
+        chunkshape : tuple
+                Chunkshape of the raw data array. If not defined PyTables chooses one.
+        chunk_size : int
+                Number of rows compared at once during verification
+
+        Returns:
+        ----------
+        Size of the input and the output file in bytes
+    '''
+    log = logger.setup_derived_logger('Recompress')
+    tmp_filename = (out_filename if out_filename else filename) + '.tmp'
+    in_size = os.path.getsize(filename)
+
+    try:
+        with tb.open_file(filename, 'r') as in_file:
+            analysis = '/raw_data' not in in_file  # analyzed data file, e.g. _interpreted.h5
+            with tb.open_file(tmp_filename, 'w', title=in_file.title) as out_file:
+                in_file.root._v_attrs._f_copy(out_file.root)
+                for node in in_file.root._f_iter_nodes():
+                    _recompress_node(node, out_file.root, profile, chunkshape, analysis)
+            with tb.open_file(tmp_filename, 'r') as out_file:
+                if not _verify_h5_files(in_file, out_file, chunk_size):
+                    raise RuntimeError('Verification of recompressed file %s failed' % filename)
+    except Exception:
+        if os.path.isfile(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+    os.replace(tmp_filename, out_filename if out_filename else filename)
+    out_size = os.path.getsize(out_filename if out_filename else filename)
+    log.info('Recompressed %s with profile %s: %1.1f MB -> %1.1f MB', os.path.basename(filename), profile, in_size / 1e6, out_size / 1e6)
+    return in_size, out_size
+
+
+def _recompress_h5_file_job(kwargs):
+    try:
+        return kwargs['filename'], recompress_h5_file(**kwargs)
+    except Exception as e:
+        logger.setup_derived_logger('Recompress').error('Recompression of %s failed: %s', kwargs['filename'], e)
+        return kwargs['filename'], None
+
+
+def recompress_directory(directory, profile='archive', chunkshape=None, n_processes=None, condition=lambda file: file.lower().endswith('.h5')):
+    '''
+        Recompress all h5 files in a directory in place using parallel processes, see recompress_h5_file.
+
+        Returns:
+        ----------
+        Dict with file name and (input size, output size) in bytes, None for failed files
+    '''
+    files = [os.path.join(directory, f) for f in os.listdir(directory) if os.path.isfile(os.path.join(directory, f))]
+    jobs = [dict(filename=f, profile=profile, chunkshape=chunkshape) for f in sorted(filter(condition, files))]
+
+    with mp.Pool(n_processes) as pool:
+        results = dict(pool.imap_unordered(_recompress_h5_file_job, jobs))
+
+    return results
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Recompress h5 files with a compression profile, the data is verified before the input file is replaced')
+    parser.add_argument('path', help='h5 file or directory with h5 files')
+    parser.add_argument('-o', '--output', default=None, help='Output file name, only for single files. If not given the input file is replaced')
+    parser.add_argument('--profile', default='archive', choices=sorted(COMPRESSION_PROFILES.keys()))
+    parser.add_argument('--chunkshape', type=int, default=None, help='Chunk length of the raw data array')
+    parser.add_argument('--n_processes', type=int, default=None, help='Number of parallel processes for directories')
+    args = parser.parse_args()
+
+    chunkshape = (args.chunkshape, ) if args.chunkshape else None
+    if os.path.isdir(args.path):
+        if args.output:
+            raise ValueError('An output file name cannot be used for a directory')
+        results = recompress_directory(args.path, profile=args.profile, chunkshape=chunkshape, n_processes=args.n_processes)
+    else:
+        results = {args.path: recompress_h5_file(args.path, out_filename=args.output, profile=args.profile, chunkshape=chunkshape)}
+    failed = sorted(filename for filename, sizes in results.items() if sizes is None)
+    in_size = sum(sizes[0] for sizes in results.values() if sizes)
+    out_size = sum(sizes[1] for sizes in results.values() if sizes)
+    print('Recompressed %d files: %1.1f MB -> %1.1f MB' % (len(results) - len(failed), in_size / 1e6, out_size / 1e6))
+    if failed:
+        raise RuntimeError('Recompression failed for %s' % ', '.join(failed))